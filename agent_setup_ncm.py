@@ -3,21 +3,32 @@ from langchain.agents import AgentType
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import BaseModel, Field
 import streamlit as st
+import pandas as pd
+import json
 import os
+import uuid
+from typing import Optional, Type
+from dataset_profile import formatar_perfil_para_prompt, perfilar_dataset
+from ncm_reference import get_ncm_reference
+from openai_limiter import get_http_client
+from sandbox_pool import get_sandbox_pool
+from startup_profile import lazy_import
 
 PROMPT_TEMPLATE = """
 Você é um agente especialista em Conformidade Fiscal de Notas Fiscais com foco em validação de NCM (Nomenclatura Comum do Mercosul) para o setor pet (clínicas veterinárias, pet shops e similares).
 
 Analise o DataFrame Pandas 'df' que contém dados de notas fiscais. Suas principais responsabilidades:
 
-1. IDENTIFICAÇÃO DE DADOS - SEMPRE FAÇA ISSO PRIMEIRO:
-   - CRÍTICO: Use df.columns.tolist() para ver TODAS as colunas disponíveis
-   - Identifique colunas exatas (case-sensitive) relacionadas a:
-     * NCM: procure por 'NCM', 'CODIGO_NCM', 'NCM/SH', 'Codigo NCM' etc
-     * Descrição: procure por 'DESCRICAO_PRODUTO', 'DESCRICAO', 'PRODUTO', 'DESC_PRODUTO' etc
-     * Valores, CFOP, impostos
-   - SEMPRE use os nomes EXATOS das colunas como aparecem em df.columns
+1. DADOS DO ARQUIVO - JÁ IDENTIFICADOS:
+   - O perfil abaixo já traz as colunas, os nomes EXATOS das colunas de NCM/descrição/valor,
+     as contagens por NCM e exemplos de produtos. NÃO gaste iterações com df.columns,
+     value_counts ou groupby para redescobrir essas informações.
+   - Quando há coluna NCM, a coluna 'NCM_normalizado' já existe em df.
+
+{perfil_dataset}
 
 2. VALIDAÇÃO DE NCM - REGRAS IMPORTANTES:
    - NCM pode ser string ou inteiro no DataFrame
@@ -60,22 +71,10 @@ Analise o DataFrame Pandas 'df' que contém dados de notas fiscais. Suas princip
 
 5. COMO ANALISAR - EVITE LOOPS E ERROS:
    
-   PASSO A PASSO CORRETO:
+   - Comece direto pela análise dos NCMs do perfil (adequação NCM x descrição)
+   - Se precisar de código, use os nomes de coluna do perfil e a coluna 'NCM_normalizado':
    ```python
-   # 1. SEMPRE comece identificando as colunas
-   colunas = df.columns.tolist()
-   
-   # 2. Encontre a coluna NCM (use o nome exato)
-   ncm_col = [c for c in df.columns if 'ncm' in c.lower()][0]
-   
-   # 3. Encontre coluna descrição (use o nome exato)  
-   desc_col = [c for c in df.columns if 'descri' in c.lower() or 'produto' in c.lower()][0]
-   
-   # 4. Normalize NCMs (converta para string primeiro!)
-   df['NCM_normalizado'] = df[ncm_col].astype(str).str.replace('.', '').str.replace('-', '')
-   
-   # 5. Agrupe e analise
-   ncms_unicos = df.groupby('NCM_normalizado')[desc_col].first()
+   df[df['NCM_normalizado'] == '23099010'][coluna_descricao].unique()[:10]
    ```
    
    NUNCA faça:
@@ -84,7 +83,17 @@ Analise o DataFrame Pandas 'df' que contém dados de notas fiscais. Suas princip
    - Funções complexas com escopo separado
    - Análise de todas as linhas individualmente
 
-6. RELATÓRIOS:
+6. FERRAMENTAS DE NCM - USE ANTES DE ESCREVER CÓDIGO:
+   - validar_ncm(ncm): valida um NCM contra a tabela de referência e mostra como ele aparece no arquivo
+     (ocorrências, exemplos de produtos e NCM sugerido para esses produtos).
+     Para perguntas como "O NCM 23099010 está correto?" UMA chamada desta ferramenta é suficiente.
+   - consultar_ncm(ncm): detalhes de um NCM na tabela de referência
+   - buscar_ncm_por_descricao(descricao): NCMs de referência mais adequados para uma descrição
+   - listar_ncms_categoria(categoria): NCMs de uma categoria (Alimentos, Higiene e Perfumaria, Medicamentos e Produtos Veterinários, Acessórios, Outros)
+   - resumir_ncms_arquivo(limite): resumo de todos os NCMs do arquivo (quantidade, exemplo, formato válido, presença na referência)
+   - Só use código pandas para análises que essas ferramentas não cobrem.
+
+7. RELATÓRIOS:
    - Use markdown para formatar resultados
    - Organize em tabelas quando possível
    - Seja claro e objetivo
@@ -92,8 +101,7 @@ Analise o DataFrame Pandas 'df' que contém dados de notas fiscais. Suas princip
 
 IMPORTANTE: 
 - SEMPRE use str(ncm) antes de qualquer operação de string
-- SEMPRE verifique df.columns.tolist() primeiro
-- Use nomes EXATOS das colunas (case-sensitive)
+- Use nomes EXATOS das colunas informados no perfil (case-sensitive)
 - Agrupe por NCM único ao invés de analisar linha por linha
 - Pare e reporte erros ao invés de retentar infinitamente
 
@@ -102,7 +110,7 @@ Pergunta atual: {input}
 Resposta:
 """
 
-def initialize_llm(api_key: str = None):
+def initialize_llm(api_key: str = None, streaming: bool = False):
     effective_key = api_key or os.getenv('OPENAI_API_KEY')
     if not effective_key:
         st.error("Nenhuma chave API encontrada. Forneça via formulário ou .env.")
@@ -112,29 +120,179 @@ def initialize_llm(api_key: str = None):
         return ChatOpenAI(
             model_name="gpt-4o-mini",
             temperature=0,
-            openai_api_key=effective_key
+            openai_api_key=effective_key,
+            streaming=streaming,  # Tokens entregues aos callbacks à medida que chegam
+            stream_usage=True,  # Uso de tokens também no último chunk do streaming
+            # Cliente compartilhado pelo processo: limite de RPM/TPM, backoff e
+            # união de requisições idênticas. As repetições ficam a cargo dele.
+            http_client=get_http_client(),
+            max_retries=0
         )
     except Exception as e:
         st.error(f"Erro ao inicializar LLM: {str(e)}")
         return None
 
-def create_agent(llm, df):
-    if "memory" not in st.session_state:
-        st.session_state.memory = ConversationBufferMemory(memory_key="history", input_key="input")
+def _to_json(dados) -> str:
+    """Serializa resposta das ferramentas (compacta, mantendo acentos)"""
+    return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+def create_ncm_tools(df: pd.DataFrame, perfil: dict = None) -> list:
+    """Cria ferramentas estruturadas sobre a tabela de referência e o arquivo carregado"""
+    ncm_ref = get_ncm_reference()
+    if perfil is None:
+        perfil = perfilar_dataset(df)
+    desc_col = perfil['colunas_detectadas']['descricao']
+    
+    # Validação por linha e grupos de descrições já calculados no perfil (uma única vez por arquivo)
+    validacao = perfil['validacao']
+    grupos = perfil.get('grupo_descricao')
+    
+    def _sugestoes(descricoes) -> list:
+        engine = lazy_import("ncm_suggestion").get_suggestion_engine()
+        sugestoes = engine.melhor_sugestao(descricoes, similaridade_minima=0.1).reset_index()
+        return sugestoes.to_dict('records')
+    
+    def validar_ncm(ncm: str) -> str:
+        """Valida um NCM contra a referência do setor pet e mostra seu uso no arquivo"""
+        resultado = ncm_ref.validate_ncm(ncm)
+        if validacao is not None:
+            ncm_norm = str(ncm).replace('.', '').replace('-', '').strip()
+            mascara = validacao['NCM_normalizado'] == ncm_norm
+            resultado['ocorrencias_no_arquivo'] = int(mascara.sum())
+            if desc_col and mascara.any():
+                descricoes = df.loc[mascara, desc_col].dropna().astype(str)
+                if grupos is not None:
+                    # Um exemplo por grupo: variantes da mesma descrição não gastam tokens
+                    descricoes = descricoes[~grupos.loc[descricoes.index].duplicated().to_numpy()]
+                exemplos = descricoes.unique()[:5].tolist()
+                resultado['exemplos_no_arquivo'] = exemplos
+                resultado['sugestoes_para_exemplos'] = _sugestoes(exemplos)
+        return _to_json(resultado)
+    
+    def consultar_ncm(ncm: str) -> str:
+        """Retorna categoria, descrição e observações de um NCM da tabela de referência"""
+        return _to_json(ncm_ref.get_ncm_info(ncm) or {'ncm': ncm, 'encontrado': False})
+    
+    def buscar_ncm_por_descricao(descricao: str) -> str:
+        """Busca NCMs de referência por palavra-chave e por similaridade com a descrição"""
+        engine = lazy_import("ncm_suggestion").get_suggestion_engine()
+        return _to_json({
+            'por_palavra_chave': ncm_ref.search_by_description(descricao),
+            'por_similaridade': engine.sugerir([descricao], top_k=3).to_dict('records')
+        })
+    
+    def listar_ncms_categoria(categoria: str) -> str:
+        """Lista os NCMs de referência de uma categoria"""
+        return _to_json(ncm_ref.get_category_ncms(categoria))
+    
+    def resumir_ncms_arquivo(limite: int = 50) -> str:
+        """Resumo dos NCMs do arquivo: quantidade, exemplo de produto, formato e presença na referência"""
+        if validacao is None:
+            return _to_json({'erro': 'Coluna NCM não encontrada', 'colunas': df.columns.tolist()})
+        
+        agregacoes = {
+            'quantidade': ('formato_valido', 'size'),
+            'formato_valido': ('formato_valido', 'first'),
+            'na_referencia': ('na_referencia', 'first'),
+        }
+        base = validacao
+        if desc_col:
+            base = validacao.assign(exemplo=df[desc_col])
+            agregacoes['exemplo'] = ('exemplo', 'first')
+        resumo = base.groupby('NCM_normalizado').agg(**agregacoes).sort_values('quantidade', ascending=False)
+        
+        return _to_json({
+            'total_linhas': len(validacao),
+            'ncms_unicos': len(resumo),
+            'ncms_formato_invalido': int((~resumo['formato_valido']).sum()),
+            'ncms_fora_referencia': int((~resumo['na_referencia']).sum()),
+            'ncms': resumo.head(limite).reset_index().to_dict('records')
+        })
+    
+    return [
+        StructuredTool.from_function(func=validar_ncm),
+        StructuredTool.from_function(func=consultar_ncm),
+        StructuredTool.from_function(func=buscar_ncm_por_descricao),
+        StructuredTool.from_function(func=listar_ncms_categoria),
+        StructuredTool.from_function(func=resumir_ncms_arquivo),
+    ]
+
+
+class PythonInputs(BaseModel):
+    query: str = Field(description="code snippet to run")
+
 
-    prompt = PromptTemplate(input_variables=["history", "input"], template=PROMPT_TEMPLATE)
+class SandboxPythonTool(BaseTool):
+    """python_repl_ast executado nos workers isolados do SandboxPool, não no servidor"""
+    
+    name: str = "python_repl_ast"
+    description: str = (
+        "A Python shell. Use this to execute python commands. "
+        "Input should be a valid python command. "
+        "When using this tool, sometimes output is abbreviated - "
+        "make sure it does not look abbreviated before using it in your answer."
+    )
+    args_schema: Type[BaseModel] = PythonInputs
+    caminho_dataset: str
+    sessao: str
+    
+    def _run(self, query: str, run_manager: Optional[object] = None) -> str:
+        return get_sandbox_pool().executar(query, self.caminho_dataset, self.sessao)
+
+
+def montar_prompt(perfil: dict) -> str:
+    """Prompt do agente com o perfil do arquivo já injetado"""
+    return PROMPT_TEMPLATE.replace("{perfil_dataset}", formatar_perfil_para_prompt(perfil))
+
+
+def create_agent(llm, df, perfil: dict = None, memoria_isolada: bool = False):
+    """
+    Agente pandas com o perfil do arquivo no prompt e o código executado no sandbox
+
+    Args:
+        memoria_isolada: Memória de conversa e sessão do sandbox próprias, em vez das
+            do chat (para o job de validação, que roda em outra thread ao mesmo tempo)
+    """
+    if memoria_isolada:
+        memoria = ConversationBufferMemory(memory_key="history", input_key="input")
+    else:
+        if "memory" not in st.session_state:
+            st.session_state.memory = ConversationBufferMemory(memory_key="history", input_key="input")
+        memoria = st.session_state.memory
+
+    # Perfil calculado uma vez por arquivo: o agente começa pela análise, não pela descoberta
+    if perfil is None:
+        perfil = perfilar_dataset(df)
+    template = montar_prompt(perfil)
+    prompt = PromptTemplate(input_variables=["history", "input"], template=template)
+    
+    # Cópia rasa com a coluna normalizada que o perfil promete ao agente
+    if perfil['validacao'] is not None:
+        df = df.assign(NCM_normalizado=perfil['validacao']['NCM_normalizado'])
     
     agent = create_pandas_dataframe_agent(
         llm=llm,
         df=df,
         verbose=True,
         agent_type=AgentType.OPENAI_FUNCTIONS,
-        memory=st.session_state.memory,
+        memory=memoria,
         prefix=prompt.template,
         allow_dangerous_code=True,
         max_iterations=10,  # Reduzido para 10 iterações
         max_execution_time=45,  # Reduzido para 45 segundos
         handle_parsing_errors=True,  # Lida com erros de parsing
-        number_of_head_rows=5  # Mostra apenas 5 linhas de preview
+        number_of_head_rows=5,  # Mostra apenas 5 linhas de preview
+        extra_tools=create_ncm_tools(df, perfil)  # Consultas à referência sem gerar código
     )
+    
+    # O código gerado pelo modelo roda nos workers isolados: o DataFrame é publicado
+    # uma vez por arquivo e cada sessão fica presa ao mesmo worker
+    sessao = uuid.uuid4().hex if memoria_isolada else st.session_state.setdefault("sandbox_sessao", uuid.uuid4().hex)
+    caminho_dataset = get_sandbox_pool().publicar_dataset(df, perfil['fingerprint'])
+    agent.tools = [
+        SandboxPythonTool(caminho_dataset=caminho_dataset, sessao=sessao)
+        if tool.name == "python_repl_ast" else tool
+        for tool in agent.tools
+    ]
     return agent
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+Execução do agente com streaming de passos intermediários e tokens para a interface
+"""
+import threading
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class ExecucaoCancelada(Exception):
+    """Levantada quando o usuário cancela uma execução em andamento"""
+
+
+class StreamlitAgentCallback(BaseCallbackHandler):
+    """
+    Escreve passos e tokens do agente em um container do Streamlit à medida que chegam
+
+    Cada atualização da interface também é o ponto em que o Streamlit interrompe
+    o script quando o usuário clica em "Cancelar": a exceção de controle do
+    Streamlit atravessa o agente e fecha a requisição de streaming em andamento.
+    """
+
+    # Exceções levantadas aqui devem interromper o agente, não ser só registradas
+    raise_error = True
+
+    def __init__(self, container, cancel_event: Optional[threading.Event] = None):
+        self.cancel_event = cancel_event
+        self.passos = container.container()
+        self.resposta = container.empty()
+        self.tokens: List[str] = []
+
+    def _verificar_cancelamento(self) -> None:
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExecucaoCancelada("Execução cancelada pelo usuário")
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        self.tokens = []
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        self.tokens = []
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        if token:
+            self.tokens.append(token)
+            self.resposta.markdown("".join(self.tokens) + "▌")
+
+    def on_agent_action(self, action: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        entrada = str(action.tool_input)
+        if len(entrada) > 300:
+            entrada = entrada[:297] + "..."
+        self.passos.markdown(f"🔧 **{action.tool}**")
+        self.passos.code(entrada)
+        # Tokens anteriores à ação não fazem parte da resposta final
+        self.tokens = []
+        self.resposta.empty()
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        saida = str(output)
+        self.passos.caption(saida[:500] + ("..." if len(saida) > 500 else ""))
+
+    def finalizar(self, resposta: str) -> None:
+        """Substitui o texto parcial pela resposta final completa"""
+        self.resposta.markdown(resposta)
+
+
+class JobAgentCallback(BaseCallbackHandler):
+    """
+    Registra passos e tokens do agente no Job de segundo plano
+
+    Roda na thread do job: não chama funções do Streamlit, apenas atualiza o
+    Job, que a página consulta periodicamente.
+    """
+
+    raise_error = True
+
+    def __init__(self, job, max_passos: int, progresso_inicial: float, progresso_final: float):
+        self.job = job
+        self.max_passos = max_passos
+        self.progresso_inicial = progresso_inicial
+        self.progresso_final = progresso_final
+        self.tokens: List[str] = []
+
+    def _verificar_cancelamento(self) -> None:
+        if self.job.cancel_event.is_set():
+            raise ExecucaoCancelada("Execução cancelada pelo usuário")
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        self.tokens = []
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        self.tokens = []
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        if token:
+            self.tokens.append(token)
+            self.job.atualizar(texto_parcial="".join(self.tokens))
+
+    def on_agent_action(self, action: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+        self.job.adicionar_passo(str(action.tool))
+        fracao = min(len(self.job.passos) / self.max_passos, 1.0)
+        self.job.atualizar(
+            texto_parcial="",
+            progresso=self.progresso_inicial + fracao * (self.progresso_final - self.progresso_inicial),
+        )
+        self.tokens = []
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self._verificar_cancelamento()
+
+
+def executar_com_streaming(
+    agent,
+    query: str,
+    container,
+    cancel_event: Optional[threading.Event] = None,
+    callbacks: Optional[List[BaseCallbackHandler]] = None
+) -> str:
+    """
+    Executa o agente exibindo passos intermediários e tokens da resposta final
+
+    Args:
+        agent: AgentExecutor criado por create_agent
+        query: Pergunta ou instrução para o agente
+        container: Container do Streamlit onde o progresso é exibido
+        cancel_event: Evento que, quando marcado, interrompe a execução
+        callbacks: Callbacks adicionais (ex.: medidor de tokens)
+
+    Returns:
+        Resposta final do agente
+    """
+    handler = StreamlitAgentCallback(container, cancel_event)
+    resposta = agent.run(query, callbacks=[handler] + list(callbacks or []))
+    handler.finalizar(resposta)
+    return resposta
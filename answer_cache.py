@@ -0,0 +1,148 @@
+"""
+Cache local de respostas do chat por similaridade da pergunta (sem serviço de embeddings)
+"""
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import FrozenSet, Optional, Tuple
+
+from memory_cache import CacheLRU
+
+# Palavras sem conteúdo para a pergunta ("mostre os NCMs" ~ "mostre NCMs")
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'do', 'da', 'dos', 'das', 'em', 'no', 'na',
+    'nos', 'nas', 'para', 'pra', 'e', 'ou', 'que', 'qual', 'quais', 'me', 'se', 'eu', 'voce', 'ao', 'aos',
+    'esta', 'estao', 'este', 'esse', 'essa', 'isso', 'isto', 'sao', 'ser', 'foi', 'ha', 'tem', 'temos', 'ja',
+    'todos', 'todas', 'favor',
+    'poderia', 'pode', 'mostre', 'mostrar', 'liste', 'listar', 'exiba', 'exibir', 'diga', 'informe',
+    'arquivo', 'dados', 'planilha',
+}
+
+# Palavras que invertem ou restringem o sentido ("com problema" x "sem problema",
+# "mais caros" x "menos caros"); ficam fora das stopwords e do corte do plural
+TERMOS_SENTIDO = {
+    'nao', 'sem', 'com', 'nenhum', 'nenhuma', 'nunca', 'exceto', 'excluindo', 'salvo', 'fora',
+    'mais', 'menos', 'maior', 'maiores', 'menor', 'menores', 'por', 'pelo', 'pela', 'pelos', 'pelas',
+}
+
+TAMANHO_NGRAMA = 3
+
+
+def normalizar_pergunta(pergunta: str) -> str:
+    """Minúsculas, sem acentos, sem pontuação, sem stopwords e sem o "s" do plural"""
+    texto = unicodedata.normalize('NFKD', pergunta).encode('ascii', 'ignore').decode('ascii').lower()
+    # Pontos e hífens de códigos ("2309.10.00") não separam os dígitos
+    texto = re.sub(r'(?<=\d)[.\-/](?=\d)', '', texto)
+    tokens = re.findall(r'[a-z0-9]+', texto)
+    tokens = [t for t in tokens if t not in STOPWORDS]
+    return ' '.join(
+        t[:-1] if len(t) > 3 and t.endswith('s') and not t.isdigit() and t not in TERMOS_SENTIDO else t
+        for t in tokens
+    )
+
+
+def ngramas(texto: str, n: int = TAMANHO_NGRAMA) -> FrozenSet[str]:
+    """N-gramas de caracteres de cada palavra (com bordas), robustos a plurais e erros de digitação"""
+    resultado = set()
+    for palavra in texto.split():
+        palavra = f' {palavra} '
+        resultado.update(palavra[i:i + n] for i in range(max(len(palavra) - n + 1, 1)))
+    return frozenset(resultado)
+
+
+def numeros(texto: str) -> FrozenSet[str]:
+    """Números da pergunta: NCMs e quantidades diferentes nunca compartilham resposta"""
+    return frozenset(re.findall(r'\d+', texto))
+
+
+def termos_sentido(texto: str) -> FrozenSet[str]:
+    """Termos de negação/exclusão/comparação: perguntas que diferem neles nunca compartilham resposta"""
+    return frozenset(t for t in texto.split() if t in TERMOS_SENTIDO)
+
+
+def similaridade(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Índice de Jaccard"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class RespostaCacheada:
+    pergunta: str
+    resposta: str
+    similaridade: float
+    idade_segundos: float
+
+
+@dataclass
+class _Entrada:
+    pergunta: str
+    normalizada: str
+    ngramas: FrozenSet[str]
+    numeros: FrozenSet[str]
+    termos: FrozenSet[str]
+    resposta: str
+    criada_em: float
+
+
+class CacheRespostas(CacheLRU):
+    """
+    Respostas do agente por (fingerprint do arquivo, pergunta normalizada)
+
+    Args:
+        limiar: Similaridade mínima de n-gramas para reaproveitar uma resposta
+        ttl_segundos: Validade de cada resposta
+        max_itens: Total de respostas guardadas (as menos usadas saem primeiro)
+    """
+
+    def __init__(self, limiar: float = 0.8, ttl_segundos: float = 3600, max_itens: int = 500):
+        super().__init__(max_itens)
+        self.limiar = limiar
+        self.ttl_segundos = ttl_segundos
+
+    def _remover_expiradas(self, agora: float) -> None:
+        for chave in [k for k, e in self._itens.items() if agora - e.criada_em > self.ttl_segundos]:
+            del self._itens[chave]
+
+    def buscar(self, fingerprint: str, pergunta: str) -> Optional[RespostaCacheada]:
+        """Resposta de uma pergunta igual ou semelhante sobre o mesmo arquivo, se houver"""
+        normalizada = normalizar_pergunta(pergunta)
+        agora = time.time()
+        with self._lock:
+            self._remover_expiradas(agora)
+
+            melhor: Optional[Tuple[float, Tuple[str, str]]] = None
+            if (fingerprint, normalizada) in self._itens:
+                melhor = (1.0, (fingerprint, normalizada))
+            else:
+                alvo_ngramas, alvo_numeros = ngramas(normalizada), numeros(normalizada)
+                alvo_termos = termos_sentido(normalizada)
+                for chave, entrada in self._itens.items():
+                    if chave[0] != fingerprint or entrada.numeros != alvo_numeros or entrada.termos != alvo_termos:
+                        continue
+                    valor = similaridade(alvo_ngramas, entrada.ngramas)
+                    if valor >= self.limiar and (melhor is None or valor > melhor[0]):
+                        melhor = (valor, chave)
+
+            if melhor is None:
+                self.falhas += 1
+                return None
+            self._marcar_uso(melhor[1])
+            entrada = self._itens[melhor[1]]
+            return RespostaCacheada(entrada.pergunta, entrada.resposta, melhor[0], agora - entrada.criada_em)
+
+    def guardar(self, fingerprint: str, pergunta: str, resposta: str) -> None:
+        normalizada = normalizar_pergunta(pergunta)
+        super().guardar((fingerprint, normalizada), _Entrada(
+            pergunta, normalizada, ngramas(normalizada), numeros(normalizada), termos_sentido(normalizada),
+            resposta, time.time()
+        ))
+
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> CacheRespostas:
+    """Cache do processo, compartilhado pelas sessões que analisam o mesmo arquivo"""
+    return CacheRespostas()
@@ -0,0 +1,140 @@
+"""
+Execução de validações em segundo plano, com progresso consultável pela interface
+"""
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+# Status possíveis de um job
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+CANCELADO = "cancelado"
+
+
+@dataclass
+class Job:
+    """Estado de uma execução em segundo plano (atualizado pelo worker, lido pela interface)"""
+    id: str
+    descricao: str
+    status: str = PENDENTE
+    etapa: str = ""
+    progresso: float = 0.0  # 0.0 a 1.0
+    linhas_processadas: int = 0
+    total_linhas: int = 0
+    lotes_concluidos: int = 0
+    total_lotes: int = 0
+    passos: List[str] = field(default_factory=list)
+    texto_parcial: str = ""
+    uso_llm: Optional[Dict[str, Any]] = None  # Tokens e custo acumulados das chamadas ao modelo
+    resultado: Any = None
+    erro: Optional[str] = None
+    criado_em: float = field(default_factory=time.time)
+    iniciado_em: Optional[float] = None
+    finalizado_em: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def atualizar(self, **campos) -> None:
+        """Atualiza campos de progresso de forma atômica"""
+        with self._lock:
+            for nome, valor in campos.items():
+                setattr(self, nome, valor)
+
+    def adicionar_passo(self, passo: str) -> None:
+        with self._lock:
+            self.passos.append(passo)
+
+    @property
+    def ativo(self) -> bool:
+        return self.status in (PENDENTE, EXECUTANDO)
+
+    @property
+    def tempo_decorrido(self) -> float:
+        if self.iniciado_em is None:
+            return 0.0
+        return (self.finalizado_em or time.time()) - self.iniciado_em
+
+    @property
+    def eta_segundos(self) -> Optional[float]:
+        """Estimativa de tempo restante a partir do progresso já feito"""
+        if not self.ativo or self.progresso <= 0.02:
+            return None
+        return self.tempo_decorrido / self.progresso * (1 - self.progresso)
+
+
+class JobManager:
+    """Pool de threads por processo que executa jobs e guarda seu estado"""
+
+    def __init__(self, max_workers: int = 4, retencao_segundos: int = 3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="validacao")
+        self.retencao_segundos = retencao_segundos
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, descricao: str, funcao: Callable[..., Any], *args, **kwargs) -> Job:
+        """
+        Agenda `funcao(job, *args, **kwargs)` em segundo plano
+
+        A função recebe o próprio Job para reportar progresso e deve
+        verificar `job.cancel_event` entre etapas.
+        """
+        self._limpar_antigos()
+        job = Job(id=uuid.uuid4().hex, descricao=descricao)
+        with self._lock:
+            self._jobs[job.id] = job
+        self.executor.submit(self._executar, job, funcao, args, kwargs)
+        return job
+
+    def _executar(self, job: Job, funcao: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        job.atualizar(status=EXECUTANDO, iniciado_em=time.time())
+        try:
+            resultado = funcao(job, *args, **kwargs)
+            if job.cancel_event.is_set():
+                job.atualizar(status=CANCELADO)
+            else:
+                job.atualizar(status=CONCLUIDO, resultado=resultado, progresso=1.0)
+        except Exception as e:
+            if job.cancel_event.is_set():
+                job.atualizar(status=CANCELADO)
+            else:
+                job.atualizar(status=ERRO, erro=f"{e}\n\n{traceback.format_exc()}")
+        finally:
+            job.atualizar(finalizado_em=time.time())
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if job_id is None:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancelar(self, job_id: str) -> None:
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+
+    def ativos(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.ativo)
+
+    def _limpar_antigos(self) -> None:
+        """Descarta jobs finalizados há mais tempo que a retenção"""
+        limite = time.time() - self.retencao_segundos
+        with self._lock:
+            for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if not job.ativo and (job.finalizado_em or job.criado_em) < limite
+            ]:
+                del self._jobs[job_id]
+
+
+@lru_cache(maxsize=1)
+def get_job_manager() -> JobManager:
+    """Retorna o gerenciador de jobs do processo (compartilhado entre sessões)"""
+    return JobManager()
@@ -0,0 +1,86 @@
+"""
+Gráficos de NCM a partir do perfil pré-agregado, com cache das imagens renderizadas
+"""
+import io
+from functools import lru_cache
+from typing import Dict, Optional
+
+import pandas as pd
+
+from memory_cache import CacheLRU
+from startup_profile import lazy_import
+
+# Tipo de gráfico -> (coluna do resumo por NCM, título, rótulo do eixo Y, cor)
+TIPOS_GRAFICO = {
+    'distribuicao': ('quantidade', 'Top {n} NCMs Mais Frequentes', 'Quantidade', 'steelblue'),
+    'valor': ('valor_total', 'Top {n} NCMs por Valor Total', 'Valor Total (R$)', 'green'),
+}
+
+
+def agregar_para_grafico(perfil: Dict, tipo: str, top_n: int = 10) -> Optional[pd.Series]:
+    """Série NCM -> valor já agregada no perfil (sem reprocessar o DataFrame)"""
+    coluna = TIPOS_GRAFICO[tipo][0]
+    resumo = perfil.get('resumo_ncms')
+    if resumo is None or coluna not in resumo.columns:
+        return None
+    return pd.to_numeric(resumo[coluna], errors='coerce').nlargest(top_n)
+
+
+def renderizar_grafico(serie: pd.Series, titulo: str, ylabel: str, cor: str, formato: str = 'png') -> bytes:
+    """
+    Desenha um gráfico de barras e devolve a imagem em bytes
+
+    Usa Figure diretamente (sem o estado global do pyplot), então nenhuma
+    figura fica registrada depois da renderização.
+    """
+    Figure = lazy_import("matplotlib.figure").Figure
+    fig = Figure(figsize=(10, 6))
+    try:
+        ax = fig.subplots()
+        ax.bar(serie.index.astype(str), serie.to_numpy(), color=cor)
+        ax.set_title(titulo)
+        ax.set_xlabel('NCM')
+        ax.set_ylabel(ylabel)
+        ax.tick_params(axis='x', labelrotation=45)
+        for rotulo in ax.get_xticklabels():
+            rotulo.set_horizontalalignment('right')
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=formato)
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+class CacheGraficos(CacheLRU):
+    """LRU de imagens por (fingerprint, tipo, top-N, formato)"""
+
+    def __init__(self, max_itens: int = 64):
+        super().__init__(max_itens)
+
+
+@lru_cache(maxsize=1)
+def get_chart_cache() -> CacheGraficos:
+    return CacheGraficos()
+
+
+def grafico_ncm(perfil: Dict, tipo: str, top_n: int = 10, formato: str = 'png') -> Optional[bytes]:
+    """
+    Imagem do gráfico `tipo` para o arquivo do perfil (renderizada uma vez por chave)
+
+    Returns:
+        Bytes da imagem ou None se o perfil não tem os dados do gráfico
+    """
+    chave = (perfil['fingerprint'], tipo, top_n, formato)
+    cache = get_chart_cache()
+    imagem = cache.obter(chave)
+    if imagem is not None:
+        return imagem
+
+    serie = agregar_para_grafico(perfil, tipo, top_n)
+    if serie is None or serie.empty:
+        return None
+    _, titulo, ylabel, cor = TIPOS_GRAFICO[tipo]
+    imagem = renderizar_grafico(serie, titulo.format(n=top_n), ylabel, cor, formato)
+    cache.guardar(chave, imagem)
+    return imagem
@@ -0,0 +1,234 @@
+"""
+Estimativa rápida de conformidade por amostragem estratificada (capítulo do NCM × faixa de valor)
+"""
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from dataset_profile import converter_valores, detectar_colunas
+from ncm_validation import normalizar_ncm, validar_ncms
+
+TAMANHO_AMOSTRA_PADRAO = 400
+
+# Faixas de valor (quantis do valor de cada produto) dentro da estratificação
+FAIXAS_VALOR = 3
+
+# Estrato dos produtos validados sempre (pesam muito nas linhas ou no valor)
+ESTRATO_CERTEZA = "certeza"
+
+# Descrição mais parecida com outro NCM da referência acima disso conta como divergente
+SIMILARIDADE_DIVERGENCIA = 0.3
+
+
+@dataclass
+class EstimativaConformidade:
+    percentual_conformidade: float
+    ic_inferior: float
+    ic_superior: float
+    # Valor (soma da coluna de valor) dos produtos não conformes, projetado para o arquivo; None sem coluna de valor
+    valor_em_risco: Optional[float]
+    valor_ic_inferior: Optional[float]
+    valor_ic_superior: Optional[float]
+    confianca: float
+    produtos: int
+    linhas: int
+    estratos: int
+    amostra: pd.DataFrame
+
+
+def montar_produtos(df: pd.DataFrame, colunas: Dict[str, Optional[str]], tamanho_amostra: int) -> pd.DataFrame:
+    """
+    Uma linha por produto (par NCM, descrição) com linhas, valor e estrato
+
+    O estrato combina o capítulo do NCM (2 primeiros dígitos) com a faixa de
+    valor do produto (tercis); sem coluna de valor, só o capítulo. Produtos
+    com ao menos 1/`tamanho_amostra` das linhas ou do valor do arquivo vão
+    para o estrato de certeza (sempre validados): em arquivos concentrados
+    em poucos produtos, são eles que decidem o percentual.
+
+    O valor é convertido para número linha a linha antes da soma: uma coluna
+    lida como texto somaria concatenando as strings.
+    """
+    col_ncm, col_desc, col_valor = colunas['ncm'], colunas['descricao'], colunas['valor']
+    base = pd.DataFrame({'ncm': df[col_ncm].astype(str)})
+    if col_desc:
+        base['descricao'] = df[col_desc].fillna('').astype(str)
+    agregados = {'linhas': ('ncm', 'size')}
+    if col_valor:
+        base['valor'] = converter_valores(df[col_valor]).fillna(0.0)
+        agregados['valor'] = ('valor', 'sum')
+    chaves = ['ncm', 'descricao'] if col_desc else ['ncm']
+    produtos = base.groupby(chaves, sort=False).agg(**agregados).reset_index()
+    if not col_desc:
+        produtos['descricao'] = None
+
+    ncm = normalizar_ncm(produtos['ncm'])
+    capitulo = ncm.str[:2].where(ncm.str.fullmatch(r'\d{8}'), '??')
+    if col_valor:
+        faixa = pd.qcut(produtos['valor'].rank(method='first'), min(FAIXAS_VALOR, len(produtos)), labels=False)
+        produtos['estrato'] = capitulo + '|' + faixa.astype(str)
+    else:
+        produtos['estrato'] = capitulo
+
+    certeza = produtos['linhas'] >= produtos['linhas'].sum() / tamanho_amostra
+    if col_valor:
+        certeza |= produtos['valor'] >= produtos['valor'].sum() / tamanho_amostra
+    produtos.loc[certeza, 'estrato'] = ESTRATO_CERTEZA
+    return produtos
+
+
+def alocar_amostra(produtos: pd.DataFrame, tamanho: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Sorteia os produtos da amostra (posições em `produtos`)
+
+    O estrato de certeza entra inteiro; o restante da amostra é dividido
+    entre os demais proporcionalmente às linhas que representam, com pelo
+    menos 2 produtos por estrato (para estimar a variância) quando há 2 ou mais.
+    O arredondamento e esse mínimo não passam de `tamanho`: o excesso sai dos
+    estratos com mais produtos acima do mínimo. A amostra só fica maior quando
+    o estrato de certeza mais 2 produtos por estrato já não cabem em `tamanho`.
+    """
+    estratos = produtos.groupby('estrato', sort=False)
+    tamanhos = estratos.size()
+    linhas = estratos['linhas'].sum()
+    certeza = tamanhos.index == ESTRATO_CERTEZA
+    restante = max(tamanho - int(tamanhos[certeza].sum()), 0)
+    peso = linhas / linhas[~certeza].sum()
+    minimo = np.minimum(tamanhos, 2)
+    alocacao = np.minimum(tamanhos, np.maximum(np.round(peso * restante), minimo))
+    alocacao[certeza] = tamanhos[certeza]
+    alocacao = alocacao.astype(int)
+
+    excesso = int(alocacao[~certeza].sum()) - restante
+    folga = (alocacao - minimo)[~certeza]
+    if excesso > 0 and folga.sum() > 0:
+        if excesso >= folga.sum():
+            corte = folga
+        else:
+            # Maiores restos: corte proporcional à folga, somando exatamente o excesso
+            proporcional = folga * excesso / folga.sum()
+            corte = np.floor(proporcional).astype(int)
+            resto = excesso - int(corte.sum())
+            corte[(proporcional - corte).sort_values(ascending=False, kind='stable').index[:resto]] += 1
+        alocacao[~certeza] -= corte
+
+    posicoes = []
+    for estrato, indices in estratos.indices.items():
+        posicoes.append(rng.choice(indices, size=alocacao[estrato], replace=False))
+    return np.concatenate(posicoes)
+
+
+def avaliar_produtos(amostra: pd.DataFrame, ncms_referencia, engine=None) -> pd.DataFrame:
+    """
+    Valida cada produto da amostra sem chamar o modelo
+
+    Não conforme: NCM fora do formato de 8 dígitos, fora da tabela de
+    referência ou divergente da descrição (a referência mais parecida tem
+    outro NCM, com similaridade acima de `SIMILARIDADE_DIVERGENCIA`).
+    """
+    validacao = validar_ncms(amostra['ncm'], ncms_referencia)
+    motivo = pd.Series(None, index=amostra.index, dtype=object)
+    motivo[~validacao['na_referencia']] = 'Fora da tabela de referência'
+    motivo[~validacao['formato_valido']] = 'Formato inválido'
+
+    if engine is not None and amostra['descricao'].notna().any():
+        sugestoes = engine.melhor_sugestao(amostra['descricao'].dropna(), SIMILARIDADE_DIVERGENCIA)
+        sugerido = amostra['descricao'].map(sugestoes['ncm_sugerido'])
+        divergente = motivo.isna() & sugerido.notna() & (sugerido != validacao['NCM_normalizado'])
+        motivo[divergente] = 'Divergente da descrição (sugerido ' + sugerido[divergente] + ')'
+
+    return amostra.assign(conforme=motivo.isna(), motivo=motivo)
+
+
+def _estimar(
+    amostra: pd.DataFrame,
+    populacao: pd.Series,
+    numerador: pd.Series,
+    denominador: Optional[pd.Series],
+    z: float
+):
+    """
+    Estimador estratificado (de razão, quando há `denominador`) e meia-largura do intervalo
+
+    Args:
+        amostra: Produtos sorteados, com a coluna estrato
+        populacao: Número de produtos por estrato
+        numerador, denominador: Variáveis por produto da amostra (mesmo índice de `amostra`)
+    """
+    n = amostra.groupby('estrato').size()
+    N = populacao.reindex(n.index)
+    fpc = 1 - n / N
+    media_num = numerador.groupby(amostra['estrato']).mean()
+    total = (N * media_num).sum()
+    if denominador is None:
+        residuos = numerador
+        escala = 1.0
+    else:
+        total_den = (N * denominador.groupby(amostra['estrato']).mean()).sum()
+        total = total / total_den
+        # Linearização: variância dos resíduos numerador - razão × denominador
+        residuos = numerador - total * denominador
+        escala = total_den
+    variancia = (N ** 2 * fpc * residuos.groupby(amostra['estrato']).var(ddof=1).fillna(0.0) / n).sum() / escala ** 2
+    return total, z * float(np.sqrt(variancia))
+
+
+def estimar_conformidade(
+    df: pd.DataFrame,
+    ncms_referencia,
+    perfil: Optional[Dict] = None,
+    tamanho_amostra: int = TAMANHO_AMOSTRA_PADRAO,
+    confianca: float = 0.95,
+    engine=None,
+    semente: Optional[int] = None
+) -> EstimativaConformidade:
+    """
+    Estima o percentual de conformidade do arquivo validando só uma amostra de produtos
+
+    O percentual é por linha, como o da validação completa: cada produto
+    sorteado pesa as linhas que tem no arquivo. O custo da validação depende
+    do tamanho da amostra, não do arquivo.
+
+    Args:
+        ncms_referencia: NCMs normalizados considerados válidos
+        tamanho_amostra: Produtos (pares NCM, descrição) validados
+        confianca: Nível do intervalo de confiança (aproximação normal)
+        engine: Motor de sugestão para a checagem descrição × NCM (None = só formato e referência)
+        semente: Semente do sorteio (None = aleatória)
+    """
+    colunas = perfil['colunas_detectadas'] if perfil else detectar_colunas(df)
+    if colunas['ncm'] is None:
+        raise ValueError("Nenhuma coluna de NCM no arquivo")
+
+    produtos = montar_produtos(df, colunas, tamanho_amostra)
+    rng = np.random.default_rng(semente)
+    amostra = avaliar_produtos(produtos.iloc[alocar_amostra(produtos, tamanho_amostra, rng)], ncms_referencia, engine)
+    populacao = produtos.groupby('estrato').size()
+    z = NormalDist().inv_cdf(0.5 + confianca / 2)
+
+    conformes = amostra['linhas'] * amostra['conforme']
+    proporcao, margem = _estimar(amostra, populacao, conformes, amostra['linhas'], z)
+
+    valor = valor_inf = valor_sup = None
+    if 'valor' in produtos:
+        em_risco = amostra['valor'] * ~amostra['conforme']
+        valor, margem_valor = _estimar(amostra, populacao, em_risco, None, z)
+        valor_total = float(produtos['valor'].sum())
+        valor_inf, valor_sup = max(0.0, valor - margem_valor), min(valor_total, valor + margem_valor)
+
+    return EstimativaConformidade(
+        percentual_conformidade=proporcao * 100,
+        ic_inferior=max(0.0, proporcao - margem) * 100,
+        ic_superior=min(1.0, proporcao + margem) * 100,
+        valor_em_risco=valor,
+        valor_ic_inferior=valor_inf,
+        valor_ic_superior=valor_sup,
+        confianca=confianca,
+        produtos=len(produtos),
+        linhas=len(df),
+        estratos=len(populacao),
+        amostra=amostra.drop(columns='estrato').reset_index(drop=True),
+    )
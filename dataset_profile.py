@@ -0,0 +1,195 @@
+"""
+Perfil do arquivo carregado (schema, colunas-chave, contagens por NCM) calculado uma única vez
+"""
+import hashlib
+from typing import Dict, Optional
+
+import pandas as pd
+
+from description_clustering import agrupar_descricoes
+from ncm_reference import get_ncm_reference
+from ncm_validation import validar_ncms
+
+# Fração mínima dos valores preenchidos (amostra) que precisa virar número para a coluna contar como valor
+MIN_VALORES_NUMERICOS = 0.8
+AMOSTRA_VALORES = 1000
+
+
+def converter_valores(serie: pd.Series) -> pd.Series:
+    """
+    Coluna de valor como float: aceita números e textos como "1.234,56", "R$ 12,50" ou "1,234.56"
+
+    O último separador (vírgula ou ponto) é o decimal; o outro é de milhar.
+    A conversão roda uma vez por valor distinto. O que não for número vira NaN.
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    codigos, unicos = pd.factorize(serie)
+    texto = pd.Series(unicos, dtype='string').str.replace(r'[R$\s]', '', regex=True)
+    virgula_decimal = (texto.str.rfind(',') > texto.str.rfind('.')).fillna(False).astype(bool)
+    texto = texto.where(
+        ~virgula_decimal, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    ).where(virgula_decimal, texto.str.replace(',', '', regex=False))
+    numeros = pd.to_numeric(texto, errors='coerce').astype(float).to_numpy()
+    return pd.Series(numeros[codigos], index=serie.index).where(codigos >= 0)
+
+
+def _e_coluna_de_valor(serie: pd.Series) -> bool:
+    """Numérica, ou texto em que a maior parte da amostra preenchida vira número"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return True
+    amostra = serie.dropna().head(AMOSTRA_VALORES)
+    return len(amostra) > 0 and converter_valores(amostra).notna().mean() >= MIN_VALORES_NUMERICOS
+
+
+def detectar_colunas(df: pd.DataFrame) -> Dict[str, Optional[str]]:
+    """
+    Identifica as colunas de NCM, descrição, valor, estabelecimento e e-mail de contato pelos nomes
+
+    A coluna de valor também é aceita como texto (vírgula decimal, "R$") quando
+    a maior parte dos valores vira número: use `converter_valores` para ler.
+    """
+    ncm_cols = [col for col in df.columns if 'ncm' in col.lower()]
+    desc_cols = [col for col in df.columns if any(x in col.lower() for x in ['descri', 'produto', 'desc'])]
+    valor_cols = [
+        col for col in df.columns
+        if ('valor' in col.lower() or 'total' in col.lower()) and _e_coluna_de_valor(df[col])
+    ]
+    est_cols = [
+        col for col in df.columns
+        if any(x in col.lower() for x in ['cnpj', 'estabelecimento', 'loja', 'filial', 'emitente'])
+    ]
+    email_cols = [col for col in df.columns if 'email' in col.lower() or 'e-mail' in col.lower()]
+    return {
+        'ncm': ncm_cols[0] if ncm_cols else None,
+        'descricao': desc_cols[0] if desc_cols else None,
+        'valor': valor_cols[0] if valor_cols else None,
+        'estabelecimento': est_cols[0] if est_cols else None,
+        'email': email_cols[0] if email_cols else None,
+    }
+
+
+def fingerprint_dataframe(df: pd.DataFrame) -> str:
+    """Hash estável do conteúdo (colunas + valores) do DataFrame"""
+    hasher = hashlib.sha1()
+    hasher.update('|'.join(map(str, df.columns)).encode('utf-8'))
+    hasher.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return hasher.hexdigest()[:16]
+
+
+def perfilar_dataset(df: pd.DataFrame, max_ncms: int = 50, exemplos_por_ncm: int = 3) -> Dict:
+    """
+    Calcula o perfil do arquivo para ser injetado no prompt do agente
+
+    Args:
+        df: DataFrame das notas fiscais
+        max_ncms: Quantidade de NCMs (mais frequentes) detalhados no perfil
+        exemplos_por_ncm: Descrições distintas de exemplo por NCM
+
+    Returns:
+        Dicionário com schema, colunas detectadas, totais e resumo por NCM
+    """
+    colunas = detectar_colunas(df)
+    perfil = {
+        'fingerprint': fingerprint_dataframe(df),
+        'linhas': len(df),
+        'schema': {col: str(dtype) for col, dtype in df.dtypes.items()},
+        'colunas_detectadas': colunas,
+        'ncms_unicos': 0,
+        'ncms_formato_invalido': 0,
+        'ncms_fora_referencia': 0,
+        'pares_unicos': 0,
+        'grupos_unicos': 0,
+        'grupo_descricao': None,
+        'resumo_ncms': pd.DataFrame(),
+        'validacao': None,
+    }
+
+    if colunas['ncm'] is None:
+        return perfil
+
+    validacao = validar_ncms(df[colunas['ncm']], get_ncm_reference().get_all_valid_ncms())
+    base = validacao.copy()
+    agregacoes = {
+        'quantidade': ('formato_valido', 'size'),
+        'formato_valido': ('formato_valido', 'first'),
+        'na_referencia': ('na_referencia', 'first'),
+    }
+    if colunas['valor']:
+        base['valor'] = converter_valores(df[colunas['valor']]).fillna(0.0)
+        agregacoes['valor_total'] = ('valor', 'sum')
+
+    resumo = base.groupby('NCM_normalizado').agg(**agregacoes).sort_values('quantidade', ascending=False)
+
+    if colunas['descricao']:
+        # Exemplos realmente diferentes: um por grupo de quase-duplicatas
+        # ("RACAO GOLDEN 15KG", "Ração Golden 15 kg"), que o agente analisa uma vez
+        top = resumo.index[:max_ncms]
+        grupos = agrupar_descricoes(df[colunas['descricao']])
+        base['descricao'] = df[colunas['descricao']]
+        base['descricao_normalizada'] = grupos['descricao_normalizada']
+        base['grupo'] = grupos['cluster_id']
+        amostra = (
+            base[base['NCM_normalizado'].isin(top)]
+            .dropna(subset=['descricao'])
+            .drop_duplicates(['NCM_normalizado', 'grupo'])
+            .groupby('NCM_normalizado')
+            .head(exemplos_por_ncm)
+        )
+        resumo['exemplos'] = amostra.groupby('NCM_normalizado')['descricao'].agg(list)
+        perfil['pares_unicos'] = len(base[['NCM_normalizado', 'descricao_normalizada']].drop_duplicates())
+        perfil['grupos_unicos'] = len(base[['NCM_normalizado', 'grupo']].drop_duplicates())
+        perfil['grupo_descricao'] = grupos['cluster_id']  # Por linha: grupo de quase-duplicatas da descrição
+    else:
+        perfil['pares_unicos'] = perfil['grupos_unicos'] = len(resumo)
+
+    perfil['ncms_unicos'] = len(resumo)
+    perfil['ncms_formato_invalido'] = int((~resumo['formato_valido']).sum())
+    perfil['ncms_fora_referencia'] = int((~resumo['na_referencia']).sum())
+    perfil['resumo_ncms'] = resumo
+    perfil['validacao'] = validacao  # Por linha: NCM_normalizado, formato_valido, na_referencia
+    perfil['max_ncms'] = max_ncms
+    return perfil
+
+
+def formatar_perfil_para_prompt(perfil: Dict) -> str:
+    """Formata o perfil de forma compacta para o prompt do agente"""
+    colunas = perfil['colunas_detectadas']
+    linhas = [
+        "=== PERFIL DO ARQUIVO (JÁ CALCULADO - NÃO REPITA ESTA DESCOBERTA) ===",
+        f"Linhas: {perfil['linhas']}",
+        "Colunas (nome: tipo): " + ", ".join(f"'{c}': {t}" for c, t in perfil['schema'].items()),
+        f"Coluna NCM: {repr(colunas['ncm'])} | Coluna descrição: {repr(colunas['descricao'])} | Coluna valor: {repr(colunas['valor'])}",
+    ]
+    if colunas['valor'] and not perfil['schema'][colunas['valor']].startswith(('int', 'float')):
+        linhas.append(
+            f"Coluna {repr(colunas['valor'])} é texto: remova 'R$' e o separador de milhar e troque a vírgula "
+            "decimal antes de somar."
+        )
+
+    if colunas['ncm'] is None:
+        linhas.append("Nenhuma coluna NCM detectada pelo nome.")
+        return "\n".join(linhas)
+
+    linhas += [
+        "Coluna 'NCM_normalizado' já existe em df (NCM como string, sem pontos/hífens).",
+        f"NCMs únicos: {perfil['ncms_unicos']} | Formato inválido: {perfil['ncms_formato_invalido']} | "
+        f"Fora da tabela de referência: {perfil['ncms_fora_referencia']}",
+        "",
+        "NCM | qtd | formato ok | na referência | exemplos de produtos",
+    ]
+
+    resumo = perfil['resumo_ncms']
+    max_ncms = perfil.get('max_ncms', len(resumo))
+    for ncm, row in resumo.head(max_ncms).iterrows():
+        exemplos = row.get('exemplos')
+        exemplos = "; ".join(str(e)[:60] for e in exemplos) if isinstance(exemplos, list) else "-"
+        linhas.append(
+            f"{ncm} | {row['quantidade']} | {'sim' if row['formato_valido'] else 'não'} | "
+            f"{'sim' if row['na_referencia'] else 'não'} | {exemplos}"
+        )
+
+    if len(resumo) > max_ncms:
+        linhas.append(f"... e mais {len(resumo) - max_ncms} NCMs (use a ferramenta resumir_ncms_arquivo).")
+
+    return "\n".join(linhas)
@@ -0,0 +1,167 @@
+"""
+Normalização de descrições de produtos e agrupamento de quase-duplicatas (MinHash/LSH)
+"""
+import zlib
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from startup_profile import lazy_import
+
+# Quantidade + unidade ("15kg", "15 kg", "2,5 L", "500ml")
+_RE_QUANTIDADE = r'\b\d+(?:[.,]\d+)?\s*(?:kg|kgs|g|gr|grs|mg|ml|l|lt|lts|un|und|unid|cx|pct|pc|pcs|m|cm|mm)\b'
+# Unidades soltas e abreviações de embalagem
+_RE_UNIDADE = r'\b(?:kg|kgs|g|gr|grs|mg|ml|l|lt|lts|un|und|unid|cx|pct|pc|pcs)\b'
+# Códigos/SKUs: qualquer token que contenha dígitos
+_RE_SKU = r'\b\w*\d\w*\b'
+
+_PRIMO_MERSENNE = np.uint64((1 << 61) - 1)
+_MASCARA_32 = np.uint64(0xFFFFFFFF)
+
+
+def remover_acentos(serie: pd.Series) -> pd.Series:
+    """Remove acentos e cedilha ("Ração" -> "Racao")"""
+    return (
+        serie.astype(str)
+        .str.normalize('NFKD')
+        .str.encode('ascii', errors='ignore')
+        .str.decode('ascii')
+    )
+
+
+def normalizar_descricoes(serie: pd.Series) -> pd.Series:
+    """
+    Normaliza descrições para comparação
+
+    Remove acentos, caixa, quantidades com unidade, unidades soltas, SKUs e
+    pontuação. Cada valor distinto é processado uma única vez.
+    """
+    codigos, unicos = pd.factorize(serie.fillna('').astype(str))
+    unicos = pd.Series(unicos, dtype=object)
+
+    texto = remover_acentos(unicos).str.lower()
+    texto = (
+        texto.str.replace(_RE_QUANTIDADE, ' ', regex=True)
+        .str.replace(_RE_SKU, ' ', regex=True)
+        .str.replace(_RE_UNIDADE, ' ', regex=True)
+        .str.replace(r'[^a-z\s]', ' ', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+    # Descrições compostas só por códigos não devem colapsar todas em ""
+    vazias = texto == ''
+    texto[vazias] = unicos[vazias].str.lower().str.strip()
+
+    return pd.Series(texto.to_numpy()[codigos], index=serie.index, dtype=object)
+
+
+def _assinaturas_minhash(textos: np.ndarray, n_permutacoes: int, tamanho_shingle: int) -> np.ndarray:
+    """Calcula assinaturas MinHash (n_textos x n_permutacoes) de shingles de caracteres"""
+    donos = []
+    hashes = []
+    for i, texto in enumerate(textos):
+        if len(texto) <= tamanho_shingle:
+            shingles = {texto}
+        else:
+            shingles = {texto[j:j + tamanho_shingle] for j in range(len(texto) - tamanho_shingle + 1)}
+        hashes.extend(zlib.crc32(s.encode('utf-8')) for s in shingles)
+        donos.extend([i] * len(shingles))
+
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    inicios = np.flatnonzero(np.r_[True, np.diff(np.asarray(donos)) != 0])
+
+    rng = np.random.default_rng(42)
+    a = rng.integers(1, 1 << 32, size=n_permutacoes, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=n_permutacoes, dtype=np.uint64)
+
+    assinaturas = np.empty((len(textos), n_permutacoes), dtype=np.uint64)
+    # Processa as permutações em blocos para limitar a memória intermediária
+    for inicio in range(0, n_permutacoes, 8):
+        fim = min(inicio + 8, n_permutacoes)
+        valores = ((hashes[:, None] * a[inicio:fim] + b[inicio:fim]) % _PRIMO_MERSENNE) & _MASCARA_32
+        assinaturas[:, inicio:fim] = np.minimum.reduceat(valores, inicios, axis=0)
+    return assinaturas
+
+
+def _arestas_lsh(assinaturas: np.ndarray, bandas: int, limiar: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Encontra pares candidatos por banda e mantém os de similaridade estimada >= limiar"""
+    n, n_permutacoes = assinaturas.shape
+    linhas_por_banda = n_permutacoes // bandas
+    pesos = np.uint64(1099511628211) ** np.arange(linhas_por_banda, dtype=np.uint64)
+    indices = np.arange(n)
+
+    origens, destinos = [], []
+    for banda in range(bandas):
+        bloco = assinaturas[:, banda * linhas_por_banda:(banda + 1) * linhas_por_banda]
+        chave_banda = (bloco * pesos).sum(axis=1)
+        # Compara cada texto com o primeiro do seu bucket (topologia em estrela)
+        primeiro = pd.Series(indices).groupby(chave_banda).transform('first').to_numpy()
+        candidatos = primeiro != indices
+        if not candidatos.any():
+            continue
+        i, j = indices[candidatos], primeiro[candidatos]
+        similaridade = (assinaturas[i] == assinaturas[j]).mean(axis=1)
+        manter = similaridade >= limiar
+        origens.append(i[manter])
+        destinos.append(j[manter])
+
+    if not origens:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    return np.concatenate(origens), np.concatenate(destinos)
+
+
+def agrupar_descricoes(
+    serie: pd.Series,
+    limiar: float = 0.8,
+    n_permutacoes: int = 64,
+    bandas: int = 16,
+    tamanho_shingle: int = 3
+) -> pd.DataFrame:
+    """
+    Agrupa descrições quase idênticas
+
+    Args:
+        serie: Descrições originais
+        limiar: Similaridade de Jaccard estimada mínima para unir duas descrições
+        n_permutacoes: Tamanho da assinatura MinHash
+        bandas: Número de bandas do LSH (n_permutacoes deve ser múltiplo)
+        tamanho_shingle: Tamanho dos n-gramas de caracteres
+
+    Returns:
+        DataFrame com o mesmo índice de `serie` e colunas
+        descricao_normalizada e cluster_id
+    """
+    normalizadas = normalizar_descricoes(serie)
+    codigos, chaves = pd.factorize(normalizadas)
+    n_chaves = len(chaves)
+
+    if n_chaves > 1:
+        # scipy só é carregado quando há agrupamento a fazer (mantém o startup leve)
+        sparse = lazy_import("scipy.sparse")
+        csgraph = lazy_import("scipy.sparse.csgraph")
+        assinaturas = _assinaturas_minhash(np.asarray(chaves, dtype=object), n_permutacoes, tamanho_shingle)
+        origens, destinos = _arestas_lsh(assinaturas, bandas, limiar)
+        grafo = sparse.coo_matrix((np.ones(len(origens)), (origens, destinos)), shape=(n_chaves, n_chaves))
+        _, cluster_por_chave = csgraph.connected_components(grafo, directed=False)
+    else:
+        cluster_por_chave = np.zeros(n_chaves, dtype=int)
+
+    return pd.DataFrame({
+        'descricao_normalizada': normalizadas,
+        'cluster_id': cluster_por_chave[codigos] if n_chaves else np.zeros(len(serie), dtype=int),
+    }, index=serie.index)
+
+
+def propagar_veredito(clusters: pd.Series, veredito_por_cluster: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replica o resultado validado de cada cluster para todas as linhas membro
+
+    Args:
+        clusters: Série com o identificador de cluster de cada linha
+        veredito_por_cluster: DataFrame indexado pelo identificador de cluster
+
+    Returns:
+        DataFrame com o índice de `clusters` e as colunas do veredito
+    """
+    return veredito_por_cluster.reindex(clusters.to_numpy()).set_axis(clusters.index)
@@ -0,0 +1,256 @@
+"""
+Fila persistente de e-mails (SQLite + diretório de spool) enviada por uma thread em segundo plano
+"""
+import atexit
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from email import message_from_bytes, policy
+from email.message import Message
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Status de cada mensagem
+PENDENTE = "pendente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALHOU = "falhou"
+
+DIRETORIO_OUTBOX = os.getenv(
+    "EMAIL_OUTBOX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox")
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mensagens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    destinatario TEXT NOT NULL,
+    assunto TEXT NOT NULL,
+    arquivo TEXT NOT NULL,
+    status TEXT NOT NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_tentativa REAL NOT NULL,
+    ultimo_erro TEXT,
+    criada_em REAL NOT NULL,
+    enviada_em REAL
+);
+CREATE INDEX IF NOT EXISTS idx_mensagens_fila ON mensagens (status, proxima_tentativa);
+"""
+
+
+class Outbox:
+    """
+    Caixa de saída durável
+
+    `enfileirar` só grava a mensagem completa (com anexos) em um arquivo .eml
+    do spool e registra-a no SQLite: a página nunca espera o servidor SMTP.
+    Uma thread envia as mensagens vencidas em lotes; cada mensagem é marcada
+    como "enviado" assim que o servidor a aceita, então uma falha no meio do
+    lote não reenvia as anteriores. Falhas são reagendadas com backoff
+    exponencial e, depois de `max_tentativas`, ficam como "falhou" com o
+    último erro (o arquivo é mantido para reenvio manual).
+
+    O lote é reservado (status "enviando") até `prazo_envio_s`: vários
+    processos podem compartilhar o diretório sem enviar a mesma mensagem, e
+    mensagens de um processo encerrado no meio do lote voltam à fila quando
+    o prazo vence.
+
+    Args:
+        diretorio: Pasta do banco `outbox.db` e do spool
+        enviar: Envia um lote e devolve, por mensagem, None ou a descrição do erro;
+            recebe também `ao_concluir(indice, erro)`, a chamar assim que cada mensagem é aceita ou recusada
+        max_tentativas: Tentativas antes de desistir de uma mensagem
+        backoff_base_s, backoff_max_s: Espera após a 1ª falha e teto da espera
+        tamanho_lote: Mensagens enviadas por sessão SMTP
+        intervalo_s: Intervalo de verificação da fila quando nada é enfileirado
+        prazo_envio_s: Validade da reserva de um lote
+    """
+
+    def __init__(
+        self,
+        diretorio: str,
+        enviar: Callable[[List[Message], Callable[[int, Optional[str]], None]], List[Optional[str]]],
+        max_tentativas: int = 8,
+        backoff_base_s: float = 30.0,
+        backoff_max_s: float = 3600.0,
+        tamanho_lote: int = 20,
+        intervalo_s: float = 5.0,
+        prazo_envio_s: float = 900.0
+    ):
+        self.diretorio_spool = os.path.join(diretorio, "spool")
+        os.makedirs(self.diretorio_spool, exist_ok=True)
+        self.caminho_db = os.path.join(diretorio, "outbox.db")
+        self.enviar = enviar
+        self.max_tentativas = max_tentativas
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_s = intervalo_s
+        self.prazo_envio_s = prazo_envio_s
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        with self._conectar() as db:
+            db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conectar(self) -> Iterator[sqlite3.Connection]:
+        """Conexão de uma operação: confirma (ou desfaz) a transação e fecha ao sair"""
+        with closing(sqlite3.connect(self.caminho_db, timeout=30)) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.row_factory = sqlite3.Row
+            with db:
+                yield db
+
+    def enfileirar(self, msg: Message) -> int:
+        """Grava a mensagem no spool e na fila; devolve o id para acompanhar o status"""
+        agora = time.time()
+        nome = f"{int(agora * 1000)}_{os.getpid()}_{threading.get_ident()}_{random.getrandbits(32):08x}.eml"
+        arquivo = os.path.join(self.diretorio_spool, nome)
+        temporario = arquivo + ".tmp"
+        with open(temporario, "wb") as destino:
+            destino.write(msg.as_bytes())
+            destino.flush()
+            os.fsync(destino.fileno())
+        os.replace(temporario, arquivo)
+
+        with self._conectar() as db:
+            cursor = db.execute(
+                "INSERT INTO mensagens (destinatario, assunto, arquivo, status, proxima_tentativa, criada_em) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(msg['To']), str(msg['Subject']), nome, PENDENTE, agora, agora)
+            )
+            id_mensagem = cursor.lastrowid
+        self._acordar.set()
+        return id_mensagem
+
+    def _espera(self, tentativas: int) -> float:
+        """Backoff exponencial com jitter"""
+        espera = min(self.backoff_base_s * 2 ** (tentativas - 1), self.backoff_max_s)
+        return espera * random.uniform(0.8, 1.2)
+
+    def _reservar_lote(self, agora: float) -> List[sqlite3.Row]:
+        """Marca como "enviando" as mensagens vencidas e as de reservas expiradas, numa transação exclusiva"""
+        with self._conectar() as db:
+            # IMMEDIATE: dois processos não leem o mesmo lote antes de um deles marcá-lo
+            db.execute("BEGIN IMMEDIATE")
+            linhas = db.execute(
+                "SELECT id, arquivo, tentativas FROM mensagens "
+                "WHERE status IN (?, ?) AND proxima_tentativa <= ? ORDER BY proxima_tentativa LIMIT ?",
+                (PENDENTE, ENVIANDO, agora, self.tamanho_lote)
+            ).fetchall()
+            db.executemany(
+                "UPDATE mensagens SET status = ?, proxima_tentativa = ? WHERE id = ?",
+                [(ENVIANDO, agora + self.prazo_envio_s, linha['id']) for linha in linhas]
+            )
+        return linhas
+
+    def _registrar_resultado(self, linha: sqlite3.Row, erro: Optional[str]) -> None:
+        """Grava o resultado de uma mensagem do lote; enviada, o arquivo do spool é apagado"""
+        agora = time.time()
+        tentativas = linha['tentativas'] + 1
+        if erro is None:
+            atualizacao = (ENVIADO, tentativas, agora, None, agora, linha['id'])
+        elif tentativas >= self.max_tentativas:
+            atualizacao = (FALHOU, tentativas, agora, erro, None, linha['id'])
+        else:
+            atualizacao = (PENDENTE, tentativas, agora + self._espera(tentativas), erro, None, linha['id'])
+        with self._conectar() as db:
+            db.execute(
+                "UPDATE mensagens SET status = ?, tentativas = ?, proxima_tentativa = ?, ultimo_erro = ?, "
+                "enviada_em = ? WHERE id = ?",
+                atualizacao
+            )
+        if erro is None:
+            os.remove(os.path.join(self.diretorio_spool, linha['arquivo']))
+
+    def processar_lote(self) -> int:
+        """Envia as mensagens vencidas (até `tamanho_lote`); devolve quantas foram processadas"""
+        agora = time.time()
+        linhas = self._reservar_lote(agora)
+        if not linhas:
+            return 0
+
+        mensagens, validas, ilegiveis = [], [], []
+        for linha in linhas:
+            try:
+                with open(os.path.join(self.diretorio_spool, linha['arquivo']), "rb") as origem:
+                    mensagens.append(message_from_bytes(origem.read(), policy=policy.SMTP))
+                validas.append(linha)
+            except OSError as e:
+                ilegiveis.append((FALHOU, agora, f"Arquivo do spool ilegível: {e}", linha['id']))
+        if ilegiveis:
+            with self._conectar() as db:
+                db.executemany(
+                    "UPDATE mensagens SET status = ?, proxima_tentativa = ?, ultimo_erro = ? WHERE id = ?", ilegiveis
+                )
+
+        registradas = set()
+
+        def ao_concluir(indice: int, erro: Optional[str]) -> None:
+            registradas.add(indice)
+            self._registrar_resultado(validas[indice], erro)
+
+        try:
+            erros = self.enviar(mensagens, ao_concluir) if mensagens else []
+        except Exception as e:
+            erros = [str(e)] * len(mensagens)
+
+        # Resultados não informados durante o envio (ex.: erro de configuração ou de login)
+        for indice, erro in enumerate(erros):
+            if indice not in registradas:
+                ao_concluir(indice, erro)
+        return len(linhas)
+
+    def _loop(self) -> None:
+        while not self._parar.is_set():
+            try:
+                if self.processar_lote():
+                    continue
+            except Exception:
+                # Banco ocupado ou disco cheio: tenta de novo no próximo ciclo
+                pass
+            self._acordar.wait(self.intervalo_s)
+            self._acordar.clear()
+
+    def iniciar(self) -> None:
+        """Inicia a thread de envio (uma por processo)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._loop, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        self._acordar.set()
+
+    def status(self, ids: List[int]) -> List[Dict]:
+        """Status, tentativas e último erro das mensagens informadas"""
+        if not ids:
+            return []
+        with self._conectar() as db:
+            linhas = db.execute(
+                f"SELECT id, destinatario, assunto, status, tentativas, proxima_tentativa, ultimo_erro "
+                f"FROM mensagens WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id",
+                list(ids)
+            ).fetchall()
+        return [dict(linha) for linha in linhas]
+
+    def contagem(self) -> Dict[str, int]:
+        """Mensagens por status"""
+        with self._conectar() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM mensagens GROUP BY status").fetchall())
+
+
+@lru_cache(maxsize=1)
+def get_outbox() -> Outbox:
+    """Fila do processo, com a thread de envio já iniciada"""
+    from email_service import get_email_service
+
+    outbox = Outbox(DIRETORIO_OUTBOX, enviar=get_email_service().enviar_em_lote)
+    outbox.iniciar()
+    atexit.register(outbox.parar)
+    return outbox
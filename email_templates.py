@@ -0,0 +1,175 @@
+"""
+Templates do e-mail de relatório: HTML e CSS montados uma vez, por mensagem só os valores
+"""
+import html
+from datetime import datetime
+from string import Template
+
+import pandas as pd
+
+from problems_table import NOME_ANEXO_PROBLEMAS, principais_problemas
+
+# Problemas listados no corpo do e-mail; a lista completa vai no anexo CSV
+MAX_PROBLEMAS_EMAIL = 20
+
+CSS_EMAIL = """
+    body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; max-width: 800px; margin: 0 auto; padding: 20px; }
+    .header { background-color: #4CAF50; color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }
+    .header h1 { margin: 0; font-size: 24px; }
+    .header p { margin: 5px 0 0 0; font-size: 14px; opacity: 0.9; }
+    .content { padding: 30px; background-color: #ffffff; border: 1px solid #ddd; border-top: none; }
+    .metrics { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 15px; margin: 20px 0; }
+    .metric { text-align: center; padding: 20px; background-color: #f5f5f5; border-radius: 8px; border-left: 4px solid #4CAF50; }
+    .metric-value { font-size: 32px; font-weight: bold; color: #2E7D32; margin: 10px 0; }
+    .metric-label { font-size: 13px; color: #666; text-transform: uppercase; letter-spacing: 0.5px; }
+    .metric.ok { border-left-color: #4CAF50; } .metric.ok .metric-value { color: #4CAF50; }
+    .metric.alerta { border-left-color: #f44336; } .metric.alerta .metric-value { color: #f44336; }
+    .status-box { padding: 20px; border-radius: 5px; margin: 20px 0; }
+    .status-box.ok { background-color: #4CAF5015; border-left: 4px solid #4CAF50; }
+    .status-box.alerta { background-color: #f4433615; border-left: 4px solid #f44336; }
+    .status-box h3 { margin: 0 0 10px 0; }
+    .status-box.ok h3 { color: #4CAF50; } .status-box.alerta h3 { color: #f44336; }
+    .problems { margin-top: 20px; padding: 20px; background-color: #fff3cd; border-left: 4px solid #ffc107; border-radius: 5px; }
+    .problems h3 { margin: 0 0 15px 0; color: #856404; }
+    .no-problems { color: #4CAF50; font-weight: bold; text-align: center; padding: 20px; background-color: #e8f5e9; border-radius: 5px; }
+    table { width: 100%; border-collapse: collapse; margin-top: 15px; font-size: 13px; }
+    th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+    th { background-color: #4CAF50; color: white; font-weight: bold; }
+    tr:hover { background-color: #f5f5f5; }
+    .actions { margin-top: 25px; padding: 20px; background-color: #e3f2fd; border-radius: 5px; }
+    .actions h3 { margin: 0 0 15px 0; color: #1976d2; }
+    .actions ul { margin: 10px 0; padding-left: 20px; }
+    .actions li { margin: 8px 0; }
+    .footer { margin-top: 30px; padding: 20px; background-color: #f5f5f5; text-align: center; font-size: 12px; color: #666; border-radius: 0 0 10px 10px; }
+    .attachment-note { margin-top: 20px; padding: 15px; background-color: #e8f5e9; border-left: 4px solid #4CAF50; border-radius: 5px; }
+"""
+
+# CSS embutido uma única vez, na importação; `$` do CSS não existe, então não conflita com o Template
+_TEMPLATE_CORPO = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <style>""" + CSS_EMAIL + """</style>
+</head>
+<body>
+    <div class="header">
+        <h1>🐾 Relatório de Conformidade Fiscal NCM</h1>
+        <p>Setor Pet - Validação de Notas Fiscais</p>
+    </div>
+
+    <div class="content">
+        <h2 style="color: #2E7D32; border-bottom: 2px solid #4CAF50; padding-bottom: 10px;">
+            Resumo Executivo
+        </h2>
+
+        <div class="metrics">
+            <div class="metric">
+                <div class="metric-label">Total de Produtos</div>
+                <div class="metric-value">$total_produtos</div>
+            </div>
+            <div class="metric">
+                <div class="metric-label">NCMs Únicos</div>
+                <div class="metric-value" style="color: #1976d2;">$ncms_unicos</div>
+            </div>
+            <div class="metric $classe_problemas">
+                <div class="metric-label">Produtos com Problemas</div>
+                <div class="metric-value">$ncms_problemas</div>
+            </div>
+            <div class="metric $classe_status">
+                <div class="metric-label">Conformidade</div>
+                <div class="metric-value">$percentual_conformidade%</div>
+            </div>
+        </div>
+
+        <div class="status-box $classe_status">
+            <h3>Status Geral: $status_texto</h3>
+            <p style="margin: 0;">$status_mensagem</p>
+        </div>
+
+        $secao_problemas
+
+        <div class="actions">
+            <h3>🎯 Ações Recomendadas</h3>
+            <ul>
+                <li><strong>Imediato:</strong> Revise os NCMs com problemas críticos identificados</li>
+                <li><strong>Curto Prazo (7 dias):</strong> Corrija as notas fiscais antes de emitir novas</li>
+                <li><strong>Médio Prazo (30 dias):</strong> Implemente processo de validação preventiva</li>
+                <li><strong>Consultoria:</strong> Entre em contato com seu contador para casos complexos</li>
+            </ul>
+        </div>
+
+        <div class="attachment-note">
+            <strong>📎 Relatório Completo em PDF</strong><br>
+            O relatório detalhado com todas as análises e recomendações está anexado a este e-mail.
+        </div>
+    </div>
+
+    <div class="footer">
+        <p><strong>Relatório gerado automaticamente</strong></p>
+        <p>Sistema de Conformidade Fiscal NCM - Setor Pet</p>
+        <p>Data: $data</p>
+        <p style="margin-top: 10px; font-size: 11px;">
+            <em>Este é um relatório automático. Consulte um profissional contábil para orientações específicas.</em>
+        </p>
+    </div>
+</body>
+</html>
+""")
+
+_TEMPLATE_PROBLEMAS = Template("""<div class="problems">
+            <h3>⚠️ Problemas Identificados</h3>
+            $problemas_lista
+        </div>""")
+
+_SEM_PROBLEMAS = (
+    '<p class="no-problems">✅ Nenhum problema encontrado! Todas as notas fiscais estão em conformidade.</p>'
+)
+
+
+def renderizar_corpo(
+    total_produtos: int,
+    ncms_unicos: int,
+    ncms_problemas: int,
+    percentual_conformidade: float,
+    problemas_lista: str
+) -> str:
+    """Corpo HTML do e-mail de relatório"""
+    if percentual_conformidade >= 95:
+        mensagem = 'Parabéns! Suas notas fiscais estão em conformidade.'
+    elif percentual_conformidade >= 80:
+        mensagem = 'Boa conformidade geral. Algumas correções menores são recomendadas.'
+    else:
+        mensagem = 'Atenção necessária. Múltiplos problemas foram identificados e requerem correção.'
+    return _TEMPLATE_CORPO.substitute(
+        total_produtos=total_produtos,
+        ncms_unicos=ncms_unicos,
+        ncms_problemas=ncms_problemas,
+        percentual_conformidade=f"{percentual_conformidade:.1f}",
+        classe_problemas='ok' if ncms_problemas == 0 else 'alerta',
+        classe_status='ok' if percentual_conformidade >= 80 else 'alerta',
+        status_texto='✅ BOM' if percentual_conformidade >= 80 else '⚠️ REQUER ATENÇÃO',
+        status_mensagem=mensagem,
+        secao_problemas=(
+            _TEMPLATE_PROBLEMAS.substitute(problemas_lista=problemas_lista) if ncms_problemas > 0 else _SEM_PROBLEMAS
+        ),
+        data=datetime.now().strftime('%d/%m/%Y às %H:%M'),
+    )
+
+
+def resumo_problemas_html(problemas_df: pd.DataFrame, top_n: int = MAX_PROBLEMAS_EMAIL) -> str:
+    """Tabela HTML com no máximo `top_n` problemas e aviso do anexo com a lista completa"""
+    if problemas_df is None or len(problemas_df) == 0:
+        return "<p><strong>Nenhum problema identificado na análise.</strong></p>"
+
+    principais = principais_problemas(problemas_df, top_n)
+    cabecalho = "".join(f"<th>{html.escape(str(c))}</th>" for c in principais.columns)
+    linhas = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in linha) + "</tr>"
+        for linha in principais.itertuples(index=False)
+    )
+    tabela = f'<div style="overflow-x: auto;"><table><tr>{cabecalho}</tr>{linhas}</table></div>'
+    if len(problemas_df) > len(principais):
+        tabela += (
+            f"<p><em>Mostrando os {len(principais)} problemas mais graves de {len(problemas_df)}. "
+            f"A lista completa está no anexo {NOME_ANEXO_PROBLEMAS}.</em></p>"
+        )
+    return tabela
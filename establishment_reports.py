@@ -0,0 +1,243 @@
+"""
+Relatórios por estabelecimento (CNPJ/loja): um PDF por loja, gerados em paralelo e empacotados em ZIP
+"""
+import atexit
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from description_clustering import normalizar_descricoes
+from ncm_validation import normalizar_ncm
+
+# Abaixo disso os PDFs são gerados no próprio processo (subir o pool custa mais)
+MIN_ESTABELECIMENTOS_PARALELO = 3
+
+# Linhas sem estabelecimento (vazio ou ausente) formam um grupo próprio com este nome
+SEM_ESTABELECIMENTO = "(sem estabelecimento)"
+
+
+@dataclass
+class RelatorioEstabelecimento:
+    estabelecimento: str
+    total_produtos: int
+    ncms_unicos: int
+    ncms_problemas: int
+    percentual_conformidade: float
+    contato: Optional[str]
+    problemas_df: pd.DataFrame
+    pdf_bytes: bytes = b""
+    # Nome do PDF no ZIP; `dividir_por_estabelecimento` desfaz colisões com sufixos _2, _3...
+    nome_arquivo: str = ""
+
+    def __post_init__(self):
+        if not self.nome_arquivo:
+            self.nome_arquivo = f"relatorio_ncm_{re.sub(r'[^0-9A-Za-z._-]+', '_', self.estabelecimento)}.pdf"
+
+
+def _desfazer_colisoes(relatorios: List[RelatorioEstabelecimento]):
+    """
+    Nomes de PDF únicos no ZIP
+
+    A limpeza do nome junta estabelecimentos diferentes ("Loja 1/A" e
+    "Loja 1?A" viram "Loja_1_A"); os repetidos ganham sufixo _2, _3...
+    A comparação ignora maiúsculas (sistemas de arquivos que não diferenciam).
+    """
+    usados = set()
+    for relatorio in relatorios:
+        base, nome, n = relatorio.nome_arquivo[:-len('.pdf')], relatorio.nome_arquivo, 1
+        while nome.lower() in usados:
+            n += 1
+            nome = f"{base}_{n}.pdf"
+        usados.add(nome.lower())
+        relatorio.nome_arquivo = nome
+
+
+def _nucleos_disponiveis() -> int:
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+
+@lru_cache(maxsize=1)
+def get_pool_pdfs() -> ProcessPoolExecutor:
+    """
+    Pool de processos do app para gerar PDFs (um por núcleo), criado no primeiro uso
+
+    Processos e não threads: o ReportLab é Python puro e segura o GIL.
+    """
+    pool = ProcessPoolExecutor(max_workers=_nucleos_disponiveis(), mp_context=multiprocessing.get_context('spawn'))
+    atexit.register(pool.shutdown, wait=False, cancel_futures=True)
+    return pool
+
+
+def dividir_por_estabelecimento(
+    df: pd.DataFrame,
+    perfil: Dict,
+    problemas_df: pd.DataFrame
+) -> List[RelatorioEstabelecimento]:
+    """
+    Métricas e problemas de cada estabelecimento (ainda sem PDF)
+
+    Os problemas apontados pelo agente vão para as lojas que vendem o par
+    (NCM, produto) citado, ou, quando o produto não é reconhecido em nenhuma
+    loja, para as que vendem o NCM. Se a resposta não trouxe tabela de
+    problemas, usa os achados da validação local (NCM fora do formato ou da
+    tabela de referência).
+    """
+    colunas = perfil['colunas_detectadas']
+    col_est, col_email, col_desc = colunas.get('estabelecimento'), colunas.get('email'), colunas['descricao']
+    validacao = perfil['validacao']
+    if col_est is None or validacao is None:
+        return []
+
+    # astype(str) transformaria ausentes no texto "nan"
+    estabelecimentos = df[col_est].astype('string').str.strip().replace('', pd.NA).fillna(SEM_ESTABELECIMENTO).astype(object)
+    base = validacao.assign(estabelecimento=estabelecimentos)
+
+    col_ncm_problema = None
+    if problemas_df is not None and not problemas_df.empty:
+        col_ncm_problema = next((c for c in problemas_df.columns if 'NCM' in str(c).upper()), None)
+    if col_ncm_problema is not None:
+        ncms_problema = normalizar_ncm(problemas_df[col_ncm_problema]).to_numpy()
+        col_prod_problema = next(
+            (c for c in problemas_df.columns if any(x in str(c).upper() for x in ('PRODUTO', 'DESCRI'))), None
+        )
+        pares = pares_problema = None
+        if col_prod_problema is not None and col_desc:
+            pares = base['NCM_normalizado'] + '|' + normalizar_descricoes(df[col_desc])
+            pares_problema = pd.Series(ncms_problema + '|' + normalizar_descricoes(problemas_df[col_prod_problema]).to_numpy())
+            reconhecidos = pares_problema.isin(pares.unique()).to_numpy()
+    else:
+        # Achados locais por linha: NCM + produto + motivo
+        falhas = base[~(base['formato_valido'] & base['na_referencia'])]
+        problemas_df = pd.DataFrame({
+            'NCM': falhas['NCM_normalizado'],
+            'Produto': df.loc[falhas.index, col_desc].astype(str) if col_desc else '',
+            'Problema': falhas['formato_valido'].map({False: 'Formato inválido', True: 'Fora da tabela de referência'}),
+            'estabelecimento': falhas['estabelecimento'],
+        }).drop_duplicates()
+
+    contatos = {}
+    if col_email:
+        emails = df[col_email].dropna().astype(str).str.strip()
+        contatos = emails[emails.str.contains('@')].groupby(estabelecimentos).first().to_dict()
+
+    relatorios = []
+    for estabelecimento, grupo in base.groupby('estabelecimento', sort=True):
+        ncms_loja = grupo['NCM_normalizado']
+        if col_ncm_problema is not None:
+            mascara = pd.Series(ncms_problema).isin(ncms_loja.unique()).to_numpy()
+            if pares is not None:
+                mascara = pares_problema.isin(pares.loc[grupo.index].unique()).to_numpy() | (~reconhecidos & mascara)
+            problemas_loja = problemas_df[mascara]
+        else:
+            problemas_loja = problemas_df[problemas_df['estabelecimento'] == estabelecimento].drop(columns='estabelecimento')
+        total = len(grupo)
+        n_problemas = min(len(problemas_loja), total)
+        relatorios.append(RelatorioEstabelecimento(
+            estabelecimento=estabelecimento,
+            total_produtos=total,
+            ncms_unicos=int(ncms_loja.nunique()),
+            ncms_problemas=n_problemas,
+            percentual_conformidade=(total - n_problemas) / total * 100 if total else 100.0,
+            contato=contatos.get(estabelecimento),
+            problemas_df=problemas_loja.reset_index(drop=True),
+        ))
+    _desfazer_colisoes(relatorios)
+    return relatorios
+
+
+def resumo_estabelecimentos(relatorios: List[RelatorioEstabelecimento]) -> pd.DataFrame:
+    """Uma linha por estabelecimento com as métricas e o nome do PDF"""
+    return pd.DataFrame([{
+        'Estabelecimento': r.estabelecimento,
+        'Produtos': r.total_produtos,
+        'NCMs Únicos': r.ncms_unicos,
+        'Problemas': r.ncms_problemas,
+        'Conformidade (%)': round(r.percentual_conformidade, 1),
+        'Contato': r.contato or '',
+        'Arquivo': r.nome_arquivo,
+    } for r in relatorios])
+
+
+def _gerar_pdf(relatorio: RelatorioEstabelecimento, observacoes: str) -> bytes:
+    """Executado nos processos do pool: cada um cria seu gerador de PDF uma vez"""
+    from pdf_generator import get_pdf_generator
+
+    return get_pdf_generator().gerar_relatorio_pdf(
+        total_produtos=relatorio.total_produtos,
+        ncms_unicos=relatorio.ncms_unicos,
+        ncms_problemas=relatorio.ncms_problemas,
+        percentual_conformidade=relatorio.percentual_conformidade,
+        problemas_df=relatorio.problemas_df,
+        observacoes=f"Estabelecimento: {relatorio.estabelecimento}\n\n{observacoes}",
+    )
+
+
+def gerar_zip_relatorios(
+    relatorios: List[RelatorioEstabelecimento],
+    observacoes: str = "",
+    n_workers: Optional[int] = None,
+    ao_concluir: Optional[Callable[[int, int], None]] = None
+) -> bytes:
+    """
+    Gera o PDF de cada estabelecimento em um pool de processos e monta o ZIP
+
+    Cada PDF entra no arquivo assim que fica pronto (na ordem de conclusão),
+    sem esperar os demais; `pdf_bytes` de cada relatório é preenchido.
+
+    Args:
+        relatorios: Saída de `dividir_por_estabelecimento`
+        observacoes: Análise do agente incluída em todos os PDFs
+        n_workers: PDFs gerados ao mesmo tempo no pool (None = núcleos disponíveis, 1 = no próprio processo)
+        ao_concluir: Chamado com (concluídos, total) a cada PDF pronto
+
+    Returns:
+        Conteúdo do arquivo ZIP
+    """
+    if n_workers is None:
+        n_workers = _nucleos_disponiveis()
+    n_workers = max(1, min(n_workers, len(relatorios)))
+
+    buffer = io.BytesIO()
+    # PDFs já são comprimidos: ZIP_STORED evita recomprimir
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as arquivo:
+        def adicionar(relatorio: RelatorioEstabelecimento, pdf_bytes: bytes, concluidos: int) -> None:
+            relatorio.pdf_bytes = pdf_bytes
+            arquivo.writestr(relatorio.nome_arquivo, pdf_bytes)
+            if ao_concluir:
+                ao_concluir(concluidos, len(relatorios))
+
+        if n_workers == 1 or len(relatorios) < MIN_ESTABELECIMENTOS_PARALELO:
+            for i, relatorio in enumerate(relatorios, 1):
+                adicionar(relatorio, _gerar_pdf(relatorio, observacoes), i)
+        else:
+            pool = get_pool_pdfs()
+            pendentes = iter(relatorios)
+            futures = {}
+
+            def submeter() -> None:
+                relatorio = next(pendentes, None)
+                if relatorio is not None:
+                    futures[pool.submit(_gerar_pdf, relatorio, observacoes)] = relatorio
+
+            # No máximo `n_workers` PDFs no pool ao mesmo tempo; cada um que termina libera o próximo
+            for _ in range(n_workers):
+                submeter()
+            concluidos = 0
+            while futures:
+                prontos, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in prontos:
+                    concluidos += 1
+                    adicionar(futures.pop(future), future.result(), concluidos)
+                    submeter()
+
+        resumo = resumo_estabelecimentos(relatorios)
+        arquivo.writestr("resumo_estabelecimentos.csv", resumo.to_csv(index=False, sep=';').encode('utf-8-sig'))
+    return buffer.getvalue()
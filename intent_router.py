@@ -0,0 +1,164 @@
+"""
+Roteador de intenções do chat: responde perguntas comuns direto dos dados, sem o agente
+"""
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import pandas as pd
+
+from answer_cache import TERMOS_SENTIDO
+from ncm_reference import get_ncm_reference
+from startup_profile import lazy_import
+
+# Código NCM completo ou prefixo logo após a palavra NCM ("ncm 9503", "ncm 2309.10")
+_RE_CODIGO = r'(\d{2,4}(?:[.\-]?\d{2}){0,2})'
+# Sem a palavra NCM, só o que tem cara de NCM: pontuado ("2309.10", "2309.10.00") ou 8 dígitos.
+# Números soltos ("os 10 produtos", "em 2023") são quantidades ou anos e vão para o agente.
+_RE_CODIGO_SOLTO = r'(\d{4}[.\-]\d{2}(?:[.\-]\d{2})?|\d{8})'
+_RE_VALIDAR = re.compile(r'\b(corret|valid|certo|errad|existe|adequad|ok\b)')
+_RE_PRODUTOS = re.compile(r'\b(produto|item|itens|descric|mercadoria)')
+_RE_UNICOS = re.compile(r'\bncms?\b.*\b(unic|distint|diferent)|\bquantos ncms?\b')
+_RE_DISTRIBUICAO = re.compile(r'\b(distribuic|grafico|mais frequent|mais comu)')
+# Perguntas abertas sempre vão para o agente
+_RE_ABERTA = re.compile(r'\b(por ?que|explique|expliqu|analise|sugira|sugest|recomend|compar|como)\b')
+# Negação, exclusão e comparação ("sem NCM 9503", "não têm", "exceto"): as respostas rápidas só
+# entendem o filtro positivo, então essas perguntas vão para o agente. "com"/"por"/"pelo" são o
+# próprio filtro ("produtos com NCM 2309") e "mais" só conta fora de "mais frequentes/comuns".
+_TERMOS_DESVIO = TERMOS_SENTIDO - {'com', 'por', 'pelo', 'pela', 'pelos', 'pelas'}
+_RE_MAIS_FREQUENTE = re.compile(r'\bmais (frequent|comu)')
+
+MAX_LINHAS_TABELA = 100
+
+
+@dataclass
+class RespostaRapida:
+    intencao: str
+    texto: str
+    tabela: Optional[pd.DataFrame] = None
+
+
+def _dobrar(texto: str) -> str:
+    """Minúsculas sem acentos"""
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def _muda_sentido(texto: str) -> bool:
+    """Pergunta com termo de negação, exclusão ou comparação (texto já dobrado)"""
+    return any(t in _TERMOS_DESVIO for t in re.findall(r'[a-z]+', _RE_MAIS_FREQUENTE.sub('', texto)))
+
+
+def _codigo(texto: str) -> Optional[str]:
+    """Primeiro código NCM citado (só dígitos), de preferência logo após a palavra NCM"""
+    achado = (
+        re.search(r'\bncm\s*(?:n[oº]?\s*)?' + _RE_CODIGO + r'\b', texto)
+        or re.search(r'\b' + _RE_CODIGO_SOLTO + r'\b', texto)
+    )
+    return re.sub(r'\D', '', achado.group(1)) if achado else None
+
+
+def _validar(ncm: str, df: pd.DataFrame, perfil: Dict) -> RespostaRapida:
+    resultado = get_ncm_reference().validate_ncm(ncm)
+    if resultado['valido']:
+        linhas = [
+            f"✅ **NCM {ncm} é válido** para o setor pet.",
+            f"- **Categoria:** {resultado['categoria']}",
+            f"- **Descrição:** {resultado['descricao']}",
+            f"- **Observações:** {resultado['observacoes']}",
+        ]
+    else:
+        linhas = [f"❌ **NCM {ncm}:** {resultado['motivo']}."]
+
+    mascara = perfil['validacao']['NCM_normalizado'] == ncm
+    ocorrencias = int(mascara.sum())
+    linhas.append(f"\n**Ocorrências no arquivo:** {ocorrencias}")
+
+    tabela = None
+    desc_col = perfil['colunas_detectadas']['descricao']
+    if ocorrencias and desc_col:
+        exemplos = df.loc[mascara, desc_col].dropna().astype(str)
+        tabela = exemplos.value_counts().head(MAX_LINHAS_TABELA).rename_axis('Produto').reset_index(name='Linhas')
+        if not resultado['valido'] and len(tabela):
+            engine = lazy_import("ncm_suggestion").get_suggestion_engine()
+            sugestoes = engine.melhor_sugestao(tabela['Produto'], similaridade_minima=0.3)
+            tabela = tabela.join(sugestoes[['ncm_sugerido', 'similaridade']], on='Produto')
+            tabela.columns = ['Produto', 'Linhas', 'NCM Sugerido', 'Similaridade']
+    return RespostaRapida('validar NCM', "\n".join(linhas), tabela)
+
+
+def _listar_produtos(prefixo: str, df: pd.DataFrame, perfil: Dict) -> RespostaRapida:
+    ncms = perfil['validacao']['NCM_normalizado']
+    # Prefixo testado só nos NCMs distintos; as linhas são filtradas por pertinência
+    alvo = [ncm for ncm in perfil['resumo_ncms'].index if str(ncm).startswith(prefixo)]
+    mascara = ncms.isin(alvo).to_numpy()
+    total = int(mascara.sum())
+    if not total:
+        return RespostaRapida('listar produtos por NCM', f"Nenhum produto com NCM iniciado por `{prefixo}` no arquivo.")
+
+    desc_col = perfil['colunas_detectadas']['descricao']
+    if desc_col:
+        base = pd.DataFrame({'NCM': ncms[mascara], 'Produto': df.loc[mascara, desc_col]})
+        tabela = (
+            base.groupby(['NCM', 'Produto'], sort=False).size().rename('Linhas')
+            .sort_values(ascending=False).reset_index()
+        )
+        texto = f"**{total} linhas** com NCM iniciado por `{prefixo}` ({len(tabela)} combinações NCM/produto distintas)."
+    else:
+        tabela = df.loc[mascara]
+        texto = f"**{total} linhas** com NCM iniciado por `{prefixo}`."
+    if len(tabela) > MAX_LINHAS_TABELA:
+        texto += f" Mostrando as {MAX_LINHAS_TABELA} primeiras."
+    return RespostaRapida('listar produtos por NCM', texto, tabela.head(MAX_LINHAS_TABELA))
+
+
+def _tabela_resumo(perfil: Dict) -> pd.DataFrame:
+    resumo = perfil['resumo_ncms'].reset_index()
+    if 'exemplos' in resumo.columns:
+        resumo['exemplos'] = resumo['exemplos'].map(lambda e: "; ".join(map(str, e)) if isinstance(e, list) else "")
+    return resumo.rename(columns={
+        'NCM_normalizado': 'NCM', 'quantidade': 'Quantidade', 'formato_valido': 'Formato Válido',
+        'na_referencia': 'Na Referência', 'valor_total': 'Valor Total', 'exemplos': 'Exemplos',
+    })
+
+
+def _ncms_unicos(perfil: Dict) -> RespostaRapida:
+    texto = (
+        f"**{perfil['ncms_unicos']} NCMs únicos** no arquivo "
+        f"({perfil['ncms_formato_invalido']} com formato inválido, "
+        f"{perfil['ncms_fora_referencia']} fora da tabela de referência)."
+    )
+    return RespostaRapida('NCMs únicos', texto, _tabela_resumo(perfil))
+
+
+def _distribuicao(perfil: Dict) -> RespostaRapida:
+    tabela = _tabela_resumo(perfil).head(10)
+    tabela.insert(2, 'Percentual', (tabela['Quantidade'] / perfil['linhas'] * 100).round(1))
+    texto = f"**Top {len(tabela)} NCMs mais frequentes** de {perfil['ncms_unicos']} NCMs únicos em {perfil['linhas']} linhas."
+    return RespostaRapida('distribuição de NCMs', texto, tabela)
+
+
+def rotear_pergunta(pergunta: str, df: pd.DataFrame, perfil: Optional[Dict]) -> Optional[RespostaRapida]:
+    """
+    Responde a pergunta direto dos dados quando ela tem um padrão conhecido
+
+    Returns:
+        RespostaRapida, ou None quando a pergunta deve ir para o agente
+    """
+    if not perfil or perfil.get('validacao') is None:
+        return None
+
+    texto = _dobrar(pergunta)
+    if _RE_ABERTA.search(texto) or _muda_sentido(texto):
+        return None
+
+    codigo = _codigo(texto)
+    if codigo and _RE_VALIDAR.search(texto) and not _RE_PRODUTOS.search(texto):
+        return _validar(codigo, df, perfil)
+    if codigo and _RE_PRODUTOS.search(texto):
+        return _listar_produtos(codigo, df, perfil)
+    if _RE_UNICOS.search(texto):
+        return _ncms_unicos(perfil)
+    if _RE_DISTRIBUICAO.search(texto) and 'ncm' in texto:
+        return _distribuicao(perfil)
+    return None
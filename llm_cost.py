@@ -0,0 +1,155 @@
+"""
+Contagem de tokens, custo estimado e orçamento das chamadas ao modelo
+"""
+import os
+from typing import Any, Callable, Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Preço em US$ por milhão de tokens (entrada, saída)
+PRECOS_POR_MILHAO = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+}
+MODELO_PADRAO = 'gpt-4o-mini'
+
+# Orçamento padrão por execução em US$ (0 = sem limite)
+ORCAMENTO_PADRAO = float(os.getenv('LLM_ORCAMENTO_USD', '0.50'))
+
+# Parâmetros da estimativa prévia de uma validação
+CHAMADAS_ESTIMADAS = 3  # Raciocínio inicial, uma ferramenta e resposta final
+TOKENS_ENTRADA_POR_PAR = 12  # Par (NCM, descrição) em saídas de ferramentas
+TOKENS_SAIDA_POR_PAR = 25  # Linha da tabela de problemas
+TOKENS_SAIDA_FIXOS = 600  # Resumo final e ações recomendadas
+# Tetos do gpt-4o-mini: contexto por chamada e saída máxima por resposta
+CONTEXTO_MAXIMO = 128_000
+SAIDA_MAXIMA = 16_384
+
+
+class OrcamentoExcedido(Exception):
+    """Levantada quando o custo acumulado da execução passa do orçamento"""
+
+
+def calcular_custo(tokens_entrada: int, tokens_saida: int, modelo: str = MODELO_PADRAO) -> float:
+    """Custo estimado em US$"""
+    preco_entrada, preco_saida = PRECOS_POR_MILHAO.get(modelo, PRECOS_POR_MILHAO[MODELO_PADRAO])
+    return (tokens_entrada * preco_entrada + tokens_saida * preco_saida) / 1_000_000
+
+
+def _tokens_aproximados(texto: str) -> int:
+    return len(texto) // 4
+
+
+class MedidorTokens(BaseCallbackHandler):
+    """
+    Acumula tokens de entrada/saída de cada chamada e interrompe acima do orçamento
+
+    Usa o uso informado pela API (token_usage ou usage_metadata). Quando ele não
+    vem (ex.: streaming sem uso no último chunk), estima pelo tamanho do texto.
+    """
+
+    raise_error = True
+
+    def __init__(
+        self,
+        orcamento_usd: float = 0.0,
+        modelo: str = MODELO_PADRAO,
+        ao_atualizar: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        self.orcamento_usd = orcamento_usd
+        self.modelo = modelo
+        self.ao_atualizar = ao_atualizar
+        self.chamadas = 0
+        self.tokens_entrada = 0
+        self.tokens_saida = 0
+        self.estimado = False
+        self._entrada_aproximada = 0
+
+    @property
+    def custo_usd(self) -> float:
+        return calcular_custo(self.tokens_entrada, self.tokens_saida, self.modelo)
+
+    def _verificar_orcamento(self) -> None:
+        if self.orcamento_usd and self.custo_usd > self.orcamento_usd:
+            raise OrcamentoExcedido(
+                f"Orçamento da execução excedido: US$ {self.custo_usd:.4f} de US$ {self.orcamento_usd:.2f} "
+                f"({self.tokens_entrada + self.tokens_saida} tokens em {self.chamadas} chamadas)"
+            )
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        self._verificar_orcamento()
+        self._entrada_aproximada = sum(_tokens_aproximados(p) for p in prompts)
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, **kwargs: Any) -> None:
+        self._verificar_orcamento()
+        self._entrada_aproximada = sum(
+            _tokens_aproximados(str(m.content)) for lote in messages for m in lote
+        )
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        entrada, saida = self._uso_informado(response)
+        if entrada is None:
+            self.estimado = True
+            entrada = self._entrada_aproximada
+            saida = sum(
+                _tokens_aproximados(g.text or str(getattr(getattr(g, 'message', None), 'additional_kwargs', '')))
+                for geracoes in response.generations for g in geracoes
+            )
+        self.chamadas += 1
+        self.tokens_entrada += entrada
+        self.tokens_saida += saida
+        if self.ao_atualizar is not None:
+            self.ao_atualizar(self.resumo())
+        self._verificar_orcamento()
+
+    @staticmethod
+    def _uso_informado(response: Any):
+        uso = (response.llm_output or {}).get('token_usage')
+        if uso:
+            return uso.get('prompt_tokens', 0), uso.get('completion_tokens', 0)
+        for geracoes in response.generations:
+            for g in geracoes:
+                metadata = getattr(getattr(g, 'message', None), 'usage_metadata', None)
+                if metadata:
+                    return metadata.get('input_tokens', 0), metadata.get('output_tokens', 0)
+        return None, None
+
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            'chamadas': self.chamadas,
+            'tokens_entrada': self.tokens_entrada,
+            'tokens_saida': self.tokens_saida,
+            'custo_usd': self.custo_usd,
+            'estimado': self.estimado,
+        }
+
+
+def acumular_uso(total: Optional[Dict[str, Any]], execucao: Dict[str, Any]) -> Dict[str, Any]:
+    """Soma o resumo de uma execução ao total da sessão"""
+    total = dict(total or {'execucoes': 0, 'chamadas': 0, 'tokens_entrada': 0, 'tokens_saida': 0, 'custo_usd': 0.0})
+    total['execucoes'] += 1
+    for chave in ('chamadas', 'tokens_entrada', 'tokens_saida', 'custo_usd'):
+        total[chave] += execucao[chave]
+    return total
+
+
+def estimar_custo_validacao(tokens_prompt: int, pares_unicos: int, modelo: str = MODELO_PADRAO) -> Dict[str, Any]:
+    """
+    Estimativa prévia do custo de uma validação
+
+    Args:
+        tokens_prompt: Tamanho aproximado do prompt do agente (com o perfil do arquivo)
+        pares_unicos: Pares (NCM, descrição) distintos do arquivo, com as quase-duplicatas
+            da descrição agrupadas (`perfil['grupos_unicos']`)
+
+    Returns:
+        Dicionário com tokens_entrada, tokens_saida e custo_usd estimados
+    """
+    por_chamada = min(tokens_prompt + pares_unicos * TOKENS_ENTRADA_POR_PAR // CHAMADAS_ESTIMADAS, CONTEXTO_MAXIMO)
+    tokens_entrada = por_chamada * CHAMADAS_ESTIMADAS
+    tokens_saida = min(TOKENS_SAIDA_FIXOS + pares_unicos * TOKENS_SAIDA_POR_PAR, SAIDA_MAXIMA)
+    return {
+        'tokens_entrada': tokens_entrada,
+        'tokens_saida': tokens_saida,
+        'custo_usd': calcular_custo(tokens_entrada, tokens_saida, modelo),
+    }
@@ -1,17 +1,57 @@
+from startup_profile import lazy_import, marcar_etapa, relatorio_importacao
 import streamlit as st
 import pandas as pd
 import zipfile
 import chardet
 import io
 import os
-from agent_setup_ncm import initialize_llm, create_agent
+import threading
+import time
+from background_jobs import get_job_manager, CONCLUIDO, CANCELADO
+from ncm_validation import validar_ncms
+from ncm_reference import get_ncm_reference
 from utils_ncm import generate_plot, display_validation_results, quick_ncm_validation
-from email_service import email_service
-from pdf_generator import pdf_generator
+from dataset_profile import perfilar_dataset
 from dotenv import load_dotenv
 
+# Módulos pesados (LangChain, ReportLab, matplotlib) e singletons de e-mail/PDF
+# são carregados sob demanda via lazy_import, depois da primeira renderização
+marcar_etapa("imports do main_ncm")
+
 load_dotenv()
 
+VALIDATION_QUERY = """
+Faça validação de conformidade de NCM seguindo EXATAMENTE estes passos:
+
+As colunas, os NCMs únicos com contagens e os exemplos de produtos JÁ ESTÃO
+no perfil do arquivo no seu contexto. NÃO execute df.columns, value_counts
+ou groupby para redescobri-los.
+
+PASSO 1 - Analisar cada NCM do perfil e verificar:
+- Se tem 8 dígitos
+- Se é válido para setor pet
+- Se está adequado à descrição dos produtos de exemplo
+Use as ferramentas validar_ncm / resumir_ncms_arquivo apenas se precisar de detalhes
+que não estão no perfil.
+
+PASSO 2 - Identificar problemas:
+Liste os NCMs com problemas em formato de tabela markdown:
+| NCM | Produto Exemplo | Problema | NCM Sugerido | Severidade |
+
+PASSO 3 - Resumo final:
+- Total de NCMs únicos
+- NCMs com problemas
+- Percentual de conformidade
+- Principais ações recomendadas
+
+IMPORTANTE: 
+- Use os nomes EXATOS das colunas informados no perfil
+- Não crie funções separadas - use apenas operações pandas inline
+"""
+
+# Linhas por lote na validação local feita em segundo plano
+TAMANHO_LOTE_VALIDACAO = 100_000
+
 def main():
     st.title("🐾 Agente de Conformidade Fiscal NCM - Setor Pet")
     st.markdown("**Validação automática de NCM em notas fiscais para clínicas veterinárias e pet shops**")
@@ -43,27 +83,46 @@ def main():
         
         st.divider()
         st.caption("💡 O relatório PDF será gerado automaticamente")
+        
+        modo_streaming = st.checkbox(
+            "Mostrar resposta do agente em tempo real",
+            value=True,
+            help="Exibe passos e texto da resposta à medida que chegam, com opção de cancelar",
+            key="modo_streaming"
+        )
 
     uploaded_file = st.file_uploader(
         "Faça upload do arquivo zip com o CSV de notas fiscais", 
         type="zip",
         key="file_uploader"
     )
+    marcar_etapa("primeira renderização")
+
+    with st.sidebar:
+        with st.expander("⏱️ Tempo de inicialização"):
+            st.dataframe(relatorio_importacao(), hide_index=True, use_container_width=True)
 
     if uploaded_file is not None:
         # Só carrega dados se mudou o arquivo ou ainda não foi carregado
         if "current_file" not in st.session_state or st.session_state.current_file != uploaded_file.name:
             st.session_state.current_file = uploaded_file.name
             st.session_state.validation_done = False
+            # Validação ainda em andamento refere-se ao arquivo anterior
+            if st.session_state.get("validation_job_id"):
+                get_job_manager().cancelar(st.session_state.validation_job_id)
+                st.session_state.validation_job_id = None
             df = load_data(uploaded_file)
             if df is None:
                 return
             st.session_state.validation_df = df
+            # Perfil (schema, colunas-chave, contagens por NCM) calculado uma vez por arquivo
+            st.session_state.dataset_profile = perfilar_dataset(df)
         else:
             df = st.session_state.validation_df
         
         if df is not None:
             display_data_preview(df)
+            exibir_estimativa_amostral(df, st.session_state.get("dataset_profile"))
 
             if "openai_api_key" not in st.session_state:
                 st.session_state.openai_api_key = ""
@@ -80,10 +139,27 @@ def main():
                 st.session_state.openai_api_key = api_key_input
                 st.success("✅ Chave API configurada com sucesso!")
 
-                llm = initialize_llm(st.session_state.openai_api_key)
+                agent_setup = lazy_import("agent_setup_ncm")
+                llm = agent_setup.initialize_llm(st.session_state.openai_api_key, streaming=modo_streaming)
 
                 if llm:
-                    agent = create_agent(llm, df)
+                    agent = agent_setup.create_agent(llm, df, st.session_state.get("dataset_profile"))
+                    llm_cost = lazy_import("llm_cost")
+                    
+                    with st.sidebar:
+                        st.divider()
+                        st.header("💰 Custo do Modelo")
+                        orcamento = st.number_input(
+                            "Orçamento por execução (US$):",
+                            min_value=0.0,
+                            value=llm_cost.ORCAMENTO_PADRAO,
+                            step=0.10,
+                            format="%.2f",
+                            help="A execução é interrompida ao ultrapassar este valor (0 = sem limite)",
+                            key="orcamento_llm"
+                        )
+                        painel_uso = st.empty()
+                    exibir_uso_sessao(painel_uso)
 
                     # VALIDAÇÃO MANUAL RÁPIDA (backup se o agente falhar)
                     with st.expander("🔧 Validação Manual Rápida (não usa IA)"):
@@ -94,75 +170,69 @@ def main():
                     # VALIDAÇÃO AUTOMÁTICA COM IA
                     st.subheader("🔍 Validação Automática de Conformidade com IA")
                     
-                    if st.button("🚀 Iniciar Validação Automática de NCM", key="btn_validacao"):
-                        with st.spinner("Validando NCMs das notas fiscais..."):
-                            try:
-                                validation_query = """
-                                Faça validação de conformidade de NCM seguindo EXATAMENTE estes passos:
-                                
-                                PASSO 1 - Identificar colunas (CRÍTICO):
-                                Execute: df.columns.tolist()
-                                Mostre TODAS as colunas encontradas.
-                                
-                                PASSO 2 - Encontrar colunas NCM e Descrição:
-                                Encontre a coluna que contém NCM (pode ser 'NCM', 'CODIGO_NCM', etc.)
-                                Encontre a coluna com descrição do produto (pode ser 'DESCRICAO_PRODUTO', 'PRODUTO', etc.)
-                                Use os nomes EXATOS (case-sensitive) das colunas.
-                                
-                                PASSO 3 - Normalizar NCMs:
-                                Execute: df['NCM_norm'] = df[nome_coluna_ncm].astype(str).str.replace('.','').str.replace('-','')
-                                Mostre: df['NCM_norm'].value_counts()
-                                
-                                PASSO 4 - Agrupar e analisar:
-                                Para cada NCM único, pegue um exemplo de descrição de produto.
-                                Execute: df.groupby('NCM_norm')[nome_coluna_descricao].first()
-                                
-                                PASSO 5 - Identificar problemas:
-                                Analise cada NCM único e verifique:
-                                - Se tem 8 dígitos
-                                - Se é válido para setor pet
-                                - Se está adequado à descrição do produto
-                                
-                                Liste os NCMs com problemas em formato de tabela markdown:
-                                | NCM | Produto Exemplo | Problema | NCM Sugerido | Severidade |
-                                
-                                PASSO 6 - Resumo final:
-                                - Total de NCMs únicos
-                                - NCMs com problemas
-                                - Percentual de conformidade
-                                - Principais ações recomendadas
-                                
-                                IMPORTANTE: 
-                                - Use astype(str) ANTES de qualquer operação de string no NCM
-                                - Use os nomes EXATOS das colunas que aparecem em df.columns
-                                - Não crie funções separadas - use apenas operações pandas inline
-                                """
-                                
-                                response = agent.run(validation_query)
-                                
-                                # Armazena resultado na sessão
-                                st.session_state.validation_response = response
-                                st.session_state.validation_done = True
-                                
-                            except Exception as e:
-                                st.error(f"❌ Erro ao processar validação: {str(e)}")
-                                st.info("💡 Tente usar a Validação Manual Rápida acima ou fazer perguntas mais simples no chat abaixo.")
-                                
-                                # Mostra informações de debug
-                                with st.expander("🔍 Informações de Debug"):
-                                    st.write("**Colunas do DataFrame:**")
-                                    st.write(df.columns.tolist())
-                                    st.write("\n**Primeiras linhas:**")
-                                    st.write(df.head())
+                    if st.session_state.pop("execucao_cancelada", False):
+                        st.warning("⏹️ Execução cancelada.")
+                    
+                    aviso_orcamento = st.session_state.pop("validation_budget", None)
+                    if aviso_orcamento:
+                        st.warning(f"💰 {aviso_orcamento}. Aumente o orçamento na barra lateral para concluir a validação.")
+                    
+                    # Estimativa prévia: arquivos enormes não gastam sem aviso
+                    perfil = st.session_state.get("dataset_profile")
+                    if perfil:
+                        estimativa = llm_cost.estimar_custo_validacao(
+                            len(agent_setup.montar_prompt(perfil)) // 4, perfil['grupos_unicos']
+                        )
+                        st.caption(
+                            f"💰 Estimativa: ~{estimativa['tokens_entrada'] + estimativa['tokens_saida']:,} tokens "
+                            f"(~US$ {estimativa['custo_usd']:.4f}) para {perfil['grupos_unicos']:,} grupos de produtos "
+                            f"({perfil['pares_unicos']:,} pares NCM, descrição únicos)"
+                        )
+                        if orcamento and estimativa['custo_usd'] > orcamento:
+                            st.warning(
+                                f"⚠️ A estimativa passa do orçamento de US$ {orcamento:.2f}: "
+                                "a validação provavelmente será interrompida antes do fim."
+                            )
+                    
+                    if st.button("🚀 Iniciar Validação Automática de NCM", key="btn_validacao",
+                                 disabled=st.session_state.get("validation_job_id") is not None):
+                        # Roda em segundo plano: interações com a página não descartam o trabalho.
+                        # Agente com memória própria: o chat pode usar a dele ao mesmo tempo
+                        agente_job = agent_setup.create_agent(llm, df, perfil, memoria_isolada=True)
+                        job = get_job_manager().submit(
+                            "Validação de NCM", _pipeline_validacao,
+                            agente_job, df, perfil, VALIDATION_QUERY, orcamento, st.session_state.current_file
+                        )
+                        st.session_state.validation_job_id = job.id
+                        st.session_state.validation_done = False
+                    
+                    if st.session_state.get("validation_job_id"):
+                        acompanhar_validacao()
                     
+                    erro_validacao = st.session_state.pop("validation_error", None)
+                    if erro_validacao:
+                        st.error("❌ Erro ao processar validação")
+                        st.info("💡 Tente usar a Validação Manual Rápida acima ou fazer perguntas mais simples no chat abaixo.")
+                        
+                        # Mostra informações de debug
+                        with st.expander("🔍 Informações de Debug"):
+                            st.code(erro_validacao)
+                            st.write("**Colunas do DataFrame:**")
+                            st.write(df.columns.tolist())
+                            st.write("\n**Primeiras linhas:**")
+                            st.write(df.head())
+                
                     # Mostra resultado se validação foi feita
                     if st.session_state.validation_done and st.session_state.validation_response:
                         display_validation_results(st.session_state.validation_response)
+                        exibir_uso_execucao(st.session_state.get("uso_ultima_validacao"))
                         gerar_e_exibir_relatorio(
                             df, 
                             st.session_state.validation_response, 
                             email_destinatario, 
-                            enviar_email_auto
+                            enviar_email_auto,
+                            st.session_state.get("validation_report"),
+                            perfil
                         )
 
                     # CHAT INTERATIVO
@@ -172,35 +242,279 @@ def main():
                     # Usar form para evitar recarregamento
                     with st.form(key="chat_form"):
                         user_query = st.text_input("Sua pergunta:", key="user_query_input")
+                        ignorar_cache = st.checkbox("Ignorar respostas em cache", key="ignorar_cache")
                         submit_chat = st.form_submit_button("Enviar")
                     
                     if submit_chat and user_query:
-                        with st.spinner("Analisando..."):
-                            try:
-                                response = agent.run(user_query)
+                        try:
+                            # Perguntas com padrão conhecido são respondidas direto dos dados, sem o agente
+                            rapida = lazy_import("intent_router").rotear_pergunta(user_query, df, perfil)
+                            
+                            # Perguntas iguais ou semelhantes sobre o mesmo arquivo não chamam o agente de novo
+                            answer_cache = lazy_import("answer_cache").get_answer_cache()
+                            fingerprint = perfil['fingerprint'] if perfil else None
+                            cacheada = None
+                            if rapida is None and not ignorar_cache and fingerprint:
+                                cacheada = answer_cache.buscar(fingerprint, user_query)
+                            
+                            if rapida is not None:
+                                st.caption(f"⚡ Respondido direto dos dados, sem IA ({rapida.intencao})")
+                                st.markdown(rapida.texto)
+                                if rapida.tabela is not None:
+                                    st.dataframe(rapida.tabela, use_container_width=True, hide_index=True)
+                                response = rapida.texto
+                            elif cacheada is not None:
+                                st.caption(
+                                    f"⚡ Resposta do cache (pergunta semelhante: \"{cacheada.pergunta}\", "
+                                    f"similaridade {cacheada.similaridade:.0%}, há {cacheada.idade_segundos / 60:.0f} min)"
+                                )
+                                response = cacheada.resposta
                                 display_response(response)
-                                generate_plot(user_query, df)
-                            except Exception as e:
-                                st.error(f"Erro ao processar: {str(e)}")
+                            else:
+                                response = executar_agente(
+                                    agent, user_query, modo_streaming, "Analisando...", "btn_cancelar_chat", orcamento
+                                )
+                                exibir_uso_sessao(painel_uso)
+                                if response is not None:
+                                    if fingerprint:
+                                        answer_cache.guardar(fingerprint, user_query, response)
+                                    if not modo_streaming:
+                                        display_response(response)
+                            if response is not None:
+                                generate_plot(user_query, perfil)
+                        except Exception as e:
+                            st.error(f"Erro ao processar: {str(e)}")
                 else:
                     st.error("❌ Chave API inválida ou não fornecida. Por favor, insira uma chave válida.")
             else:
                 st.warning("⚠️ Por favor, insira sua chave OpenAI API para continuar.")
     else:
         st.info("📁 Por favor, faça upload de um arquivo zip contendo o CSV de notas fiscais.")
+    
+    exibir_tendencias()
+    exibir_comparacao(
+        st.session_state.validation_df if uploaded_file is not None else None,
+        st.session_state.get("dataset_profile")
+    )
+    
+    if st.session_state.get("emails_enfileirados"):
+        with st.sidebar:
+            st.divider()
+            st.header("📤 Fila de E-mails")
+            exibir_fila_emails()
+
+
+def _cancelar_execucao():
+    """Callback do botão Cancelar: sinaliza o agente em andamento desta sessão"""
+    st.session_state.execucao_cancelada = True
+    if "cancel_event" in st.session_state:
+        st.session_state.cancel_event.set()
+
+
+def executar_agente(agent, query, streaming, mensagem_spinner, chave_cancelar, orcamento=0.0):
+    """Executa o agente em modo streaming (com botão Cancelar) ou aguardando a resposta completa"""
+    llm_cost = lazy_import("llm_cost")
+    medidor = llm_cost.MedidorTokens(orcamento)
+    try:
+        if not streaming:
+            with st.spinner(mensagem_spinner):
+                return agent.run(query, callbacks=[medidor])
+        
+        agent_streaming = lazy_import("agent_streaming")
+        cancel_event = st.session_state.setdefault("cancel_event", threading.Event())
+        cancel_event.clear()
+        
+        # O clique em Cancelar dispara um rerun: o Streamlit interrompe este script
+        # na próxima atualização da interface feita pelo callback de streaming
+        st.button("⏹️ Cancelar", key=chave_cancelar, on_click=_cancelar_execucao)
+        st.write("**💡 Resposta do Agente:**")
+        try:
+            return agent_streaming.executar_com_streaming(
+                agent, query, st.container(), cancel_event, callbacks=[medidor]
+            )
+        except agent_streaming.ExecucaoCancelada:
+            st.warning("⏹️ Execução cancelada.")
+            return None
+    except llm_cost.OrcamentoExcedido as e:
+        st.warning(f"💰 {e}")
+        return None
+    finally:
+        # Chamadas já feitas contam mesmo em execuções canceladas ou interrompidas
+        registrar_uso(medidor.resumo())
+        exibir_uso_execucao(medidor.resumo())
+
+
+def registrar_uso(uso):
+    """Soma o uso de uma execução ao total da sessão"""
+    if uso and uso['chamadas']:
+        st.session_state.uso_llm = lazy_import("llm_cost").acumular_uso(st.session_state.get("uso_llm"), uso)
+
+
+def exibir_uso_execucao(uso):
+    """Tokens e custo estimado de uma execução"""
+    if uso and uso['chamadas']:
+        st.caption(
+            f"🧮 {uso['chamadas']} chamadas ao modelo | {uso['tokens_entrada']:,} tokens de entrada, "
+            f"{uso['tokens_saida']:,} de saída | ~US$ {uso['custo_usd']:.4f}"
+            + (" (parcialmente estimado)" if uso['estimado'] else "")
+        )
+
+
+def exibir_uso_sessao(painel):
+    """Totais da sessão na barra lateral"""
+    total = st.session_state.get("uso_llm")
+    if not total:
+        painel.caption("Nenhuma chamada ao modelo nesta sessão")
+        return
+    painel.markdown(
+        f"**Sessão:** {total['execucoes']} execuções, {total['chamadas']} chamadas  \n"
+        f"{total['tokens_entrada'] + total['tokens_saida']:,} tokens | **~US$ {total['custo_usd']:.4f}**"
+    )
 
 
-def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto):
-    """Gera PDF e envia e-mail se configurado"""
+def _pipeline_validacao(job, agent, df, perfil, query, orcamento=0.0, arquivo=None):
+    """
+    Validação completa executada na thread do job (sem chamadas ao Streamlit)
     
-    st.markdown("---")
-    st.subheader("📄 Relatório")
+    Etapas: contagem da validação local dos NCMs em lotes, análise do agente,
+    geração do PDF e registro no histórico de validações.
+    O progresso de cada etapa é publicado no Job e lido pela página.
+    O `agent` deve ter memória própria (`create_agent(..., memoria_isolada=True)`):
+    o chat da sessão usa a dele enquanto o job roda.
+    """
+    total_linhas = len(df)
+    total_lotes = max(1, -(-total_linhas // TAMANHO_LOTE_VALIDACAO))
+    job.atualizar(etapa="Validando NCMs localmente", total_linhas=total_linhas, total_lotes=total_lotes)
     
-    # Debug: Mostra parte da resposta
-    with st.expander("🔍 Debug - Resposta do Agente"):
-        st.text(response[:500])
+    # A validação por linha já está no perfil do arquivo; os lotes só dão progresso e cancelamento
+    validacao = perfil.get('validacao') if perfil else None
+    if validacao is None:
+        ncm_cols = [col for col in df.columns if 'ncm' in col.lower()]
+        if ncm_cols:
+            validacao = validar_ncms(df[ncm_cols[0]], get_ncm_reference().get_all_valid_ncms())
+    validacao_local = {'formato_invalido': 0, 'fora_referencia': 0}
+    if validacao is not None:
+        formato_invalido = ~validacao['formato_valido'].to_numpy()
+        fora_referencia = ~validacao['na_referencia'].to_numpy()
+        for lote, inicio in enumerate(range(0, total_linhas, TAMANHO_LOTE_VALIDACAO), start=1):
+            if job.cancel_event.is_set():
+                return None
+            fim = min(inicio + TAMANHO_LOTE_VALIDACAO, total_linhas)
+            validacao_local['formato_invalido'] += int(formato_invalido[inicio:fim].sum())
+            validacao_local['fora_referencia'] += int(fora_referencia[inicio:fim].sum())
+            job.atualizar(linhas_processadas=fim, lotes_concluidos=lote, progresso=0.2 * lote / total_lotes)
+    
+    job.atualizar(etapa="Analisando com o agente", progresso=0.2)
+    agent_streaming = lazy_import("agent_streaming")
+    llm_cost = lazy_import("llm_cost")
+    handler = agent_streaming.JobAgentCallback(job, agent.max_iterations, 0.2, 0.9)
+    medidor = llm_cost.MedidorTokens(orcamento, ao_atualizar=lambda uso: job.atualizar(uso_llm=uso))
+    try:
+        response = agent.run(query, callbacks=[handler, medidor])
+    except llm_cost.OrcamentoExcedido as e:
+        return {'response': None, 'orcamento_excedido': str(e)}
+    
+    job.atualizar(etapa="Gerando relatório PDF", progresso=0.9, texto_parcial=response)
+    relatorio = dict(obter_relatorio(df, response, perfil['fingerprint'] if perfil else None))
+    relatorio['validacao_local'] = validacao_local
+    
+    job.atualizar(etapa="Registrando no histórico", progresso=0.97)
+    validation_history = lazy_import("validation_history")
+    try:
+        validation_history.registrar_validacao(
+            validation_history.get_historico(), df, perfil, relatorio, arquivo, id_execucao=job.id
+        )
+    except Exception as e:
+        # Falha no histórico (ex.: disco cheio) não invalida a validação
+        relatorio['aviso'] = relatorio['aviso'] or ('warning', f"⚠️ Validação não registrada no histórico: {e}")
+    return {'response': response, 'relatorio': relatorio}
+
+
+def _cancelar_validacao(job_id):
+    """Callback do botão Cancelar da validação em segundo plano"""
+    get_job_manager().cancelar(job_id)
+
+
+@st.fragment(run_every=1.0)
+def acompanhar_validacao():
+    """Mostra o progresso do job de validação da sessão e recolhe o resultado quando termina"""
+    job = get_job_manager().get(st.session_state.get("validation_job_id"))
+    
+    if job is None:
+        # Job descartado (ex.: servidor reiniciado)
+        st.session_state.validation_job_id = None
+        st.session_state.validation_error = "Validação em segundo plano não encontrada. Inicie novamente."
+        st.rerun()
     
-    # Extrai métricas da resposta do agente
+    if job.ativo:
+        st.progress(job.progresso, text=f"⏳ {job.etapa or 'Aguardando na fila...'}")
+        detalhes = [
+            f"Linhas: {job.linhas_processadas:,}/{job.total_linhas:,}",
+            f"Lotes: {job.lotes_concluidos}/{job.total_lotes}",
+        ]
+        if job.passos:
+            detalhes.append(f"Passos do agente: {len(job.passos)} (último: {job.passos[-1]})")
+        if job.uso_llm:
+            detalhes.append(f"Custo: ~US$ {job.uso_llm['custo_usd']:.4f}")
+        detalhes.append(f"Decorrido: {job.tempo_decorrido:.0f}s")
+        if job.eta_segundos is not None:
+            detalhes.append(f"Restante: ~{job.eta_segundos:.0f}s")
+        st.caption(" | ".join(detalhes))
+        if job.texto_parcial:
+            st.markdown(job.texto_parcial + "▌")
+        st.button("⏹️ Cancelar", key="btn_cancelar_validacao", on_click=_cancelar_validacao, args=(job.id,))
+        return
+    
+    # Terminou: resultado passa para a sessão e a página inteira é redesenhada
+    st.session_state.validation_job_id = None
+    registrar_uso(job.uso_llm)
+    st.session_state.uso_ultima_validacao = job.uso_llm
+    if job.status == CONCLUIDO and job.resultado is not None and job.resultado.get('orcamento_excedido'):
+        st.session_state.validation_budget = job.resultado['orcamento_excedido']
+    elif job.status == CONCLUIDO and job.resultado is not None:
+        st.session_state.validation_response = job.resultado['response']
+        st.session_state.validation_report = job.resultado['relatorio']
+        st.session_state.validation_done = True
+        # O job usou memória própria; o chat passa a conhecer a validação aqui, na thread da página
+        if "memory" in st.session_state:
+            st.session_state.memory.save_context({'input': VALIDATION_QUERY}, {'output': job.resultado['response']})
+    elif job.status == CANCELADO or job.resultado is None:
+        st.session_state.execucao_cancelada = True
+    else:
+        st.session_state.validation_error = job.erro
+    st.rerun()
+
+
+def obter_relatorio(df, response, fingerprint=None):
+    """
+    Relatório do resultado (calculado só na primeira vez para cada arquivo + resposta)
+    
+    Returns:
+        Dicionário de `calcular_relatorio` com a chave 'chave' identificando o resultado
+    """
+    report_cache = lazy_import("report_cache")
+    if fingerprint is None:
+        fingerprint = lazy_import("dataset_profile").fingerprint_dataframe(df)
+    chave = report_cache.chave_relatorio(fingerprint, response)
+    cache = report_cache.get_report_cache()
+    relatorio = cache.obter(chave)
+    if relatorio is None:
+        relatorio = calcular_relatorio(df, response)
+        relatorio['chave'] = chave
+        cache.guardar(chave, relatorio)
+    return relatorio
+
+
+def calcular_relatorio(df, response):
+    """
+    Extrai métricas da resposta do agente e gera o PDF
+    
+    Não usa o Streamlit: pode rodar na thread de um job de validação.
+    
+    Returns:
+        Dicionário com métricas, DataFrame de problemas, bytes do PDF e
+        aviso opcional (tipo, mensagem) sobre a extração da tabela
+    """
     total_produtos = len(df)
     ncm_cols = [col for col in df.columns if 'ncm' in col.lower()]
     
@@ -212,12 +526,13 @@ def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto):
         ncms_unicos = 0
     
     # Extrai DataFrame de problemas da resposta
-    problemas_df = extrair_problemas_da_resposta(response)
+    problemas_df, erro_extracao = extrair_problemas_da_resposta(response)
+    aviso = None
     
     # Conta problemas reais do DataFrame extraído
     if problemas_df is not None and not problemas_df.empty and 'Resumo' not in problemas_df.columns:
         ncms_problemas = len(problemas_df)
-        st.info(f"✅ Detectados {ncms_problemas} problemas na análise")
+        aviso = ('info', f"✅ Detectados {ncms_problemas} problemas na análise")
     else:
         # Tenta contar por palavras-chave na resposta
         response_upper = response.upper()
@@ -233,23 +548,66 @@ def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto):
         
         # Se encontrou menções mas não extraiu tabela, avisa
         if ncms_problemas > 0:
-            st.warning(f"⚠️ Detectados {ncms_problemas} menções de problemas, mas tabela não foi extraída corretamente")
+            aviso = ('warning', f"⚠️ Detectados {ncms_problemas} menções de problemas, mas tabela não foi extraída corretamente")
+    if erro_extracao:
+        aviso = ('warning', f"⚠️ Erro ao extrair tabela: {erro_extracao}" + (f" ({aviso[1]})" if aviso else ""))
     
     percentual_conformidade = ((total_produtos - ncms_problemas) / total_produtos * 100) if total_produtos > 0 else 100
     
     # Gera PDF com dados reais
-    pdf_filename = "relatorio_ncm.pdf"
+    pdf_generator = lazy_import("pdf_generator").get_pdf_generator()
+    # PDF em memória: cada sessão/job tem o seu, sem arquivo compartilhado em disco
+    pdf_bytes = pdf_generator.gerar_relatorio_pdf(
+        total_produtos=total_produtos,
+        ncms_unicos=ncms_unicos,
+        ncms_problemas=ncms_problemas,
+        percentual_conformidade=percentual_conformidade,
+        problemas_df=problemas_df,
+        observacoes=response[:2000]  # Primeiros 2000 caracteres da análise
+    )
+    
+    return {
+        'total_produtos': total_produtos,
+        'ncms_unicos': ncms_unicos,
+        'ncms_problemas': ncms_problemas,
+        'percentual_conformidade': percentual_conformidade,
+        'problemas_df': problemas_df,
+        'pdf_bytes': pdf_bytes,
+        'aviso': aviso,
+    }
+
+
+def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto, relatorio=None, perfil=None):
+    """Exibe métricas e PDF (obtendo-os do cache se não vierem prontos do job) e envia e-mail se configurado"""
+    
+    st.markdown("---")
+    st.subheader("📄 Relatório")
+    
+    # Debug: Mostra parte da resposta
+    with st.expander("🔍 Debug - Resposta do Agente"):
+        st.text(response[:500])
     
     try:
-        with st.spinner("Gerando relatório PDF..."):
-            pdf_path = pdf_generator.gerar_relatorio_pdf(
-                filename=pdf_filename,
-                total_produtos=total_produtos,
-                ncms_unicos=ncms_unicos,
-                ncms_problemas=ncms_problemas,
-                percentual_conformidade=percentual_conformidade,
-                problemas_df=problemas_df,
-                observacoes=response[:2000]  # Primeiros 2000 caracteres da análise
+        if relatorio is None:
+            with st.spinner("Gerando relatório PDF..."):
+                relatorio = obter_relatorio(df, response, perfil['fingerprint'] if perfil else None)
+        
+        total_produtos = relatorio['total_produtos']
+        ncms_unicos = relatorio['ncms_unicos']
+        ncms_problemas = relatorio['ncms_problemas']
+        percentual_conformidade = relatorio['percentual_conformidade']
+        problemas_df = relatorio['problemas_df']
+        pdf_bytes = relatorio['pdf_bytes']
+        
+        if relatorio['aviso']:
+            tipo, mensagem = relatorio['aviso']
+            getattr(st, tipo)(mensagem)
+        
+        validacao_local = relatorio.get('validacao_local')
+        if validacao_local:
+            st.caption(
+                f"Validação local: {validacao_local['formato_invalido']} linhas com NCM fora do formato de 8 dígitos, "
+                f"{validacao_local['fora_referencia']} fora da tabela de referência"
             )
         
         # Mostra métricas na interface
@@ -271,13 +629,24 @@ def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto):
         col1, col2 = st.columns(2)
         
         with col1:
-            with open(pdf_filename, "rb") as pdf_file:
-                pdf_bytes = pdf_file.read()
+            st.download_button(
+                label="📥 Baixar Relatório PDF",
+                data=pdf_bytes,
+                file_name=f"relatorio_ncm_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                mime="application/pdf",
+                use_container_width=True
+            )
+            email_templates = lazy_import("email_templates")
+            problems_table = lazy_import("problems_table")
+            if problemas_df is not None and len(problemas_df) > email_templates.MAX_PROBLEMAS_EMAIL:
+                # Lista completa em planilha (o e-mail traz só os mais graves); gerada uma vez por relatório
+                if 'problemas_csv_gz' not in relatorio:
+                    relatorio['problemas_csv_gz'] = problems_table.compactar_problemas_csv(problemas_df)
                 st.download_button(
-                    label="📥 Baixar Relatório PDF",
-                    data=pdf_bytes,
-                    file_name=f"relatorio_ncm_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                    mime="application/pdf",
+                    label="📥 Baixar Todos os Problemas (CSV)",
+                    data=relatorio['problemas_csv_gz'],
+                    file_name=problems_table.NOME_ANEXO_PROBLEMAS,
+                    mime="application/gzip",
                     use_container_width=True
                 )
         
@@ -291,13 +660,15 @@ def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto):
                         ncms_problemas,
                         percentual_conformidade,
                         problemas_df,
-                        pdf_filename
+                        pdf_bytes
                     )
             else:
                 st.info("Configure o e-mail na sidebar para enviar relatório")
         
-        # Envio automático
-        if enviar_auto and email_destinatario:
+        # Envio automático: uma vez por relatório e destinatário, não a cada rerun
+        envio_auto = (relatorio.get('chave'), email_destinatario)
+        if enviar_auto and email_destinatario and st.session_state.get("email_auto_enviado") != envio_auto:
+            st.session_state.email_auto_enviado = envio_auto
             enviar_relatorio_email(
                 email_destinatario, 
                 total_produtos,
@@ -305,19 +676,76 @@ def gerar_e_exibir_relatorio(df, response, email_destinatario, enviar_auto):
                 ncms_problemas,
                 percentual_conformidade,
                 problemas_df,
-                pdf_filename
+                pdf_bytes
             )
         
         st.success("✅ Relatório PDF gerado com sucesso!")
         
+        exibir_relatorios_por_estabelecimento(df, perfil, response, relatorio)
+        
     except Exception as e:
         st.error(f"Erro ao gerar relatório: {str(e)}")
         import traceback
         st.code(traceback.format_exc())
 
 
-def extrair_problemas_da_resposta(response: str) -> pd.DataFrame:
-    """Extrai problemas da resposta do agente e cria DataFrame"""
+def exibir_relatorios_por_estabelecimento(df, perfil, response, relatorio):
+    """Um PDF por CNPJ/loja (gerados em paralelo), download em ZIP e envio ao contato de cada loja"""
+    col_est = perfil['colunas_detectadas'].get('estabelecimento') if perfil else None
+    if col_est is None:
+        return
+    n_estabelecimentos = df[col_est].nunique()
+    if n_estabelecimentos < 2:
+        return
+    
+    establishment_reports = lazy_import("establishment_reports")
+    st.markdown("---")
+    st.subheader("🏬 Relatórios por Estabelecimento")
+    
+    gerados = st.session_state.get("relatorios_estabelecimento")
+    if gerados is None or gerados['chave'] != relatorio.get('chave'):
+        st.caption(f"{n_estabelecimentos} estabelecimentos na coluna `{col_est}`")
+        if not st.button("🏬 Gerar um relatório por estabelecimento", use_container_width=True):
+            return
+        relatorios = establishment_reports.dividir_por_estabelecimento(df, perfil, relatorio['problemas_df'])
+        barra = st.progress(0.0, text="Gerando PDFs...")
+        zip_bytes = establishment_reports.gerar_zip_relatorios(
+            relatorios,
+            observacoes=response[:2000],
+            ao_concluir=lambda feitos, total: barra.progress(feitos / total, text=f"Gerando PDFs: {feitos}/{total}")
+        )
+        barra.empty()
+        gerados = {'chave': relatorio.get('chave'), 'relatorios': relatorios, 'zip': zip_bytes}
+        st.session_state.relatorios_estabelecimento = gerados
+    
+    st.dataframe(establishment_reports.resumo_estabelecimentos(gerados['relatorios']),
+                 hide_index=True, use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📦 Baixar Relatórios (ZIP)",
+            data=gerados['zip'],
+            file_name=f"relatorios_ncm_estabelecimentos_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip",
+            use_container_width=True
+        )
+    with col2:
+        com_contato = [r for r in gerados['relatorios'] if r.contato]
+        if com_contato:
+            if st.button(f"📧 Enviar a cada loja ({len(com_contato)} contatos)", use_container_width=True):
+                enviar_relatorios_estabelecimentos(com_contato)
+        else:
+            st.info("Inclua uma coluna de e-mail no arquivo para enviar a cada loja")
+
+
+def extrair_problemas_da_resposta(response: str):
+    """
+    Extrai problemas da resposta do agente e cria DataFrame (sem chamadas ao Streamlit)
+
+    Returns:
+        (DataFrame de problemas, vazio se não houver tabela; mensagem de erro da extração ou None)
+    """
     
     # Procura por tabela markdown na resposta
     linhas = response.split('\n')
@@ -381,58 +809,342 @@ def extrair_problemas_da_resposta(response: str) -> pd.DataFrame:
                     
                     if dados_ajustados:
                         df_problemas = pd.DataFrame(dados_ajustados, columns=colunas)
-                        return df_problemas
+                        return df_problemas, None
             except Exception as e:
-                st.warning(f"Erro ao extrair tabela: {e}")
+                # Roda na thread do job: o aviso volta no relatório, não vai para a página
+                return pd.DataFrame(), str(e)
     
     # Se não encontrou tabela, retorna DataFrame vazio
-    return pd.DataFrame()
+    return pd.DataFrame(), None
+
+
+def montar_email_relatorio(email_service, total, ncms_unicos, problemas, conformidade, problemas_df):
+    """
+    Assunto, corpo HTML e anexo CSV gzip do e-mail de relatório (sem chamadas ao Streamlit)
+
+    O corpo lista só os problemas mais graves; quando há mais, a lista completa
+    vai no anexo (None quando cabe inteira no corpo).
+    """
+    email_templates = lazy_import("email_templates")
+    problemas_html = email_templates.resumo_problemas_html(problemas_df)
+    anexo_csv = None
+    if problemas_df is not None and len(problemas_df) > email_templates.MAX_PROBLEMAS_EMAIL:
+        anexo_csv = lazy_import("problems_table").compactar_problemas_csv(problemas_df)
+    
+    # Gera corpo do e-mail com resumo executivo
+    corpo_html = email_service.gerar_corpo_email_html(
+        total_produtos=total,
+        ncms_unicos=ncms_unicos,
+        ncms_problemas=problemas,
+        percentual_conformidade=conformidade,
+        problemas_lista=problemas_html
+    )
+    assunto = f"Relatório de Conformidade NCM - {pd.Timestamp.now().strftime('%d/%m/%Y')}"
+    return assunto, corpo_html, anexo_csv
+
+
+def enfileirar_emails(mensagens):
+    """Grava as mensagens na caixa de saída (retorna na hora; o envio é em segundo plano)"""
+    outbox = lazy_import("email_outbox").get_outbox()
+    ids = [outbox.enfileirar(msg) for msg in mensagens]
+    st.session_state.setdefault("emails_enfileirados", []).extend(ids)
+    return ids
 
 
-def enviar_relatorio_email(destinatario, total, ncms_unicos, problemas, conformidade, problemas_df, pdf_path):
-    """Envia relatório por e-mail com resumo executivo e PDF anexado"""
+def enviar_relatorio_email(destinatario, total, ncms_unicos, problemas, conformidade, problemas_df, pdf_bytes):
+    """Coloca na fila de envio o relatório com resumo executivo e PDF anexado"""
     
-    with st.spinner("Enviando e-mail..."):
-        # Prepara resumo de problemas para o e-mail
-        if problemas_df is not None and len(problemas_df) > 0:
-            # Converte DataFrame para HTML
-            problemas_html = problemas_df.to_html(
-                index=False,
-                border=1,
-                classes='table table-striped',
-                escape=False
+    email_service = lazy_import("email_service").get_email_service()
+    assunto, corpo_html, anexo_csv = montar_email_relatorio(
+        email_service, total, ncms_unicos, problemas, conformidade, problemas_df
+    )
+    enfileirar_emails([email_service.montar_mensagem(destinatario, assunto, corpo_html, pdf_bytes, anexo_csv)])
+    st.success(f"📤 E-mail para {destinatario} na fila de envio (acompanhe na barra lateral)")
+
+
+def enviar_relatorios_estabelecimentos(relatorios):
+    """Coloca na fila o PDF de cada loja para o seu contato (enviados juntos em segundo plano)"""
+    
+    email_service = lazy_import("email_service").get_email_service()
+    mensagens = []
+    for r in relatorios:
+        assunto, corpo_html, anexo_csv = montar_email_relatorio(
+            email_service, r.total_produtos, r.ncms_unicos, r.ncms_problemas,
+            r.percentual_conformidade, r.problemas_df
+        )
+        mensagens.append(email_service.montar_mensagem(
+            r.contato, f"{assunto} - {r.estabelecimento}", corpo_html, r.pdf_bytes, anexo_csv
+        ))
+    enfileirar_emails(mensagens)
+    st.success(f"📤 {len(mensagens)} e-mail(s) na fila de envio aos estabelecimentos")
+
+
+def _exibir_status_emails(estados):
+    email_outbox = lazy_import("email_outbox")
+    icones = {
+        email_outbox.PENDENTE: "⏳", email_outbox.ENVIANDO: "📨",
+        email_outbox.ENVIADO: "✅", email_outbox.FALHOU: "❌",
+    }
+    agora = time.time()
+    for estado in estados[-10:]:
+        linha = f"{icones.get(estado['status'], '•')} {estado['destinatario']} — {estado['status']}"
+        if estado['status'] == email_outbox.PENDENTE and estado['tentativas']:
+            espera = max(estado['proxima_tentativa'] - agora, 0)
+            linha += f" (tentativa {estado['tentativas'] + 1} em ~{espera:.0f}s)"
+        st.caption(linha)
+        if estado['ultimo_erro'] and estado['status'] != email_outbox.ENVIADO:
+            st.caption(f"↳ {estado['ultimo_erro'][:200]}")
+
+
+@st.fragment(run_every=2.0)
+def _acompanhar_emails():
+    """Atualiza o status das mensagens da sessão até todas saírem da fila"""
+    email_outbox = lazy_import("email_outbox")
+    estados = email_outbox.get_outbox().status(st.session_state.emails_enfileirados)
+    _exibir_status_emails(estados)
+    if not any(e['status'] in (email_outbox.PENDENTE, email_outbox.ENVIANDO) for e in estados):
+        st.rerun()
+
+
+def exibir_fila_emails():
+    """Status dos e-mails enfileirados nesta sessão (atualizado enquanto houver pendentes)"""
+    email_outbox = lazy_import("email_outbox")
+    estados = email_outbox.get_outbox().status(st.session_state.emails_enfileirados)
+    if any(e['status'] in (email_outbox.PENDENTE, email_outbox.ENVIANDO) for e in estados):
+        _acompanhar_emails()
+    else:
+        _exibir_status_emails(estados)
+
+
+def exibir_estimativa_amostral(df, perfil):
+    """Percentual de conformidade estimado por amostragem (segundos, sem IA) antes de pagar pela validação completa"""
+    with st.expander("📊 Estimativa Rápida de Conformidade (amostragem, não usa IA)"):
+        conformity_sampling = lazy_import("conformity_sampling")
+        col1, col2 = st.columns(2)
+        with col1:
+            tamanho = st.select_slider(
+                "Produtos na amostra:", options=[100, 200, 400, 800, 1600],
+                value=conformity_sampling.TAMANHO_AMOSTRA_PADRAO, key="amostra_tamanho"
+            )
+        with col2:
+            confianca = st.select_slider(
+                "Confiança:", options=[0.90, 0.95, 0.99], value=0.95,
+                format_func=lambda c: f"{c:.0%}", key="amostra_confianca"
             )
-            # Aplica estilo
-            problemas_html = f"""
-            <div style="overflow-x: auto;">
-                {problemas_html}
-            </div>
-            """
-        else:
-            problemas_html = "<p><strong>Nenhum problema identificado na análise.</strong></p>"
         
-        # Gera corpo do e-mail com resumo executivo
-        corpo_html = email_service.gerar_corpo_email_html(
-            total_produtos=total,
-            ncms_unicos=ncms_unicos,
-            ncms_problemas=problemas,
-            percentual_conformidade=conformidade,
-            problemas_lista=problemas_html
-        )
+        chave = (perfil['fingerprint'] if perfil else None, tamanho, confianca)
+        estimativa = st.session_state.get("estimativa_amostral")
+        if estimativa is None or estimativa['chave'] != chave:
+            if not st.button("📊 Estimar Conformidade", key="btn_estimar"):
+                return
+            with st.spinner("Validando amostra..."):
+                resultado = conformity_sampling.estimar_conformidade(
+                    df,
+                    get_ncm_reference().get_all_valid_ncms(),
+                    perfil,
+                    tamanho_amostra=tamanho,
+                    confianca=confianca,
+                    engine=lazy_import("ncm_suggestion").get_suggestion_engine()
+                )
+            estimativa = {'chave': chave, 'resultado': resultado}
+            st.session_state.estimativa_amostral = estimativa
         
-        # Envia e-mail com PDF anexado
-        sucesso = email_service.enviar_relatorio_email(
-            destinatario=destinatario,
-            assunto=f"Relatório de Conformidade NCM - {pd.Timestamp.now().strftime('%d/%m/%Y')}",
-            corpo_html=corpo_html,
-            pdf_path=pdf_path
+        e = estimativa['resultado']
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Conformidade Estimada", f"{e.percentual_conformidade:.1f}%")
+            st.caption(f"IC {e.confianca:.0%}: {e.ic_inferior:.1f}% a {e.ic_superior:.1f}%")
+        with col2:
+            if e.valor_em_risco is not None:
+                st.metric("Valor em Risco Projetado", f"R$ {e.valor_em_risco:,.2f}")
+                st.caption(f"IC {e.confianca:.0%}: R$ {e.valor_ic_inferior:,.2f} a R$ {e.valor_ic_superior:,.2f}")
+            else:
+                st.metric("Valor em Risco Projetado", "-")
+                st.caption("Sem coluna de valor no arquivo")
+        st.caption(
+            f"Produtos na amostra: {len(e.amostra):,} de {e.produtos:,} validados ({e.linhas:,} linhas), "
+            f"{e.estratos} estratos (capítulo do NCM × faixa de valor). "
+            "Checagens locais: formato, tabela de referência e NCM × descrição."
+            + (f" A amostra passou dos {tamanho} pedidos: os produtos que concentram linhas ou valor "
+               "e 2 por estrato são sempre validados." if len(e.amostra) > tamanho else "")
         )
+        st.dataframe(e.amostra[~e.amostra['conforme']], hide_index=True, use_container_width=True)
+
+
+# As consultas do histórico são refeitas só quando uma validação nova é registrada
+# (`ultima_execucao` entra na chave do cache), não a cada rerun da página
+@st.cache_data(max_entries=32, show_spinner=False)
+def _consultar_tendencias(ultima_execucao, estabelecimento, meses):
+    historico = lazy_import("validation_history").get_historico()
+    desde = time.time() - meses * 30 * 86400
+    return (
+        historico.conformidade_no_tempo(estabelecimento, desde),
+        historico.ncms_recorrentes(estabelecimento, desde),
+        historico.tempo_ate_correcao(estabelecimento, desde),
+    )
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _consultar_execucoes(ultima_execucao):
+    historico = lazy_import("validation_history").get_historico()
+    return historico.execucoes(), historico.estabelecimentos()
+
+
+def exibir_tendencias():
+    """Histórico de validações: conformidade ao longo do tempo, NCMs recorrentes e tempo até correção"""
+    validation_history = lazy_import("validation_history")
+    if not validation_history.existe_historico():
+        return
+    
+    st.markdown("---")
+    # Toggle e não expander: o conteúdo de um expander fechado também é executado.
+    # O banco só é aberto com a seção ligada.
+    if not st.toggle("📈 Histórico e Tendências", key="mostrar_tendencias"):
+        return
+    
+    ultima = validation_history.get_historico().ultima_execucao()
+    if ultima is None:
+        st.info("Nenhuma validação registrada ainda")
+        return
+    _, estabelecimentos = _consultar_execucoes(ultima)
+    col1, col2 = st.columns(2)
+    with col1:
+        escolhido = st.selectbox(
+            "Estabelecimento:", ["Todos (arquivo inteiro)"] + estabelecimentos, key="tendencia_estabelecimento"
+        )
+        estabelecimento = validation_history.GERAL if escolhido not in estabelecimentos else escolhido
+    with col2:
+        meses = st.select_slider("Período (meses):", options=[1, 3, 6, 12, 24], value=12, key="tendencia_meses")
+    
+    serie, recorrentes, correcoes = _consultar_tendencias(ultima, estabelecimento, meses)
+    if serie.empty:
+        st.info("Nenhuma validação no período")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Validações", len(serie))
+    with col2:
+        variacao = serie['percentual_conformidade'].iloc[-1] - serie['percentual_conformidade'].iloc[0]
+        st.metric("Conformidade Atual", f"{serie['percentual_conformidade'].iloc[-1]:.1f}%",
+                  delta=f"{variacao:+.1f} p.p. no período")
+    corrigidos = correcoes.dropna(subset=['corrigido_em'])
+    with col3:
+        st.metric("Tempo Médio até Correção",
+                  f"{corrigidos['dias_ate_correcao'].mean():.1f} dias" if not corrigidos.empty else "-")
+    
+    st.markdown("**Conformidade ao longo do tempo (%)**")
+    st.line_chart(serie.set_index('criada_em')['percentual_conformidade'])
+    
+    st.markdown("**NCMs com problemas recorrentes**")
+    st.dataframe(recorrentes, hide_index=True, use_container_width=True)
+    
+    st.markdown(f"**Tempo até correção** ({len(corrigidos)} corrigidos, {len(correcoes) - len(corrigidos)} em aberto)")
+    st.dataframe(correcoes, hide_index=True, use_container_width=True)
+
+
+def exibir_comparacao(df, perfil):
+    """Compara o arquivo atual com outro arquivo, ou duas validações do histórico: corrigidos, novos, mantidos e regressões"""
+    validation_history = lazy_import("validation_history")
+    tem_historico = validation_history.existe_historico()
+    if df is None and not tem_historico:
+        return
+    if not st.toggle("🔀 Comparar Validações", key="mostrar_comparacao"):
+        return
+    
+    historico = validation_history.get_historico() if tem_historico else None
+    ultima = historico.ultima_execucao() if historico else None
+    execucoes = _consultar_execucoes(ultima)[0] if ultima is not None else pd.DataFrame()
+    modos = (["Arquivo atual × outro arquivo"] if df is not None else []) + (
+        ["Duas validações do histórico"] if len(execucoes) >= 2 else []
+    )
+    if not modos:
+        st.info("Faça ao menos duas validações (ou carregue um arquivo) para comparar")
+        return
+    
+    validation_diff = lazy_import("validation_diff")
+    with st.container(border=True):
+        modo = st.radio("Comparar:", modos, horizontal=True, key="comparacao_modo")
+        por_arquivo = df is not None and modo == modos[0]
         
-        if sucesso:
-            st.success(f"✅ E-mail enviado para {destinatario}!")
-            st.info("📎 PDF completo anexado ao e-mail")
+        if por_arquivo:
+            outro = st.file_uploader("Outro arquivo (zip com CSV):", type="zip", key="comparacao_arquivo")
+            col1, col2 = st.columns(2)
+            with col1:
+                outro_e_anterior = st.checkbox("O outro arquivo é a versão anterior", value=True, key="comparacao_ordem")
+            with col2:
+                por = st.radio("Chave:", ["produto", "linha"], horizontal=True, key="comparacao_chave",
+                               help="produto: estabelecimento + descrição normalizada; linha: linha inteira sem o NCM")
+            if outro is None:
+                return
+            chave = (outro.name, outro.size, perfil['fingerprint'] if perfil else None, outro_e_anterior, por)
         else:
-            st.error("❌ Erro ao enviar e-mail. Verifique as configurações.")
+            rotulos = {
+                linha.id: f"#{linha.id} - {linha.criada_em:%d/%m/%Y %H:%M} - {linha.arquivo or 'sem nome'} "
+                          f"({linha.percentual_conformidade:.1f}%)"
+                for linha in execucoes.itertuples()
+            }
+            ids = list(rotulos)
+            col1, col2 = st.columns(2)
+            with col1:
+                id_antes = st.selectbox("Antes:", ids[1:] + ids[:1], format_func=rotulos.get, key="comparacao_antes")
+            with col2:
+                id_depois = st.selectbox("Depois:", ids, format_func=rotulos.get, key="comparacao_depois")
+            por = "produto"
+            chave = ("historico", id_antes, id_depois)
+        
+        comparacao = st.session_state.get("comparacao")
+        if comparacao is None or comparacao['chave'] != chave:
+            if not st.button("🔀 Comparar", key="btn_comparar"):
+                return
+            aviso = None
+            try:
+                with st.spinner("Comparando..."):
+                    if not por_arquivo:
+                        antes = validation_diff.lado_de_execucao(historico, id_antes, rotulos[id_antes])
+                        depois = validation_diff.lado_de_execucao(historico, id_depois, rotulos[id_depois])
+                    else:
+                        df_outro = load_data(outro)
+                        if df_outro is None:
+                            return
+                        diferenca = validation_diff.diferenca_colunas(df, df_outro) if por == "linha" else None
+                        if diferenca:
+                            # O hash por linha não casaria nenhuma linha: compara por produto
+                            aviso = f"Chave por linha indisponível ({diferenca}). Comparação feita por produto."
+                            por = "produto"
+                        referencia = get_ncm_reference().get_all_valid_ncms()
+                        atual = validation_diff.lado_de_arquivo(df, referencia, perfil, st.session_state.current_file, por)
+                        anterior = validation_diff.lado_de_arquivo(df_outro, referencia, None, outro.name, por)
+                        antes, depois = (anterior, atual) if outro_e_anterior else (atual, anterior)
+                    resultado = validation_diff.comparar(antes, depois, por)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+                return
+            comparacao = {
+                'chave': chave,
+                'resultado': resultado,
+                'aviso': aviso,
+                'csv': resultado.detalhes.to_csv(index=False, sep=';').encode('utf-8-sig'),
+            }
+            st.session_state.comparacao = comparacao
+        
+        resultado = comparacao['resultado']
+        if comparacao.get('aviso'):
+            st.warning(f"⚠️ {comparacao['aviso']}")
+        st.caption(f"Antes: {resultado.antes} → Depois: {resultado.depois}")
+        colunas = st.columns(len(resultado.resumo))
+        for coluna, (categoria, produtos, valor) in zip(colunas, resultado.resumo.itertuples(index=False, name=None)):
+            with coluna:
+                st.metric(categoria, f"{produtos:,}", help=f"Valor em risco: R$ {valor:,.2f}")
+        st.dataframe(resultado.resumo, hide_index=True, use_container_width=True)
+        st.dataframe(resultado.detalhes.head(1000), hide_index=True, use_container_width=True)
+        st.download_button(
+            label="📥 Baixar Comparação (CSV)",
+            data=comparacao['csv'],
+            file_name=f"comparacao_ncm_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv",
+            key="btn_baixar_comparacao"
+        )
 
 
 def load_data(uploaded_file):
@@ -0,0 +1,45 @@
+"""
+LRU em memória, seguro entre threads, base dos caches do processo (snippets, respostas, gráficos, relatórios)
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class CacheLRU:
+    """
+    Dicionário limitado a `max_itens`: o item usado há mais tempo sai primeiro
+
+    Subclasses com buscas próprias (ex.: por similaridade) usam `_itens`
+    sob `_lock` e chamam `_marcar_uso` no item encontrado.
+    """
+
+    def __init__(self, max_itens: int):
+        self.max_itens = max_itens
+        self._itens: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def _marcar_uso(self, chave: Hashable) -> None:
+        self._itens.move_to_end(chave)
+        self.acertos += 1
+
+    def obter(self, chave: Hashable) -> Optional[Any]:
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is None:
+                self.falhas += 1
+                return None
+            self._marcar_uso(chave)
+            return valor
+
+    def guardar(self, chave: Hashable, valor: Any) -> None:
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
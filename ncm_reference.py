@@ -3,6 +3,7 @@ Módulo para carregar e consultar tabela de referência de NCMs do setor pet
 """
 import pandas as pd
 import os
+from functools import lru_cache
 from typing import Optional, List, Dict
 
 class NCMReference:
@@ -11,6 +12,7 @@ class NCMReference:
     def __init__(self, csv_path: str = "ncm_petshop.csv"):
         self.csv_path = csv_path
         self.df_reference = None
+        self._indice_ncm: Dict[str, Dict] = {}
         self.load_reference()
     
     def load_reference(self) -> bool:
@@ -31,6 +33,7 @@ class NCMReference:
                     .str.replace('-', '')
                     .str.strip()
                 )
+                self._construir_indice()
             
             print(f"✅ Carregados {len(self.df_reference)} NCMs de referência")
             return True
@@ -39,6 +42,18 @@ class NCMReference:
             print(f"❌ Erro ao carregar referência: {e}")
             return False
     
+    def _construir_indice(self) -> None:
+        """Indexa as linhas por NCM normalizado para consultas O(1)"""
+        self._indice_ncm = {}
+        for row in self.df_reference.to_dict('records'):
+            # Mantém a primeira ocorrência, como a busca original (iloc[0])
+            self._indice_ncm.setdefault(row['NCM_normalizado'], {
+                'ncm': row.get('Código NCM', row['NCM_normalizado']),
+                'categoria': row.get('Categoria', 'N/A'),
+                'descricao': row.get('Produto/Descrição Exemplo', 'N/A'),
+                'observacoes': row.get('Observações', 'N/A')
+            })
+    
     def get_all_valid_ncms(self) -> List[str]:
         """Retorna lista de todos os NCMs válidos"""
         if self.df_reference is None:
@@ -53,19 +68,9 @@ class NCMReference:
         # Normaliza o NCM consultado
         ncm_norm = str(ncm).replace('.', '').replace('-', '').strip()
         
-        # Busca no DataFrame
-        result = self.df_reference[self.df_reference['NCM_normalizado'] == ncm_norm]
-        
-        if result.empty:
-            return None
-        
-        row = result.iloc[0]
-        return {
-            'ncm': row.get('Código NCM', ncm_norm),
-            'categoria': row.get('Categoria', 'N/A'),
-            'descricao': row.get('Produto/Descrição Exemplo', 'N/A'),
-            'observacoes': row.get('Observações', 'N/A')
-        }
+        # Busca no índice
+        info = self._indice_ncm.get(ncm_norm)
+        return dict(info) if info else None
     
     def search_by_description(self, keyword: str) -> List[Dict]:
         """Busca NCMs pela descrição do produto"""
@@ -164,12 +169,23 @@ class NCMReference:
             }
 
 
-# Instância global para ser usada pelo agente
-ncm_ref = NCMReference()
+@lru_cache(maxsize=1)
+def get_ncm_reference() -> NCMReference:
+    """Retorna a instância global, carregando o CSV apenas no primeiro uso"""
+    return NCMReference()
+
+
+def __getattr__(name: str):
+    # Compatibilidade: `ncm_reference.ncm_ref` continua disponível, mas só é
+    # criado quando acessado pela primeira vez
+    if name == 'ncm_ref':
+        return get_ncm_reference()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_valid_ncms_list() -> str:
     """Retorna lista formatada de NCMs válidos para usar no prompt"""
+    ncm_ref = get_ncm_reference()
     if ncm_ref.df_reference is None:
         return "Tabela de referência não disponível"
     
@@ -179,6 +195,7 @@ def get_valid_ncms_list() -> str:
 
 def get_ncm_reference_for_prompt() -> str:
     """Retorna referência formatada para incluir no prompt do agente"""
+    ncm_ref = get_ncm_reference()
     if ncm_ref.df_reference is None:
         return "Tabela de referência não carregada"
     
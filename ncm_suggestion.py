@@ -0,0 +1,104 @@
+"""
+Motor local de sugestão de NCM por similaridade de descrição (TF-IDF de n-gramas de caracteres)
+"""
+from functools import lru_cache
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from ncm_reference import NCMReference, get_ncm_reference
+
+
+class NCMSuggestionEngine:
+    """Indexa as descrições da tabela de referência e sugere NCMs por vizinhos mais próximos"""
+
+    def __init__(self, reference: NCMReference, ngram_range: tuple = (2, 4)):
+        self.reference = reference
+        self.vectorizer = TfidfVectorizer(
+            analyzer='char_wb',
+            ngram_range=ngram_range,
+            lowercase=True,
+            strip_accents='unicode',
+            sublinear_tf=True,
+            dtype=np.float32
+        )
+        self.indice = None  # Matriz esparsa (n_referencias x n_features), linhas com norma L2
+        self.ncms = np.array([], dtype=object)
+        self.categorias = np.array([], dtype=object)
+        self._construir_indice()
+
+    def _construir_indice(self) -> None:
+        """Vetoriza as descrições de referência (descrição + categoria)"""
+        df_ref = self.reference.df_reference
+        if df_ref is None or df_ref.empty:
+            return
+
+        textos = (
+            df_ref['Produto/Descrição Exemplo'].fillna('').astype(str) + ' ' +
+            df_ref['Categoria'].fillna('').astype(str)
+        )
+        # TfidfVectorizer já normaliza as linhas (L2): o produto escalar é o cosseno
+        self.indice = self.vectorizer.fit_transform(textos).tocsr()
+        self.ncms = df_ref['NCM_normalizado'].to_numpy(dtype=object)
+        self.categorias = df_ref['Categoria'].to_numpy(dtype=object)
+
+    def sugerir(
+        self,
+        descricoes: Iterable[str],
+        top_k: int = 3,
+        tamanho_lote: int = 20000
+    ) -> pd.DataFrame:
+        """
+        Sugere os top-k NCMs para cada descrição única
+
+        Args:
+            descricoes: Descrições de produtos (duplicatas são pontuadas uma única vez)
+            top_k: Quantidade de sugestões por descrição
+            tamanho_lote: Descrições vetorizadas por produto de matrizes
+
+        Returns:
+            DataFrame com colunas descricao, rank, ncm_sugerido, categoria e similaridade
+        """
+        colunas = ['descricao', 'rank', 'ncm_sugerido', 'categoria', 'similaridade']
+        unicas = pd.unique(pd.Series(list(descricoes), dtype=object).dropna().astype(str))
+        if self.indice is None or len(unicas) == 0:
+            return pd.DataFrame(columns=colunas)
+
+        k = min(top_k, self.indice.shape[0])
+        indice_t = self.indice.T.tocsc()
+        partes = []
+
+        for inicio in range(0, len(unicas), tamanho_lote):
+            lote = unicas[inicio:inicio + tamanho_lote]
+            similaridades = (self.vectorizer.transform(lote) @ indice_t).toarray()
+
+            # Top-k sem ordenar a linha inteira; depois ordena só os k escolhidos
+            melhores = np.argpartition(-similaridades, k - 1, axis=1)[:, :k]
+            valores = np.take_along_axis(similaridades, melhores, axis=1)
+            ordem = np.argsort(-valores, axis=1)
+            melhores = np.take_along_axis(melhores, ordem, axis=1)
+            valores = np.take_along_axis(valores, ordem, axis=1)
+
+            partes.append(pd.DataFrame({
+                'descricao': np.repeat(lote, k),
+                'rank': np.tile(np.arange(1, k + 1), len(lote)),
+                'ncm_sugerido': self.ncms[melhores.ravel()],
+                'categoria': self.categorias[melhores.ravel()],
+                'similaridade': valores.ravel().astype(float).round(4),
+            }))
+
+        return pd.concat(partes, ignore_index=True)
+
+    def melhor_sugestao(self, descricoes: Iterable[str], similaridade_minima: float = 0.0) -> pd.DataFrame:
+        """Retorna apenas a sugestão de maior similaridade por descrição (indexado pela descrição)"""
+        sugestoes = self.sugerir(descricoes, top_k=1)
+        sugestoes = sugestoes[sugestoes['similaridade'] >= similaridade_minima]
+        return sugestoes.drop(columns='rank').set_index('descricao')
+
+
+@lru_cache(maxsize=1)
+def get_suggestion_engine() -> NCMSuggestionEngine:
+    """Retorna o motor global, indexando a referência apenas no primeiro uso"""
+    return NCMSuggestionEngine(get_ncm_reference())
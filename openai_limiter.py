@@ -0,0 +1,313 @@
+"""
+Limite de taxa compartilhado para as chamadas à API da OpenAI
+
+Todas as sessões do processo usam o mesmo cliente HTTP. Seu transporte:
+- aplica token bucket por requisições e por tokens por minuto
+- repete respostas 429/5xx e falhas de conexão com backoff exponencial e jitter
+- une requisições idênticas em andamento: só a primeira vai à API, as demais
+  recebem a mesma resposta (inclusive em streaming)
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+# Limites padrão do gpt-4o-mini no tier 1 (sobrescritos por variáveis de ambiente)
+RPM_PADRAO = 500
+TPM_PADRAO = 200_000
+
+STATUS_REPETIVEIS = {429, 500, 502, 503, 504}
+
+# Reserva de tokens de saída quando a requisição não informa max_tokens
+TOKENS_SAIDA_PADRAO = 1000
+
+
+class TokenBucket:
+    """Balde de fichas reabastecido continuamente até `capacidade` por minuto"""
+
+    def __init__(self, capacidade_por_minuto: float):
+        self.capacidade = float(capacidade_por_minuto)
+        self.taxa = self.capacidade / 60.0
+        self.disponivel = self.capacidade
+        self.atualizado_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self, quantidade: float = 1.0) -> float:
+        """Bloqueia até haver `quantidade` fichas e as consome; retorna o tempo esperado"""
+        quantidade = min(float(quantidade), self.capacidade)
+        esperado = 0.0
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.disponivel = min(self.capacidade, self.disponivel + (agora - self.atualizado_em) * self.taxa)
+                self.atualizado_em = agora
+                if self.disponivel >= quantidade:
+                    self.disponivel -= quantidade
+                    return esperado
+                espera = (quantidade - self.disponivel) / self.taxa
+            time.sleep(espera)
+            esperado += espera
+
+
+class RateLimiter:
+    """Limites de requisições e tokens por minuto, mais pausa global após 429"""
+
+    def __init__(self, rpm: float = RPM_PADRAO, tpm: float = TPM_PADRAO):
+        self.requisicoes = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._pausa_ate = 0.0
+        self._lock = threading.Lock()
+
+    def pausar(self, segundos: float) -> None:
+        """Segura todas as threads (não só a que recebeu o 429) pelo tempo indicado"""
+        with self._lock:
+            self._pausa_ate = max(self._pausa_ate, time.monotonic() + segundos)
+
+    def adquirir(self, tokens: int) -> None:
+        with self._lock:
+            espera = self._pausa_ate - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self.requisicoes.adquirir(1)
+        self.tokens.adquirir(tokens)
+
+
+def estimar_tokens(corpo: bytes) -> int:
+    """Estimativa barata (~4 bytes por token) da entrada mais a saída reservada"""
+    saida = TOKENS_SAIDA_PADRAO
+    try:
+        dados = json.loads(corpo)
+        saida = dados.get('max_tokens') or dados.get('max_completion_tokens') or saida
+    except (ValueError, AttributeError):
+        pass
+    return len(corpo) // 4 + int(saida)
+
+
+class _RespostaCompartilhada:
+    """Resposta de uma requisição em andamento, repassada às requisições idênticas"""
+
+    def __init__(self):
+        self.pronta = threading.Event()
+        self.status_code: Optional[int] = None
+        self.headers: Optional[httpx.Headers] = None
+        self.erro: Optional[BaseException] = None
+        self.chunks: List[bytes] = []
+        self.finalizada = False
+        self.completa = False
+        self.cond = threading.Condition()
+
+    def publicar(self, response: Optional[httpx.Response], erro: Optional[BaseException] = None) -> None:
+        if response is not None:
+            self.status_code = response.status_code
+            self.headers = response.headers
+        self.erro = erro
+        self.pronta.set()
+
+    def adicionar(self, chunk: bytes) -> None:
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finalizar(self, completa: bool) -> None:
+        with self.cond:
+            if not self.finalizada:
+                self.finalizada = True
+                self.completa = completa
+                self.cond.notify_all()
+
+
+class _StreamLider(httpx.SyncByteStream):
+    """Repassa o corpo da resposta real e copia cada chunk para os seguidores"""
+
+    def __init__(self, origem: httpx.SyncByteStream, compartilhada: _RespostaCompartilhada, ao_finalizar):
+        self.origem = origem
+        self.compartilhada = compartilhada
+        self.ao_finalizar = ao_finalizar
+
+    def __iter__(self) -> Iterator[bytes]:
+        completa = False
+        try:
+            for chunk in self.origem:
+                self.compartilhada.adicionar(chunk)
+                yield chunk
+            completa = True
+        finally:
+            self._finalizar(completa)
+
+    def close(self) -> None:
+        self.origem.close()
+        self._finalizar(False)
+
+    def _finalizar(self, completa: bool) -> None:
+        self.compartilhada.finalizar(completa)
+        self.ao_finalizar()
+
+
+class _StreamSeguidor(httpx.SyncByteStream):
+    """Reproduz os chunks da resposta líder à medida que chegam"""
+
+    def __init__(self, compartilhada: _RespostaCompartilhada):
+        self.compartilhada = compartilhada
+
+    def __iter__(self) -> Iterator[bytes]:
+        posicao = 0
+        compartilhada = self.compartilhada
+        while True:
+            with compartilhada.cond:
+                while posicao >= len(compartilhada.chunks) and not compartilhada.finalizada:
+                    compartilhada.cond.wait()
+                novos = compartilhada.chunks[posicao:]
+                posicao += len(novos)
+                fim = compartilhada.finalizada and posicao >= len(compartilhada.chunks)
+            yield from novos
+            if fim:
+                if not compartilhada.completa:
+                    raise httpx.ReadError("Resposta compartilhada interrompida antes do fim")
+                return
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """
+    Transporte HTTP com limite de taxa, repetição com backoff e união de requisições
+
+    Args:
+        limiter: Limites compartilhados de RPM/TPM
+        transporte: Transporte real (padrão: httpx.HTTPTransport)
+        max_tentativas: Tentativas por requisição, incluindo a primeira
+        backoff_base: Espera base em segundos (dobra a cada tentativa)
+        backoff_max: Teto da espera entre tentativas
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        transporte: Optional[httpx.BaseTransport] = None,
+        max_tentativas: int = 6,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0
+    ):
+        self.limiter = limiter
+        self.transporte = transporte or httpx.HTTPTransport()
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._em_andamento: Dict[str, _RespostaCompartilhada] = {}
+        self._lock = threading.Lock()
+        self.estatisticas = {'requisicoes': 0, 'unidas': 0, 'repeticoes': 0}
+
+    @staticmethod
+    def _chave(request: httpx.Request, corpo: bytes) -> str:
+        # A chave de API entra na chave: respostas não são compartilhadas entre contas
+        hasher = hashlib.sha256()
+        for parte in (request.method, str(request.url), request.headers.get('authorization', '')):
+            hasher.update(parte.encode('utf-8'))
+            hasher.update(b'\0')
+        hasher.update(corpo)
+        return hasher.hexdigest()
+
+    def _espera(self, tentativa: int, response: Optional[httpx.Response]) -> float:
+        """Backoff exponencial com jitter total, respeitando Retry-After quando presente"""
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativa))
+
+    def _enviar(self, request: httpx.Request, tokens: int) -> httpx.Response:
+        for tentativa in range(self.max_tentativas):
+            self.limiter.adquirir(tokens)
+            ultima = tentativa == self.max_tentativas - 1
+            try:
+                response = self.transporte.handle_request(request)
+            except httpx.TransportError:
+                if ultima:
+                    raise
+                self.estatisticas['repeticoes'] += 1
+                time.sleep(self._espera(tentativa, None))
+                continue
+
+            if response.status_code not in STATUS_REPETIVEIS or ultima:
+                return response
+
+            espera = self._espera(tentativa, response)
+            response.read()
+            response.close()
+            if response.status_code == 429:
+                self.limiter.pausar(espera)
+            self.estatisticas['repeticoes'] += 1
+            time.sleep(espera)
+        raise RuntimeError("max_tentativas deve ser pelo menos 1")
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        corpo = request.read()
+        chave = self._chave(request, corpo)
+
+        with self._lock:
+            compartilhada = self._em_andamento.get(chave)
+            lider = compartilhada is None
+            if lider:
+                compartilhada = _RespostaCompartilhada()
+                self._em_andamento[chave] = compartilhada
+                self.estatisticas['requisicoes'] += 1
+            else:
+                self.estatisticas['unidas'] += 1
+
+        if not lider:
+            compartilhada.pronta.wait()
+            if compartilhada.erro is not None:
+                raise compartilhada.erro
+            return httpx.Response(
+                compartilhada.status_code,
+                headers=compartilhada.headers,
+                stream=_StreamSeguidor(compartilhada),
+                request=request
+            )
+
+        def liberar():
+            with self._lock:
+                if self._em_andamento.get(chave) is compartilhada:
+                    del self._em_andamento[chave]
+
+        try:
+            response = self._enviar(request, estimar_tokens(corpo))
+        except BaseException as e:
+            compartilhada.publicar(None, e)
+            compartilhada.finalizar(False)
+            liberar()
+            raise
+
+        compartilhada.publicar(response)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_StreamLider(response.stream, compartilhada, liberar),
+            request=request,
+            extensions=response.extensions
+        )
+
+    def close(self) -> None:
+        self.transporte.close()
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """
+    Cliente HTTP do processo para o ChatOpenAI, com limites lidos do ambiente
+
+    Variáveis: OPENAI_LIMITE_RPM, OPENAI_LIMITE_TPM. Para testar contra um
+    servidor local, aponte OPENAI_BASE_URL para ele.
+    """
+    limiter = RateLimiter(
+        rpm=float(os.getenv('OPENAI_LIMITE_RPM', RPM_PADRAO)),
+        tpm=float(os.getenv('OPENAI_LIMITE_TPM', TPM_PADRAO)),
+    )
+    return httpx.Client(transport=LimitedTransport(limiter), timeout=httpx.Timeout(60.0, connect=10.0))
@@ -5,12 +5,59 @@ from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Flowable
 from reportlab.platypus import Image as RLImage
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 from datetime import datetime
+import io
+import re
+from functools import lru_cache
 import pandas as pd
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
+
+from problems_table import principais_problemas
+
+# Tabela completa de problemas (modo_tabela="completa")
+FONTE_TABELA_LONGA = 7
+MAX_CARACTERES_CELULA = 300  # Textos maiores são cortados (no máximo ~10 linhas por célula)
+LIMITE_RESUMO_NCM = 20  # Acima disso o relatório abre com o resumo por NCM
+LINHAS_POR_BLOCO = 5000  # Linhas convertidas para texto de cada vez ao calcular as páginas
+
+
+class _PaginaTabela(Flowable):
+    """
+    Uma página da tabela longa, guardada só como o intervalo de linhas
+
+    A Table é montada quando o ReportLab chega à página (wrap) e descartada
+    depois de desenhada: em memória fica uma página de cada vez, não a
+    tabela inteira.
+    """
+
+    def __init__(self, montar: Callable[[int, int], Table], inicio: int, fim: int):
+        super().__init__()
+        self._montar = montar
+        self.inicio, self.fim = inicio, fim
+        self._tabela = None
+        self.hAlign = 'CENTER'
+
+    def _obter(self) -> Table:
+        if self._tabela is None:
+            self._tabela = self._montar(self.inicio, self.fim)
+        return self._tabela
+
+    def wrap(self, largura, altura):
+        self.width, self.height = self._obter().wrap(largura, altura)
+        return self.width, self.height
+
+    def split(self, largura, altura):
+        # Só quando a estimativa de altura da página falha: divide a Table montada
+        partes = self._obter().split(largura, altura)
+        self._tabela = None
+        return partes
+
+    def draw(self):
+        self._obter().drawOn(self.canv, 0, 0)
+        self._tabela = None
 
 class PDFReportGenerator:
     """Gerador de relatórios PDF de conformidade NCM"""
@@ -54,32 +101,37 @@ class PDFReportGenerator:
     
     def gerar_relatorio_pdf(
         self,
-        filename: str,
         total_produtos: int,
         ncms_unicos: int,
         ncms_problemas: int,
         percentual_conformidade: float,
         problemas_df: pd.DataFrame = None,
-        observacoes: str = ""
-    ) -> str:
+        observacoes: str = "",
+        modo_tabela: str = "completa",
+        resumo_por_ncm: bool = None
+    ) -> bytes:
         """
         Gera relatório PDF de conformidade
         
         Args:
-            filename: Nome do arquivo PDF
             total_produtos: Total de produtos analisados
             ncms_unicos: Total de NCMs únicos
             ncms_problemas: Total de NCMs com problemas
             percentual_conformidade: Percentual de conformidade
             problemas_df: DataFrame com detalhes dos problemas
             observacoes: Observações adicionais
+            modo_tabela: "completa" lista todos os problemas (os mais graves primeiro) em
+                páginas com cabeçalho repetido; "resumida" mostra só os 20 primeiros
+            resumo_por_ncm: Inclui antes da lista o resumo agrupado por NCM
+                (padrão: quando há mais de LIMITE_RESUMO_NCM problemas)
             
         Returns:
-            Caminho do arquivo gerado
+            Conteúdo do PDF (gerado em memória, sem arquivo em disco)
         """
         # Cria documento
+        buffer = io.BytesIO()
         doc = SimpleDocTemplate(
-            filename,
+            buffer,
             pagesize=A4,
             rightMargin=72,
             leftMargin=72,
@@ -159,7 +211,25 @@ class PDFReportGenerator:
             
             if problemas_df is not None and len(problemas_df) > 0 and not problemas_df.empty:
                 # Verifica se não é o DataFrame dummy vazio
-                if problemas_df.columns.tolist() != ['Resumo'] and len(problemas_df.columns) > 1:
+                if problemas_df.columns.tolist() != ['Resumo'] and len(problemas_df.columns) > 1 and modo_tabela == "completa":
+                    if resumo_por_ncm is None:
+                        resumo_por_ncm = len(problemas_df) > LIMITE_RESUMO_NCM
+                    resumo = self._resumo_por_ncm(problemas_df) if resumo_por_ncm else None
+                    listados = principais_problemas(problemas_df)
+                    if resumo is not None:
+                        elements.append(Paragraph("Resumo por NCM", self.styles['Heading3']))
+                        elements.extend(self._tabela_paginada(resumo, doc, doc.height - 1.5*inch))
+                        elements.append(PageBreak())
+                        elements.append(Paragraph("Todos os problemas", self.styles['Heading3']))
+                        elements.extend(self._tabela_paginada(listados, doc, doc.height - 0.5*inch))
+                    else:
+                        elements.extend(self._tabela_paginada(listados, doc, doc.height - 1.2*inch))
+                    elements.append(Spacer(1, 0.2*inch))
+                    elements.append(Paragraph(
+                        f"<i>Total: {len(problemas_df)} problemas identificados.</i>",
+                        self.styles['CustomBody']
+                    ))
+                elif problemas_df.columns.tolist() != ['Resumo'] and len(problemas_df.columns) > 1:
                     # Tem dados reais na tabela
                     # Converte DataFrame para lista
                     problemas_data = [problemas_df.columns.tolist()]
@@ -291,8 +361,108 @@ class PDFReportGenerator:
         # Gera PDF
         doc.build(elements)
         
-        return filename
+        return buffer.getvalue()
+
+    def _resumo_por_ncm(self, problemas_df: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """Problemas por NCM (com a divisão por severidade, se houver), do mais frequente ao menos"""
+        col_ncm = next((c for c in problemas_df.columns if 'NCM' in str(c).upper()), None)
+        if col_ncm is None:
+            return None
+        col_sev = next((c for c in problemas_df.columns if 'SEVERIDADE' in str(c).upper()), None)
+        ncms = problemas_df[col_ncm].astype(str).str.strip()
+        if col_sev is not None:
+            # groupby/unstack vetorizado (crosstab agrega grupo a grupo em Python)
+            severidade = problemas_df[col_sev].astype(str).str.strip()
+            resumo = ncms.groupby([ncms, severidade]).size().unstack(fill_value=0)
+            resumo.columns.name = None
+            resumo.insert(0, 'Problemas', resumo.sum(axis=1))
+        else:
+            resumo = ncms.value_counts().to_frame('Problemas')
+        resumo = resumo.sort_values('Problemas', ascending=False)
+        resumo.index.name = 'NCM'
+        return resumo.reset_index()
+
+    def _tabela_paginada(self, dados: pd.DataFrame, doc, altura_primeira: float) -> List:
+        """
+        Tabela longa dividida em uma Table por página, cada uma com o cabeçalho
+
+        As linhas são quebradas aqui (texto simples, sem Paragraph) para que a
+        altura de cada uma seja conhecida: as páginas são montadas sem o
+        ReportLab precisar redividir uma tabela enorme a cada quebra de página.
+        Os elementos devolvidos guardam só o intervalo de linhas de cada página
+        (`_PaginaTabela`); o texto é convertido em blocos de `LINHAS_POR_BLOCO`.
+
+        Args:
+            dados: Linhas da tabela
+            doc: Documento (largura e altura úteis da página)
+            altura_primeira: Espaço livre na página onde a tabela começa
+        """
+        # Largura de cada coluna proporcional ao tamanho médio do texto (amostra), entre 6 e 60 caracteres
+        amostra = dados.head(2000).astype(str)
+        pesos = [min(max(amostra[c].str.len().mean() if len(amostra) else 0, len(str(c)), 6), 60) for c in amostra.columns]
+        larguras = [doc.width * p / sum(pesos) for p in pesos]
+        # Largura média de caractere da Helvetica ~0,55 da fonte, descontado o padding das células
+        limites = [max(int((w - 12) / (FONTE_TABELA_LONGA * 0.55)), 4) for w in larguras]
+        padroes = [re.compile(r'(.{1,%d})(?:\s+|$)|(.{%d})' % (n, n)) for n in limites]
+        entrelinha = FONTE_TABELA_LONGA * 1.2
+
+        def quebrar(valor: str, coluna: int) -> str:
+            if len(valor) <= limites[coluna]:
+                return valor
+            if len(valor) > MAX_CARACTERES_CELULA:
+                valor = valor[:MAX_CARACTERES_CELULA - 3] + '...'
+            return '\n'.join(m.group(1) or m.group(2) for m in padroes[coluna].finditer(valor))
+
+        def altura(linha: List[str]) -> float:
+            return max(celula.count('\n') + 1 for celula in linha) * entrelinha + 7
+
+        def linhas_texto(inicio: int, fim: int) -> List[List[str]]:
+            textos = dados.iloc[inicio:fim].astype(str).to_numpy().tolist()
+            return [[quebrar(v, i) for i, v in enumerate(linha)] for linha in textos]
+
+        cabecalho = [quebrar(str(c), i) for i, c in enumerate(dados.columns)]
+        estilo = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f44336')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), FONTE_TABELA_LONGA),
+            ('LEADING', (0, 0), (-1, -1), entrelinha),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ])
+
+        def montar(inicio: int, fim: int) -> Table:
+            return Table([cabecalho] + linhas_texto(inicio, fim), colWidths=larguras, style=estilo, repeatRows=1)
+
+        elementos = []
+        # Margem de segurança para a estimativa de altura
+        disponivel = (altura_primeira - altura(cabecalho)) * 0.95
+        inicio, usado = 0, 0.0
+        for bloco in range(0, len(dados), LINHAS_POR_BLOCO):
+            for posicao, linha in enumerate(linhas_texto(bloco, bloco + LINHAS_POR_BLOCO), start=bloco):
+                h = altura(linha)
+                if posicao > inicio and usado + h > disponivel:
+                    elementos.append(_PaginaTabela(montar, inicio, posicao))
+                    elementos.append(PageBreak())
+                    inicio, usado = posicao, 0.0
+                    disponivel = (doc.height - altura(cabecalho)) * 0.95
+                usado += h
+        if len(dados) > inicio:
+            elementos.append(_PaginaTabela(montar, inicio, len(dados)))
+        return elementos
+
+
+@lru_cache(maxsize=1)
+def get_pdf_generator() -> PDFReportGenerator:
+    """Retorna a instância global, criando os estilos apenas no primeiro uso"""
+    return PDFReportGenerator()
 
 
-# Instância global
-pdf_generator = PDFReportGenerator()
\ No newline at end of file
+def __getattr__(name: str):
+    # Compatibilidade com `from pdf_generator import pdf_generator`
+    if name == 'pdf_generator':
+        return get_pdf_generator()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Tabela de problemas da validação compartilhada por PDF, e-mail e interface: ordem por severidade e CSV completo
+"""
+import gzip
+import unicodedata
+
+import pandas as pd
+
+NOME_ANEXO_PROBLEMAS = "problemas_ncm.csv.gz"
+
+# Ordem de exibição: mais graves primeiro
+_ORDEM_SEVERIDADE = {'CRITICA': 0, 'ALTA': 1, 'MEDIA': 2, 'BAIXA': 3}
+
+
+def _chave_severidade(valor: str) -> int:
+    texto = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode('ascii').upper()
+    return next((ordem for nome, ordem in _ORDEM_SEVERIDADE.items() if nome in texto), len(_ORDEM_SEVERIDADE))
+
+
+def principais_problemas(problemas_df: pd.DataFrame, top_n: int = None) -> pd.DataFrame:
+    """
+    Problemas do mais grave ao menos grave (pela coluna de severidade, se houver), na ordem original entre iguais
+
+    Args:
+        top_n: Quantos manter (None = todos)
+    """
+    col_sev = next((c for c in problemas_df.columns if 'SEVERIDADE' in str(c).upper()), None)
+    if col_sev is None:
+        return problemas_df.head(top_n) if top_n is not None else problemas_df
+    severidades = problemas_df[col_sev]
+    ordem = severidades.map({valor: _chave_severidade(valor) for valor in severidades.unique()})
+    return problemas_df.loc[ordem.sort_values(kind='stable').index[:top_n]]
+
+
+def compactar_problemas_csv(problemas_df: pd.DataFrame) -> bytes:
+    """Lista completa de problemas em CSV (; e UTF-8 com BOM, abre no Excel) comprimido com gzip"""
+    csv = problemas_df.to_csv(index=False, sep=';').encode('utf-8-sig')
+    return gzip.compress(csv, compresslevel=6)
@@ -0,0 +1,29 @@
+"""
+Cache dos relatórios gerados (métricas + PDF) por resultado de validação
+"""
+import hashlib
+from functools import lru_cache
+
+from memory_cache import CacheLRU
+
+
+def chave_relatorio(fingerprint: str, response: str) -> str:
+    """Identifica o relatório pelo arquivo validado e pela resposta do agente"""
+    return hashlib.sha1(f"{fingerprint}\0{response}".encode('utf-8')).hexdigest()
+
+
+class CacheRelatorios(CacheLRU):
+    """
+    LRU de relatórios prontos
+
+    Reruns do Streamlit (chat, checkboxes) só redesenham os widgets: o
+    DataFrame de problemas e o PDF são calculados uma vez por resultado.
+    """
+
+    def __init__(self, max_itens: int = 32):
+        super().__init__(max_itens)
+
+
+@lru_cache(maxsize=1)
+def get_report_cache() -> CacheRelatorios:
+    return CacheRelatorios()
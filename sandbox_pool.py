@@ -0,0 +1,341 @@
+"""
+Execução isolada do código Python gerado pelo agente em processos pré-aquecidos
+
+Cada worker é um processo separado, com limite de tempo de CPU e de memória,
+que lê o DataFrame de um arquivo Arrow mapeado em memória (compartilhado por
+todos os workers, sem uma cópia serializada por snippet). Um snippet lento ou
+que estoure os limites derruba só o seu worker, que é substituído.
+"""
+import ast
+import atexit
+import multiprocessing as mp
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from functools import lru_cache
+from io import StringIO
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from snippet_cache import CacheSnippets, e_snippet_puro, encadear_estado, normalizar_codigo
+
+try:
+    import resource
+except ImportError:  # Windows: roda sem limites de CPU/memória
+    resource = None
+
+# Diretório dos datasets publicados (em RAM quando /dev/shm existe)
+DIRETORIO_DATASETS = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# Tamanho máximo da saída devolvida ao agente
+MAX_CARACTERES_SAIDA = 10_000
+
+# Datasets mantidos em cada worker e publicados em disco (o mais antigo sai primeiro)
+DATASETS_POR_WORKER = 2
+DATASETS_PUBLICADOS = 8
+
+# Sessões com worker atribuído; a menos usada recentemente perde o namespace
+SESSOES_MANTIDAS = 100
+
+
+class WorkerReiniciado(Exception):
+    """O worker morreu ou estourou o tempo e foi substituído"""
+
+
+def _sanitizar(codigo: str) -> str:
+    """Remove crases e o prefixo 'python' (mesma regra do PythonAstREPLTool)"""
+    codigo = re.sub(r"^(\s|`)*(?i:python)?\s*", "", codigo)
+    return re.sub(r"(\s|`)*$", "", codigo)
+
+
+def executar_snippet(codigo: str, namespace: Dict) -> str:
+    """
+    Executa o snippet como o PythonAstREPLTool: todas as instruções e, se a
+    última for uma expressão, devolve seu valor; senão, o que foi impresso
+    """
+    try:
+        tree = ast.parse(_sanitizar(codigo))
+        saida = StringIO()
+        with redirect_stdout(saida):
+            exec(ast.unparse(ast.Module(tree.body[:-1], type_ignores=[])), namespace)
+            ultima = ast.unparse(ast.Module(tree.body[-1:], type_ignores=[]))
+            try:
+                valor = eval(ultima, namespace)
+            except Exception:
+                exec(ultima, namespace)
+                valor = None
+        return saida.getvalue() if valor is None else str(valor)
+    except Exception as e:
+        return "{}: {}".format(type(e).__name__, str(e))
+
+
+def _aplicar_limites(limite_memoria_mb: int) -> None:
+    if resource is None:
+        return
+    limite = limite_memoria_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+
+
+def _limitar_cpu(segundos: int) -> None:
+    """Limite de CPU relativo ao que o processo já usou (SIGXCPU encerra o worker)"""
+    if resource is None:
+        return
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    _, rigido = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (int(uso.ru_utime + uso.ru_stime) + segundos, rigido))
+
+
+def _loop_worker(conn, limite_memoria_mb: int) -> None:
+    """Processo worker: importa as bibliotecas uma vez e atende snippets até o pipe fechar"""
+    import numpy as np
+    import pyarrow as pa
+
+    # Cópias rasas por sessão não podem alterar o dataset compartilhado
+    pd.options.mode.copy_on_write = True
+    _aplicar_limites(limite_memoria_mb)
+
+    datasets: Dict[str, pd.DataFrame] = {}
+    namespaces: Dict[tuple, Dict] = {}
+    conn.send("pronto")
+
+    while True:
+        try:
+            codigo, caminho, sessao, limite_cpu, descartadas = conn.recv()
+        except EOFError:
+            return
+
+        for chave in [k for k in namespaces if k[0] in descartadas]:
+            del namespaces[chave]
+
+        if caminho not in datasets:
+            if len(datasets) >= DATASETS_POR_WORKER:
+                antigo = next(iter(datasets))
+                del datasets[antigo]
+                for chave in [k for k in namespaces if k[1] == antigo]:
+                    del namespaces[chave]
+            with pa.memory_map(caminho) as origem:
+                # split_blocks evita consolidar colunas numéricas em cópias novas
+                datasets[caminho] = pa.ipc.open_file(origem).read_all().to_pandas(split_blocks=True)
+
+        chave = (sessao, caminho)
+        if chave not in namespaces:
+            namespaces[chave] = {'df': datasets[caminho].copy(deep=False), 'pd': pd, 'np': np}
+
+        _limitar_cpu(limite_cpu)
+        conn.send(executar_snippet(codigo, namespaces[chave])[:MAX_CARACTERES_SAIDA])
+
+
+class _Worker:
+    def __init__(self, contexto, limite_memoria_mb: int):
+        self.conn, conn_filho = contexto.Pipe()
+        self.processo = contexto.Process(
+            target=_loop_worker, args=(conn_filho, limite_memoria_mb), daemon=True
+        )
+        self.processo.start()
+        conn_filho.close()
+        self.pronto = False
+
+    def aguardar_pronto(self, timeout: float) -> None:
+        if not self.pronto:
+            if not self.conn.poll(timeout):
+                raise WorkerReiniciado("Worker não iniciou a tempo")
+            self.conn.recv()
+            self.pronto = True
+
+    def encerrar(self) -> None:
+        self.conn.close()
+        if self.processo.is_alive():
+            self.processo.kill()
+        self.processo.join(timeout=5)
+
+
+class SandboxPool:
+    """
+    Pool de processos que executam o código do agente
+
+    Args:
+        n_workers: Processos mantidos prontos
+        limite_cpu_s: Tempo de CPU por snippet
+        limite_memoria_mb: Espaço de endereçamento de cada worker
+        timeout_s: Tempo de relógio por snippet (inclui a leitura do dataset)
+        cache: Cache de saídas de snippets puros (None desativa)
+    """
+
+    def __init__(
+        self,
+        n_workers: int = 2,
+        limite_cpu_s: int = 20,
+        limite_memoria_mb: int = 4096,
+        timeout_s: float = 30.0,
+        cache: Optional[CacheSnippets] = None
+    ):
+        self.limite_cpu_s = limite_cpu_s
+        self.limite_memoria_mb = limite_memoria_mb
+        self.timeout_s = timeout_s
+        self._contexto = mp.get_context("spawn")
+        self._workers = [self._novo_worker() for _ in range(n_workers)]
+        # Um snippet por vez em cada posição do pool; a posição é que é travada,
+        # não o worker, que pode ser substituído enquanto outros esperam
+        self._locks = [threading.Lock() for _ in range(n_workers)]
+        self._sessoes: "OrderedDict[str, int]" = OrderedDict()
+        # Sessões expulsas cujo namespace o worker ainda precisa descartar
+        self._descartadas: List[List[str]] = [[] for _ in range(n_workers)]
+        self._datasets: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.reinicios = 0
+        self.cache = cache
+        # Histórico (hash encadeado) dos snippets com efeitos já executados por (sessão, dataset)
+        self._estados: Dict[Tuple[str, str], str] = {}
+
+    def _novo_worker(self) -> _Worker:
+        return _Worker(self._contexto, self.limite_memoria_mb)
+
+    def publicar_dataset(self, df: pd.DataFrame, chave: str) -> str:
+        """
+        Grava o DataFrame uma única vez em formato Arrow IPC para os workers mapearem
+
+        Args:
+            df: DataFrame exposto ao agente como `df`
+            chave: Identificador estável do conteúdo (ex.: fingerprint do arquivo)
+
+        Returns:
+            Caminho do arquivo publicado
+        """
+        import pyarrow as pa
+
+        with self._lock:
+            caminho = self._datasets.get(chave)
+            if caminho and os.path.exists(caminho):
+                return caminho
+
+            try:
+                tabela = pa.Table.from_pandas(df, preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Colunas object com tipos misturados (ex.: NCM lido ora como número, ora como texto)
+                df = df.apply(lambda col: col.where(col.isna(), col.astype(str)) if col.dtype == object else col)
+                tabela = pa.Table.from_pandas(df, preserve_index=False)
+
+            caminho = os.path.join(DIRETORIO_DATASETS, f"ncm_dataset_{os.getpid()}_{chave}.arrow")
+            temporario = caminho + ".tmp"
+            with pa.OSFile(temporario, "wb") as destino:
+                with pa.ipc.new_file(destino, tabela.schema) as escritor:
+                    escritor.write_table(tabela)
+            os.replace(temporario, caminho)
+            self._datasets[chave] = caminho
+
+            # Workers que já mapearam um arquivo removido continuam lendo-o normalmente
+            while len(self._datasets) > DATASETS_PUBLICADOS:
+                antigo = self._datasets.pop(next(iter(self._datasets)))
+                if os.path.exists(antigo):
+                    os.remove(antigo)
+            return caminho
+
+    def _worker_da_sessao(self, sessao: str) -> int:
+        """
+        Sessões ficam no mesmo worker, onde estão as variáveis criadas por elas
+
+        Acima de `SESSOES_MANTIDAS`, a sessão usada há mais tempo é esquecida:
+        seu namespace é descartado no worker e ela recomeça do estado inicial.
+        """
+        with self._lock:
+            if sessao in self._sessoes:
+                self._sessoes.move_to_end(sessao)
+                return self._sessoes[sessao]
+
+            if len(self._sessoes) >= SESSOES_MANTIDAS:
+                antiga, indice_antigo = self._sessoes.popitem(last=False)
+                self._descartadas[indice_antigo].append(antiga)
+                for chave in [k for k in self._estados if k[0] == antiga]:
+                    del self._estados[chave]
+
+            carga = [0] * len(self._workers)
+            for indice in self._sessoes.values():
+                carga[indice] += 1
+            self._sessoes[sessao] = carga.index(min(carga))
+            return self._sessoes[sessao]
+
+    def _reiniciar(self, indice: int, worker: _Worker) -> None:
+        """Substitui o worker da posição, se ainda for o mesmo que falhou"""
+        with self._lock:
+            if self._workers[indice] is not worker:
+                return
+            worker.encerrar()
+            self._workers[indice] = self._novo_worker()
+            self._descartadas[indice] = []
+            self.reinicios += 1
+            # Namespaces do worker foram perdidos: as sessões voltam ao estado inicial
+            for chave in [k for k in self._estados if self._sessoes.get(k[0]) == indice]:
+                del self._estados[chave]
+
+    def executar(self, codigo: str, caminho_dataset: str, sessao: str) -> str:
+        """
+        Executa o snippet no worker da sessão e devolve a saída como texto
+
+        Snippets puros são respondidos pelo cache quando o mesmo código já rodou
+        sobre o mesmo dataset e o mesmo histórico de alterações.
+        """
+        normalizado = normalizar_codigo(_sanitizar(codigo))
+        chave_estado = (sessao, caminho_dataset)
+        estado = self._estados.get(chave_estado, "")
+        chave_cache = None
+        if self.cache is not None and normalizado is not None and e_snippet_puro(_sanitizar(codigo)):
+            chave_cache = self.cache.chave(normalizado, caminho_dataset, estado)
+            saida = self.cache.obter(chave_cache)
+            if saida is not None:
+                return saida
+
+        saida, ok = self._executar_no_worker(codigo, caminho_dataset, sessao)
+        if ok:
+            if chave_cache is not None:
+                self.cache.guardar(chave_cache, saida)
+            elif normalizado is not None:
+                self._estados[chave_estado] = encadear_estado(estado, normalizado)
+        return saida
+
+    def _executar_no_worker(self, codigo: str, caminho_dataset: str, sessao: str) -> Tuple[str, bool]:
+        indice = self._worker_da_sessao(sessao)
+        with self._locks[indice]:
+            # Lido só com a posição travada: quem esperava um worker reiniciado usa o novo
+            with self._lock:
+                worker = self._workers[indice]
+                descartadas, self._descartadas[indice] = self._descartadas[indice], []
+            inicio = time.monotonic()
+            try:
+                worker.aguardar_pronto(self.timeout_s)
+                worker.conn.send((codigo, caminho_dataset, sessao, self.limite_cpu_s, descartadas))
+                restante = max(self.timeout_s - (time.monotonic() - inicio), 0.1)
+                if not worker.conn.poll(restante):
+                    raise WorkerReiniciado(f"tempo limite de {self.timeout_s:.0f}s excedido")
+                return worker.conn.recv(), True
+            except (WorkerReiniciado, EOFError, OSError) as e:
+                motivo = str(e) or "limite de CPU ou memória excedido"
+                self._reiniciar(indice, worker)
+                return (
+                    f"Erro: execução interrompida ({motivo}). O ambiente Python foi reiniciado e "
+                    "variáveis criadas antes foram perdidas; prefira operações menores."
+                ), False
+
+    def encerrar(self) -> None:
+        for worker in self._workers:
+            worker.encerrar()
+        for caminho in self._datasets.values():
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+
+@lru_cache(maxsize=1)
+def get_sandbox_pool() -> SandboxPool:
+    """Pool do processo, criado (e aquecido) no primeiro uso"""
+    pool = SandboxPool(
+        n_workers=int(os.getenv("SANDBOX_WORKERS", "2")),
+        limite_cpu_s=int(os.getenv("SANDBOX_LIMITE_CPU_S", "20")),
+        limite_memoria_mb=int(os.getenv("SANDBOX_LIMITE_MEMORIA_MB", "4096")),
+        cache=CacheSnippets(),
+    )
+    atexit.register(pool.encerrar)
+    return pool
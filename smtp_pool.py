@@ -0,0 +1,183 @@
+"""
+Pool de conexões SMTP autenticadas, reaproveitadas entre envios
+"""
+import smtplib
+import socket
+import threading
+import time
+from email.message import Message
+from typing import Callable, List, Optional
+
+# Erros que indicam conexão perdida: a mensagem é reenviada em uma conexão nova
+_ERROS_CONEXAO = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+
+class _Conexao:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.ultimo_uso = time.monotonic()
+
+    def fechar(self) -> None:
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+
+class PoolSMTP:
+    """
+    Mantém sessões SMTP abertas (conectadas, com STARTTLS e login feitos)
+
+    Uma sessão parada há mais de `verificar_apos_s` é testada com NOOP antes
+    de ser reutilizada; parada há mais de `ociosidade_max_s` é descartada
+    (servidores costumam derrubar conexões ociosas).
+
+    Args:
+        host, porta: Servidor SMTP
+        usuario, senha: Credenciais (login só quando informadas e o servidor oferece AUTH)
+        starttls: Usa STARTTLS após conectar
+        max_conexoes: Sessões simultâneas no máximo
+        timeout: Tempo limite de cada operação de rede
+    """
+
+    def __init__(
+        self,
+        host: str,
+        porta: int,
+        usuario: Optional[str] = None,
+        senha: Optional[str] = None,
+        starttls: bool = True,
+        max_conexoes: int = 2,
+        timeout: float = 30.0,
+        verificar_apos_s: float = 15.0,
+        ociosidade_max_s: float = 240.0
+    ):
+        self.host = host
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.starttls = starttls
+        self.timeout = timeout
+        self.verificar_apos_s = verificar_apos_s
+        self.ociosidade_max_s = ociosidade_max_s
+        self._livres: List[_Conexao] = []
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(max_conexoes)
+        self.conexoes_abertas = 0
+
+    def _abrir(self) -> _Conexao:
+        smtp = smtplib.SMTP(self.host, self.porta, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.usuario and self.senha and smtp.has_extn('auth'):
+                smtp.login(self.usuario, self.senha)
+        except Exception:
+            smtp.close()
+            raise
+        self.conexoes_abertas += 1
+        return _Conexao(smtp)
+
+    def _saudavel(self, conexao: _Conexao) -> bool:
+        parada = time.monotonic() - conexao.ultimo_uso
+        if parada > self.ociosidade_max_s:
+            return False
+        if parada > self.verificar_apos_s:
+            try:
+                return conexao.smtp.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                return False
+        return True
+
+    def _obter(self) -> _Conexao:
+        while True:
+            with self._lock:
+                conexao = self._livres.pop() if self._livres else None
+            if conexao is None:
+                return self._abrir()
+            if self._saudavel(conexao):
+                return conexao
+            conexao.fechar()
+
+    def _devolver(self, conexao: _Conexao) -> None:
+        conexao.ultimo_uso = time.monotonic()
+        with self._lock:
+            self._livres.append(conexao)
+
+    def enviar_varios(
+        self,
+        mensagens: List[Message],
+        ao_concluir: Optional[Callable[[int, Optional[Exception]], None]] = None
+    ) -> List[Optional[Exception]]:
+        """
+        Envia as mensagens em sequência pela mesma sessão
+
+        Uma mensagem recusada não interrompe as demais; se a conexão cair,
+        ela é reaberta e a mensagem, reenviada uma vez. Se não for possível
+        reabrir, a mensagem atual e as seguintes recebem o erro da reconexão;
+        as já aceitas continuam com None.
+
+        Args:
+            ao_concluir: Chamado com (índice, None ou exceção) assim que o
+                servidor aceita ou recusa cada mensagem
+
+        Returns:
+            Para cada mensagem, None se foi aceita ou a exceção do servidor
+
+        Raises:
+            smtplib.SMTPAuthenticationError e erros de conexão ao abrir a sessão
+            (antes de qualquer mensagem ser enviada)
+        """
+        resultados: List[Optional[Exception]] = []
+
+        def registrar(resultado: Optional[Exception]) -> None:
+            resultados.append(resultado)
+            if ao_concluir is not None:
+                ao_concluir(len(resultados) - 1, resultado)
+
+        with self._vagas:
+            conexao = self._obter()
+            try:
+                for msg in mensagens:
+                    for tentativa in range(2):
+                        try:
+                            conexao.smtp.send_message(msg)
+                            registrar(None)
+                            break
+                        except _ERROS_CONEXAO as e:
+                            conexao.smtp.close()
+                            conexao = None
+                            if tentativa:
+                                registrar(e)
+                            try:
+                                conexao = self._abrir()
+                            except (smtplib.SMTPException, OSError) as erro:
+                                while len(resultados) < len(mensagens):
+                                    registrar(erro)
+                                return resultados
+                        except smtplib.SMTPException as e:
+                            registrar(e)
+                            break
+            except BaseException:
+                if conexao is not None:
+                    conexao.smtp.close()
+                    conexao = None
+                raise
+            finally:
+                if conexao is not None:
+                    self._devolver(conexao)
+        return resultados
+
+    def enviar(self, msg: Message) -> None:
+        """Envia uma mensagem; levanta a exceção do servidor se for recusada"""
+        erro = self.enviar_varios([msg])[0]
+        if erro is not None:
+            raise erro
+
+    def fechar(self) -> None:
+        with self._lock:
+            livres, self._livres = self._livres, []
+        for conexao in livres:
+            conexao.fechar()
@@ -0,0 +1,108 @@
+"""
+Cache dos resultados de snippets sem efeitos colaterais executados pelo agente
+"""
+import ast
+import hashlib
+from typing import Optional
+
+from memory_cache import CacheLRU
+
+# Lista de permissão: qualquer outra chamada (inclusive funções definidas pelo agente na
+# sessão, que podem alterar o df) torna o snippet impuro e ele sempre executa.
+# Funções embutidas chamadas pelo nome que só leem os argumentos
+_FUNCOES_PURAS = {
+    'len', 'sorted', 'list', 'tuple', 'dict', 'set', 'frozenset', 'str', 'repr', 'int', 'float',
+    'bool', 'round', 'abs', 'min', 'max', 'sum', 'any', 'all', 'range', 'enumerate', 'zip',
+    'reversed', 'isinstance', 'type', 'print',
+}
+
+# Métodos de leitura de pandas (DataFrame, Series, GroupBy, .str), de str, list e dict e do
+# módulo pd; nenhum altera o objeto (exceto com `inplace=True`, recusado à parte) nem grava arquivos
+_METODOS_LEITURA = {
+    # Inspeção e seleção
+    'head', 'tail', 'describe', 'info', 'isin', 'isna', 'isnull', 'notna', 'notnull', 'between',
+    'duplicated', 'drop_duplicates', 'dropna', 'fillna', 'filter', 'query', 'select_dtypes', 'get',
+    'nlargest', 'nsmallest', 'idxmax', 'idxmin', 'where', 'mask', 'clip', 'memory_usage',
+    'keys', 'values', 'items', 'copy', 'eq', 'ne', 'lt', 'le', 'gt', 'ge',
+    # Agregação
+    'value_counts', 'unique', 'nunique', 'groupby', 'size', 'count', 'sum', 'mean', 'median',
+    'min', 'max', 'std', 'var', 'quantile', 'mode', 'first', 'last', 'any', 'all', 'prod',
+    'cumsum', 'cumcount', 'diff', 'pct_change', 'corr', 'rank', 'round', 'abs',
+    # Reformatação (devolvem objeto novo)
+    'sort_values', 'sort_index', 'reset_index', 'set_index', 'rename', 'astype', 'drop',
+    'pivot_table', 'crosstab', 'melt', 'stack', 'unstack', 'transpose', 'explode', 'merge',
+    'concat', 'to_frame', 'to_list', 'tolist', 'to_dict', 'to_numpy', 'to_string',
+    # Texto
+    'contains', 'startswith', 'endswith', 'len', 'lower', 'upper', 'strip', 'lstrip', 'rstrip',
+    'replace', 'split', 'slice', 'zfill', 'match', 'fullmatch', 'extract', 'findall', 'join',
+    'format', 'cat', 'title', 'isdigit', 'isnumeric',
+}
+
+# Nomes que dão acesso a estado externo ao DataFrame
+_NOMES_IMPUROS = {
+    'open', 'exec', 'eval', 'compile', '__import__', 'globals', 'locals', 'vars', 'setattr',
+    'delattr', 'input', 'exit', 'quit', 'breakpoint', 'os', 'sys', 'subprocess', 'shutil',
+    'importlib', 'builtins', 'random', 'time', 'datetime',
+}
+
+
+def normalizar_codigo(codigo: str) -> Optional[str]:
+    """Forma canônica do código (ignora espaços, comentários e estilo de aspas); None se inválido"""
+    try:
+        return ast.dump(ast.parse(codigo))
+    except SyntaxError:
+        return None
+
+
+def e_snippet_puro(codigo: str) -> bool:
+    """
+    Indica se o snippet só lê dados: apenas expressões (inclusive print), sem
+    atribuições, sem `inplace=True` e só com chamadas da lista de permissão
+    (funções embutidas de leitura pelo nome, métodos de leitura do pandas)
+    """
+    try:
+        tree = ast.parse(codigo)
+    except SyntaxError:
+        return False
+
+    if not tree.body or not all(isinstance(stmt, ast.Expr) for stmt in tree.body):
+        return False
+
+    for no in ast.walk(tree):
+        if isinstance(no, (ast.NamedExpr, ast.Yield, ast.YieldFrom, ast.Await)):
+            return False
+        if isinstance(no, ast.Name) and no.id in _NOMES_IMPUROS:
+            return False
+        if isinstance(no, ast.Call):
+            funcao = no.func
+            if isinstance(funcao, ast.Name):
+                if funcao.id not in _FUNCOES_PURAS:
+                    return False
+            elif not (isinstance(funcao, ast.Attribute) and funcao.attr in _METODOS_LEITURA):
+                return False
+            for kw in no.keywords:
+                if kw.arg == 'inplace' and not (isinstance(kw.value, ast.Constant) and kw.value.value is False):
+                    return False
+    return True
+
+
+def encadear_estado(estado: str, codigo_normalizado: str) -> str:
+    """Novo estado do namespace após executar um snippet que pode alterá-lo"""
+    return hashlib.sha1(f"{estado}\0{codigo_normalizado}".encode('utf-8')).hexdigest()
+
+
+class CacheSnippets(CacheLRU):
+    """
+    LRU de saídas de snippets puros
+
+    A chave combina o código normalizado, o dataset e o histórico de snippets
+    com efeitos já executados na sessão: duas sessões que criaram as mesmas
+    colunas da mesma forma compartilham os resultados.
+    """
+
+    def __init__(self, max_itens: int = 512):
+        super().__init__(max_itens)
+
+    @staticmethod
+    def chave(codigo_normalizado: str, dataset: str, estado: str) -> str:
+        return hashlib.sha1(f"{dataset}\0{estado}\0{codigo_normalizado}".encode('utf-8')).hexdigest()
@@ -0,0 +1,52 @@
+"""
+Importação sob demanda de módulos pesados e relatório de tempo de inicialização
+"""
+import importlib
+import sys
+import time
+from types import ModuleType
+from typing import Dict, List
+
+import pandas as pd
+
+# Referência de início do processo (este módulo é o primeiro importado pelo app)
+_inicio_processo = time.perf_counter()
+
+_tempos_importacao: Dict[str, float] = {}
+_etapas: Dict[str, float] = {}
+
+
+def lazy_import(nome: str) -> ModuleType:
+    """
+    Importa um módulo apenas quando ele é realmente necessário
+
+    O tempo da primeira importação é registrado para o relatório de
+    inicialização; chamadas seguintes reutilizam o módulo já carregado.
+    """
+    modulo = sys.modules.get(nome)
+    if modulo is not None:
+        return modulo
+
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nome)
+    _tempos_importacao[nome] = time.perf_counter() - inicio
+    return modulo
+
+
+def marcar_etapa(nome: str) -> None:
+    """Registra (uma única vez por processo) o instante de uma etapa da inicialização"""
+    if nome not in _etapas:
+        _etapas[nome] = time.perf_counter() - _inicio_processo
+
+
+def relatorio_importacao() -> pd.DataFrame:
+    """Retorna DataFrame com etapas de inicialização e importações sob demanda"""
+    linhas: List[Dict] = [
+        {'Tipo': 'Etapa', 'Nome': nome, 'Tempo (ms)': round(segundos * 1000, 1)}
+        for nome, segundos in _etapas.items()
+    ]
+    linhas += [
+        {'Tipo': 'Importação', 'Nome': nome, 'Tempo (ms)': round(segundos * 1000, 1)}
+        for nome, segundos in sorted(_tempos_importacao.items(), key=lambda x: -x[1])
+    ]
+    return pd.DataFrame(linhas, columns=['Tipo', 'Nome', 'Tempo (ms)'])
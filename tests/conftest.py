@@ -0,0 +1,89 @@
+import os
+import socketserver
+import sys
+import threading
+
+import pytest
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _SessaoSMTP(socketserver.StreamRequestHandler):
+    """Servidor SMTP mínimo: aceita tudo, recusa destinatários `recusado@` e derruba conexões sob comando"""
+
+    def handle(self):
+        servidor = self.server
+        servidor.conexoes += 1
+        enviadas = 0
+        destinatarios = []
+        self._responder('220 teste')
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            comando = linha.decode('utf-8', 'replace').strip()
+            maiusculo = comando.upper()
+            if maiusculo.startswith(('EHLO', 'HELO')):
+                self._responder('250-teste', '250 SIZE 10000000')
+            elif maiusculo.startswith('MAIL'):
+                destinatarios = []
+                self._responder('250 ok')
+            elif maiusculo.startswith('RCPT'):
+                if 'recusado@' in comando:
+                    self._responder('550 destinatario inexistente')
+                else:
+                    destinatarios.append(comando.split(':', 1)[1].strip(' <>'))
+                    self._responder('250 ok')
+            elif maiusculo == 'DATA':
+                self._responder('354 envie')
+                while self.rfile.readline().strip() != b'.':
+                    pass
+                enviadas += 1
+                servidor.aceitas.extend(destinatarios)
+                self._responder('250 aceita')
+                if servidor.mensagens_por_conexao and enviadas >= servidor.mensagens_por_conexao:
+                    if servidor.recusar_reconexao:
+                        servidor.parar()
+                    return
+            elif maiusculo in ('NOOP', 'RSET'):
+                self._responder('250 ok')
+            elif maiusculo == 'QUIT':
+                self._responder('221 tchau')
+                return
+            else:
+                self._responder('500 comando desconhecido')
+
+    def _responder(self, *linhas):
+        for linha in linhas:
+            self.wfile.write((linha + '\r\n').encode())
+
+
+class ServidorSMTP(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SessaoSMTP)
+        self.porta = self.server_address[1]
+        self.conexoes = 0
+        self.aceitas = []
+        # Derruba a conexão depois de N mensagens (0 = nunca)
+        self.mensagens_por_conexao = 0
+        # Ao derrubar, para de aceitar conexões novas
+        self.recusar_reconexao = False
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        if self._thread.is_alive():
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            self._thread.join(5)
+        self.server_close()
+
+
+@pytest.fixture
+def servidor_smtp():
+    servidor = ServidorSMTP()
+    yield servidor
+    servidor.parar()
@@ -0,0 +1,76 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from agent_streaming import ExecucaoCancelada, JobAgentCallback, executar_com_streaming
+from background_jobs import Job
+
+
+class _CancelarAposTokens(BaseCallbackHandler):
+    """Simula o clique em "Cancelar" depois de alguns tokens"""
+
+    def __init__(self, evento, tokens):
+        self.evento = evento
+        self.restantes = tokens
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.restantes -= 1
+        if self.restantes == 0:
+            self.evento.set()
+
+
+def _modelo():
+    return GenericFakeChatModel(messages=iter([AIMessage(content="um dois tres quatro cinco seis")]))
+
+
+class _Area:
+    """Container do Streamlit mínimo: guarda o último texto escrito"""
+
+    def __init__(self):
+        self.texto = None
+
+    def container(self):
+        return self
+
+    def empty(self):
+        return self
+
+    def markdown(self, texto):
+        self.texto = texto
+
+
+def test_cancelar_interrompe_o_streaming_no_job():
+    job = Job(id='1', descricao='validação')
+    callbacks = [JobAgentCallback(job, max_passos=5, progresso_inicial=0.5, progresso_final=0.9),
+                 _CancelarAposTokens(job.cancel_event, 2)]
+    with pytest.raises(ExecucaoCancelada):
+        for _ in _modelo().stream("oi", config={'callbacks': callbacks}):
+            pass
+    # Parou no primeiro token depois do cancelamento
+    assert job.texto_parcial == "um "
+
+
+def test_executar_com_streaming_cancelado_nao_finaliza_a_resposta():
+    evento = threading.Event()
+    area = _Area()
+
+    def run(query, callbacks):
+        return "".join(c.content for c in _modelo().stream(query, config={'callbacks': callbacks}))
+
+    with pytest.raises(ExecucaoCancelada):
+        executar_com_streaming(SimpleNamespace(run=run), "oi", area, evento, [_CancelarAposTokens(evento, 3)])
+    assert area.texto.endswith("▌")
+
+    resposta = executar_com_streaming(SimpleNamespace(run=run), "oi", area, threading.Event())
+    assert resposta == area.texto == "um dois tres quatro cinco seis"
+
+
+def test_evento_marcado_antes_barra_a_chamada():
+    job = Job(id='1', descricao='validação')
+    job.cancel_event.set()
+    with pytest.raises(ExecucaoCancelada):
+        _modelo().invoke("oi", config={'callbacks': [JobAgentCallback(job, 5, 0.0, 1.0)]})
@@ -0,0 +1,39 @@
+from answer_cache import CacheRespostas, normalizar_pergunta
+
+
+def _cache_com(pergunta, resposta="resposta"):
+    cache = CacheRespostas(limiar=0.6)
+    cache.guardar('arq', pergunta, resposta)
+    return cache
+
+
+def test_pergunta_parecida_reaproveita_resposta():
+    cache = _cache_com("Quais são os NCMs inválidos do arquivo?")
+    encontrada = cache.buscar('arq', "mostre os ncms invalidos")
+    assert encontrada is not None and encontrada.resposta == "resposta"
+
+
+def test_negacao_diferente_nunca_e_acerto():
+    cache = _cache_com("Quais produtos estão com problema?")
+    assert cache.buscar('arq', "Quais produtos estão sem problema?") is None
+    assert cache.buscar('arq', "Quais produtos não estão com problema?") is None
+
+    cache = _cache_com("Total de produtos exceto rações")
+    assert cache.buscar('arq', "Total de produtos rações") is None
+
+
+def test_comparativos_opostos_nao_compartilham_resposta():
+    cache = _cache_com("Quais os 10 produtos mais caros?")
+    assert cache.buscar('arq', "Quais os 10 produtos menos caros?") is None
+    assert cache.buscar('arq', "Quais os 10 produto mais caro?") is not None
+
+
+def test_numeros_e_arquivo_diferentes_nao_compartilham_resposta():
+    cache = _cache_com("Quantos produtos têm o NCM 2309.10.00?")
+    assert cache.buscar('arq', "Quantos produtos têm o NCM 2309.90.10?") is None
+    assert cache.buscar('outro', "Quantos produtos têm o NCM 2309.10.00?") is None
+
+
+def test_termos_de_sentido_nao_sao_cortados():
+    assert normalizar_pergunta("Produtos sem NCM por estabelecimento") == "produto sem ncm por estabelecimento"
+    assert normalizar_pergunta("os mais vendidos") == "mais vendido"
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from conformity_sampling import ESTRATO_CERTEZA, alocar_amostra, estimar_conformidade, montar_produtos
+
+REFERENCIA = {f'{c:02d}{i:06d}' for c in range(1, 40) for i in range(0, 200, 2)}
+
+
+def _arquivo(linhas=60_000, capitulos=30, semente=0):
+    """Produtos de `capitulos` capítulos; NCMs com final ímpar ficam fora da referência"""
+    rng = np.random.default_rng(semente)
+    produto = rng.integers(0, 3000, linhas)
+    capitulo = produto % capitulos + 1
+    item = produto % 200
+    return pd.DataFrame({
+        'ncm': [f'{c:02d}{i:06d}' for c, i in zip(capitulo, item)],
+        'descricao': [f'produto {p}' for p in produto],
+        'valor': rng.gamma(2.0, 50.0, linhas).round(2),
+    })
+
+
+def test_valor_em_texto_e_convertido_antes_da_soma():
+    df = pd.DataFrame({
+        'ncm': ['23091000', '23091000', '42010090'],
+        'descricao': ['Ração', 'Ração', 'Coleira'],
+        'valor': ['10.5', '4.5', 'n/d'],
+    })
+    colunas = {'ncm': 'ncm', 'descricao': 'descricao', 'valor': 'valor'}
+    produtos = montar_produtos(df, colunas, 400).set_index('descricao')
+    assert produtos.loc['Ração', 'valor'] == 15.0
+    assert produtos.loc['Coleira', 'valor'] == 0.0
+    assert produtos.loc['Ração', 'linhas'] == 2
+
+
+def test_amostra_nao_passa_do_tamanho_pedido():
+    df = _arquivo()
+    colunas = {'ncm': 'ncm', 'descricao': 'descricao', 'valor': 'valor'}
+    rng = np.random.default_rng(1)
+    # 90 estratos: com 200 produtos o mínimo de 2 por estrato empurrava a amostra para além do pedido
+    for tamanho in (200, 400):
+        produtos = montar_produtos(df, colunas, tamanho)
+        posicoes = alocar_amostra(produtos, tamanho, rng)
+        assert tamanho - 10 <= len(posicoes) <= tamanho
+        assert len(np.unique(posicoes)) == len(posicoes)
+        # Estrato de certeza inteiro e ao menos 2 produtos por estrato
+        sorteados = produtos.iloc[posicoes]
+        assert (sorteados['estrato'] == ESTRATO_CERTEZA).sum() == (produtos['estrato'] == ESTRATO_CERTEZA).sum()
+        assert sorteados.groupby('estrato').size().min() >= 2
+
+
+def test_minimo_por_estrato_prevalece_sobre_o_tamanho():
+    df = _arquivo()
+    colunas = {'ncm': 'ncm', 'descricao': 'descricao', 'valor': 'valor'}
+    produtos = montar_produtos(df, colunas, 100)
+    posicoes = alocar_amostra(produtos, 100, np.random.default_rng(1))
+    assert len(posicoes) == 2 * produtos['estrato'].nunique() > 100
+
+
+def test_estimativa_proxima_da_conformidade_real():
+    df = _arquivo()
+    real = df['ncm'].isin(REFERENCIA).mean() * 100
+    e = estimar_conformidade(df, REFERENCIA, tamanho_amostra=400, semente=3)
+    assert e.ic_inferior <= real <= e.ic_superior
+    assert abs(e.percentual_conformidade - real) < 5
+    assert len(e.amostra) <= 400
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+import dataset_profile
+from dataset_profile import converter_valores, detectar_colunas, perfilar_dataset
+
+
+class _Referencia:
+    def get_all_valid_ncms(self):
+        return ['23091000', '42010090']
+
+
+@pytest.fixture(autouse=True)
+def _referencia(monkeypatch):
+    monkeypatch.setattr(dataset_profile, 'get_ncm_reference', _Referencia)
+
+
+def test_converte_valores_em_texto():
+    serie = pd.Series(['1.234,56', 'R$ 12,50', '1,234.56', '10', 'n/d', None, 7])
+    convertidos = converter_valores(serie)
+    assert convertidos[:4].tolist() == [1234.56, 12.5, 1234.56, 10.0]
+    assert convertidos[[4, 5]].isna().all()
+    assert convertidos[6] == 7.0
+
+
+def test_coluna_de_valor_em_texto_e_detectada():
+    df = pd.DataFrame({
+        'NCM': ['23091000', '2309.10.00', '42010090'],
+        'Descricao': ['Ração', 'Ração', 'Coleira'],
+        'Valor Total': ['10,50', '4,50', 'R$ 1.000,00'],
+        'Total de itens': ['muitos', 'poucos', 'n/d'],
+    })
+    assert detectar_colunas(df)['valor'] == 'Valor Total'
+    resumo = perfilar_dataset(df)['resumo_ncms']
+    assert resumo.loc['23091000', 'valor_total'] == 15.0
+    assert resumo.loc['42010090', 'valor_total'] == 1000.0
+
+
+def test_coluna_com_poucos_numeros_nao_e_valor():
+    df = pd.DataFrame({'NCM': ['23091000'] * 5, 'Total': ['a', 'b', 'c', 'd', '1']})
+    assert detectar_colunas(df)['valor'] is None
+
+
+def test_prompt_resume_o_perfil_e_limita_os_ncms():
+    df = pd.DataFrame({
+        'NCM': ['23091000'] * 3 + ['42010090'] * 2 + ['1234'],
+        'Descricao': ['Ração A', 'RAÇÃO A ', 'Ração B', 'Coleira', 'Coleira', 'Areia'],
+    })
+    perfil = perfilar_dataset(df, max_ncms=2)
+    texto = dataset_profile.formatar_perfil_para_prompt(perfil)
+    assert "Linhas: 6" in texto
+    assert "NCMs únicos: 3 | Formato inválido: 1 | Fora da tabela de referência: 1" in texto
+    # Exemplos deduplicados pela descrição normalizada
+    assert "23091000 | 3 | sim | sim | Ração A; Ração B" in texto
+    assert "42010090 | 2 | sim | sim | Coleira" in texto
+    assert "1234 |" not in texto
+    assert "... e mais 1 NCMs" in texto
+
+
+def test_prompt_sem_coluna_ncm():
+    texto = dataset_profile.formatar_perfil_para_prompt(perfilar_dataset(pd.DataFrame({'Produto': ['Ração']})))
+    assert texto.endswith("Nenhuma coluna NCM detectada pelo nome.")
+
+
+def test_variantes_da_descricao_viram_um_exemplo_e_um_grupo():
+    df = pd.DataFrame({
+        'NCM': ['23091000'] * 4 + ['42010090'],
+        'Descricao': ['RACAO GOLDEN 15KG', 'Ração Golden 15 kg', 'racao golden 15kg un', 'Petisco bifinho', 'Coleira'],
+    })
+    perfil = perfilar_dataset(df)
+    assert perfil['resumo_ncms'].loc['23091000', 'exemplos'] == ['RACAO GOLDEN 15KG', 'Petisco bifinho']
+    assert perfil['grupos_unicos'] == 3
+    assert perfil['pares_unicos'] >= perfil['grupos_unicos']
+    assert perfil['grupo_descricao'].iloc[:3].nunique() == 1
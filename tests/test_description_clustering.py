@@ -0,0 +1,47 @@
+import pandas as pd
+
+from description_clustering import agrupar_descricoes, normalizar_descricoes, propagar_veredito
+
+
+def test_normalizar_remove_acentos_quantidades_e_skus():
+    serie = pd.Series(['Ração Golden Adulto 15kg SKU123', 'RACAO golden adulto 15 KG', '12345'])
+    normalizadas = normalizar_descricoes(serie)
+    assert normalizadas[0] == normalizadas[1] == 'racao golden adulto'
+    # Descrição só com código não vira string vazia
+    assert normalizadas[2] == '12345'
+
+
+def test_quase_duplicatas_caem_no_mesmo_cluster():
+    serie = pd.Series([
+        'Ração Golden Adulto Frango 15kg',
+        'Racao Golden Adulto Frango 10,1 kg',
+        'Racao Golden Adulto Frang 15kg',
+        'Areia Sanitaria Pipicat Classic',
+        'Areia Sanitária Pipicat Classic 4kg',
+        'Coleira Antipulgas Seresto Caes Grandes',
+    ])
+    clusters = agrupar_descricoes(serie)['cluster_id']
+    assert clusters[0] == clusters[1] == clusters[2]
+    assert clusters[3] == clusters[4]
+    assert clusters.nunique() == 3
+
+
+def test_descricoes_diferentes_nao_sao_unidas():
+    serie = pd.Series(['Ração Premier Filhotes', 'Shampoo Neutro Pet Clean', 'Arranhador Torre Gatos'])
+    assert agrupar_descricoes(serie)['cluster_id'].nunique() == 3
+
+
+def test_agrupamento_preserva_indice_e_vazios():
+    assert agrupar_descricoes(pd.Series([], dtype=object)).empty
+    serie = pd.Series(['Petisco Dental', 'Petisco Dental 100g'], index=[10, 20])
+    resultado = agrupar_descricoes(serie)
+    assert list(resultado.index) == [10, 20]
+    assert resultado['cluster_id'].nunique() == 1
+
+
+def test_propagar_veredito_replica_por_cluster():
+    clusters = pd.Series([1, 0, 1], index=['a', 'b', 'c'])
+    veredito = pd.DataFrame({'ncm': ['23091000', '33051000']}, index=[0, 1])
+    propagado = propagar_veredito(clusters, veredito)
+    assert list(propagado.index) == ['a', 'b', 'c']
+    assert list(propagado['ncm']) == ['33051000', '23091000', '33051000']
@@ -0,0 +1,159 @@
+import os
+import time
+from email.message import EmailMessage
+
+from email_outbox import ENVIADO, ENVIANDO, FALHOU, PENDENTE, Outbox
+from smtp_pool import PoolSMTP
+
+
+def _mensagem(destinatario):
+    msg = EmailMessage()
+    msg['From'] = 'relatorios@teste.com'
+    msg['To'] = destinatario
+    msg['Subject'] = f'Relatório {destinatario}'
+    msg.set_content('corpo')
+    msg.add_attachment(b'%PDF-1.4', maintype='application', subtype='pdf', filename='relatorio_ncm.pdf')
+    return msg
+
+
+def _spool(outbox):
+    return sorted(os.listdir(outbox.diretorio_spool))
+
+
+class Envio:
+    """Envio falso: devolve `erros` e avisa cada resultado até `falhar_apos`, quando levanta"""
+
+    def __init__(self, erros=None, falhar_apos=None):
+        self.erros = erros
+        self.falhar_apos = falhar_apos
+        self.lotes = []
+
+    def __call__(self, mensagens, ao_concluir):
+        self.lotes.append([str(m['To']) for m in mensagens])
+        erros = self.erros if self.erros is not None else [None] * len(mensagens)
+        for i, erro in enumerate(erros[:len(mensagens)]):
+            if self.falhar_apos is not None and i >= self.falhar_apos:
+                raise ConnectionError("conexão perdida")
+            ao_concluir(i, erro)
+        return erros[:len(mensagens)]
+
+
+def test_envio_marca_enviado_e_limpa_o_spool(tmp_path):
+    envio = Envio()
+    outbox = Outbox(str(tmp_path), envio)
+    ids = [outbox.enfileirar(_mensagem(f'{i}@x.com')) for i in range(3)]
+    assert len(_spool(outbox)) == 3
+
+    assert outbox.processar_lote() == 3
+    assert [e['status'] for e in outbox.status(ids)] == [ENVIADO] * 3
+    assert _spool(outbox) == []
+    assert envio.lotes == [['0@x.com', '1@x.com', '2@x.com']]
+    assert outbox.processar_lote() == 0
+
+
+def test_falha_reagenda_com_backoff_e_desiste_depois_do_limite(tmp_path):
+    outbox = Outbox(str(tmp_path), Envio(erros=['550 recusado']), max_tentativas=2, backoff_base_s=10)
+    id_msg = outbox.enfileirar(_mensagem('a@x.com'))
+
+    inicio = time.time()
+    outbox.processar_lote()
+    estado, = outbox.status([id_msg])
+    assert (estado['status'], estado['tentativas'], estado['ultimo_erro']) == (PENDENTE, 1, '550 recusado')
+    assert inicio + 8 <= estado['proxima_tentativa'] <= time.time() + 12
+    # Ainda não venceu
+    assert outbox.processar_lote() == 0
+
+    with outbox._conectar() as db:
+        db.execute("UPDATE mensagens SET proxima_tentativa = 0")
+    outbox.processar_lote()
+    estado, = outbox.status([id_msg])
+    assert (estado['status'], estado['tentativas']) == (FALHOU, 2)
+    assert len(_spool(outbox)) == 1  # mantido para reenvio manual
+
+
+def test_aceitas_antes_de_uma_falha_no_meio_do_lote_nao_sao_reenviadas(tmp_path):
+    envio = Envio(falhar_apos=2)
+    outbox = Outbox(str(tmp_path), envio)
+    ids = [outbox.enfileirar(_mensagem(f'{i}@x.com')) for i in range(4)]
+
+    outbox.processar_lote()
+    estados = outbox.status(ids)
+    assert [e['status'] for e in estados] == [ENVIADO, ENVIADO, PENDENTE, PENDENTE]
+    assert estados[2]['ultimo_erro'] == 'conexão perdida'
+
+    with outbox._conectar() as db:
+        db.execute("UPDATE mensagens SET proxima_tentativa = 0 WHERE status = ?", (PENDENTE,))
+    envio.falhar_apos = None
+    outbox.processar_lote()
+    assert envio.lotes[-1] == ['2@x.com', '3@x.com']
+    assert [e['status'] for e in outbox.status(ids)] == [ENVIADO] * 4
+
+
+def test_reserva_do_lote_nao_e_desfeita_por_outro_processo(tmp_path):
+    primeiro = Outbox(str(tmp_path), Envio(), prazo_envio_s=0.2)
+    id_msg = primeiro.enfileirar(_mensagem('a@x.com'))
+    assert len(primeiro._reservar_lote(time.time())) == 1
+
+    envio = Envio()
+    segundo = Outbox(str(tmp_path), envio)
+    assert segundo.status([id_msg])[0]['status'] == ENVIANDO
+    assert segundo.processar_lote() == 0
+
+    # Reserva vencida (processo encerrado no meio do envio): a mensagem volta à fila
+    time.sleep(0.25)
+    assert segundo.processar_lote() == 1
+    assert envio.lotes == [['a@x.com']]
+    assert segundo.status([id_msg])[0]['status'] == ENVIADO
+
+
+def test_queda_do_smtp_no_meio_do_lote(tmp_path, servidor_smtp):
+    servidor_smtp.mensagens_por_conexao = 2
+    servidor_smtp.recusar_reconexao = True
+    pool = PoolSMTP('127.0.0.1', servidor_smtp.porta, starttls=False, timeout=5)
+
+    def enviar(mensagens, ao_concluir):
+        erros = pool.enviar_varios(mensagens, lambda i, erro: ao_concluir(i, None if erro is None else str(erro)))
+        return [None if erro is None else str(erro) for erro in erros]
+
+    outbox = Outbox(str(tmp_path), enviar)
+    ids = [outbox.enfileirar(_mensagem(f'{i}@x.com')) for i in range(4)]
+    outbox.processar_lote()
+
+    assert [e['status'] for e in outbox.status(ids)] == [ENVIADO, ENVIADO, PENDENTE, PENDENTE]
+    assert servidor_smtp.aceitas == ['0@x.com', '1@x.com']
+    assert len(_spool(outbox)) == 2
+
+
+def test_erro_sem_aviso_por_mensagem_vale_para_o_lote(tmp_path):
+    erros = ['Configure EMAIL_APP_PASSWORD no .env'] * 2
+    outbox = Outbox(str(tmp_path), lambda mensagens, ao_concluir: erros)
+    ids = [outbox.enfileirar(_mensagem(f'{i}@x.com')) for i in range(2)]
+    outbox.processar_lote()
+    assert [e['ultimo_erro'] for e in outbox.status(ids)] == erros
+
+
+def test_conexoes_sao_fechadas(tmp_path, monkeypatch):
+    import sqlite3
+
+    import email_outbox
+
+    abertas = []
+    conectar = sqlite3.connect
+
+    def rastrear(*args, **kwargs):
+        abertas.append(conectar(*args, **kwargs))
+        return abertas[-1]
+
+    monkeypatch.setattr(email_outbox.sqlite3, 'connect', rastrear)
+    outbox = Outbox(str(tmp_path), enviar=Envio(erros=[None, 'recusado']))
+    ids = [outbox.enfileirar(_mensagem('a@teste.com')), outbox.enfileirar(_mensagem('b@teste.com'))]
+    outbox.processar_lote()
+    outbox.status(ids)
+    outbox.contagem()
+    assert len(abertas) >= 6
+    for db in abertas:
+        try:
+            db.execute("SELECT 1")
+        except sqlite3.ProgrammingError:
+            continue
+        raise AssertionError("conexão deixada aberta")
@@ -0,0 +1,64 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("reportlab")
+
+from dataset_profile import perfilar_dataset
+from establishment_reports import SEM_ESTABELECIMENTO, dividir_por_estabelecimento, gerar_zip_relatorios
+
+
+@pytest.fixture
+def relatorios():
+    df = pd.DataFrame({
+        'Loja': ['A', 'A', 'B', 'C', 'D', 'D'],
+        'NCM': ['23091000', '123', '23091000', '9999.99.99', '23091000', '42010090'],
+        'Descricao': ['Racao', 'Coleira', 'Racao', 'Brinquedo', 'Racao', 'Guia'],
+        'Email': ['a@loja.com', None, 'b@loja.com', None, None, None],
+    })
+    return dividir_por_estabelecimento(df, perfilar_dataset(df), None)
+
+
+def test_divide_achados_locais_por_loja(relatorios):
+    por_loja = {r.estabelecimento: r for r in relatorios}
+    assert list(por_loja) == ['A', 'B', 'C', 'D']
+    assert list(por_loja['A'].problemas_df['Produto']) == ['Coleira']
+    assert por_loja['B'].ncms_problemas == 0
+    assert (por_loja['A'].contato, por_loja['C'].contato) == ('a@loja.com', None)
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_zip_tem_um_pdf_por_loja_e_o_resumo(relatorios, n_workers):
+    progresso = []
+    conteudo = gerar_zip_relatorios(relatorios, n_workers=n_workers, ao_concluir=lambda f, t: progresso.append((f, t)))
+
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as arquivo:
+        nomes = set(arquivo.namelist())
+        assert nomes == {r.nome_arquivo for r in relatorios} | {'resumo_estabelecimentos.csv'}
+        assert all(arquivo.read(r.nome_arquivo) == r.pdf_bytes for r in relatorios)
+    assert all(r.pdf_bytes.startswith(b'%PDF') for r in relatorios)
+    assert progresso == [(i, 4) for i in range(1, 5)]
+
+
+def test_nomes_de_pdf_unicos_e_loja_ausente_rotulada():
+    df = pd.DataFrame({
+        'Loja': ['Loja 1/A', 'Loja 1?A', None, '  ', 'loja 1 a'],
+        'NCM': ['23091000', '23091000', '123', '23091000', '23091000'],
+        'Descricao': ['Racao'] * 5,
+    })
+    relatorios = dividir_por_estabelecimento(df, perfilar_dataset(df), None)
+    por_loja = {r.estabelecimento: r for r in relatorios}
+    assert set(por_loja) == {'Loja 1/A', 'Loja 1?A', 'loja 1 a', SEM_ESTABELECIMENTO}
+    assert por_loja[SEM_ESTABELECIMENTO].total_produtos == 2
+    assert 'nan' not in por_loja
+    nomes = [r.nome_arquivo.lower() for r in relatorios]
+    assert len(set(nomes)) == len(nomes)
+    assert {por_loja['Loja 1/A'].nome_arquivo, por_loja['Loja 1?A'].nome_arquivo} == {
+        'relatorio_ncm_Loja_1_A.pdf', 'relatorio_ncm_Loja_1_A_2.pdf'
+    }
+
+    conteudo = gerar_zip_relatorios(relatorios, n_workers=1)
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as arquivo:
+        assert len(arquivo.namelist()) == len(set(arquivo.namelist())) == len(relatorios) + 1
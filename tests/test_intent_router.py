@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from dataset_profile import perfilar_dataset
+from intent_router import _codigo, _dobrar, rotear_pergunta
+
+
+@pytest.fixture
+def dados():
+    df = pd.DataFrame({
+        'NCM': ['2309.10.00', '2309.10.00', '9503.00.99', '123'],
+        'Descricao': ['Racao Golden', 'Racao Premier', 'Bolinha de borracha', 'Coleira'],
+        'Valor': [10.0, 20.0, 5.0, 1.0],
+    })
+    return df, perfilar_dataset(df)
+
+
+@pytest.mark.parametrize('pergunta, esperado', [
+    ("O NCM 2309.10.00 está correto?", '23091000'),
+    ("ncm 9503 existe?", '9503'),
+    ("Produtos do NCM nº 23", '23'),
+    ("Liste os produtos com 2309.10", '230910'),
+    ("23091000 está certo?", '23091000'),
+    ("Mostre os 10 produtos mais caros", None),
+    ("Quais os 20 produtos de maior valor?", None),
+    ("Em 2023 quais produtos tiveram problema?", None),
+    ("Produtos com 230910", None),
+])
+def test_codigo(pergunta, esperado):
+    assert _codigo(_dobrar(pergunta)) == esperado
+
+
+@pytest.mark.parametrize('pergunta', [
+    "Mostre os 10 produtos mais caros",
+    "Quais os 20 produtos de maior valor?",
+    "Em 2023 quais produtos tiveram problema?",
+    "Explique por que o NCM 9503.00.99 está errado",
+])
+def test_numeros_soltos_e_perguntas_abertas_vao_para_o_agente(dados, pergunta):
+    df, perfil = dados
+    assert rotear_pergunta(pergunta, df, perfil) is None
+
+
+def test_lista_produtos_por_prefixo(dados):
+    df, perfil = dados
+    resposta = rotear_pergunta("Liste os produtos com NCM 2309", df, perfil)
+    assert resposta.intencao == 'listar produtos por NCM'
+    assert set(resposta.tabela['Produto']) == {'Racao Golden', 'Racao Premier'}
+
+
+def test_ncms_unicos(dados):
+    df, perfil = dados
+    assert rotear_pergunta("Quantos NCMs únicos existem?", df, perfil).intencao == 'NCMs únicos'
+
+
+@pytest.mark.parametrize('pergunta', [
+    "Liste produtos sem NCM 9503",
+    "Quais produtos não têm NCM 23099010?",
+    "Mostre produtos exceto NCM 2309",
+    "Produtos fora do NCM 2309",
+    "Liste os produtos excluindo NCM 9503.00.99",
+    "O NCM 2309.10.00 nunca está correto?",
+    "Quais os NCMs menos frequentes?",
+])
+def test_negacao_e_exclusao_vao_para_o_agente(dados, pergunta):
+    df, perfil = dados
+    assert rotear_pergunta(pergunta, df, perfil) is None
+
+
+def test_mais_frequentes_continua_roteado(dados):
+    df, perfil = dados
+    assert rotear_pergunta("Quais os NCMs mais frequentes?", df, perfil).intencao == 'distribuição de NCMs'
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+from langchain_core.outputs import Generation, LLMResult
+
+import dataset_profile
+from llm_cost import MedidorTokens, OrcamentoExcedido, calcular_custo, estimar_custo_validacao
+
+
+def _resposta(entrada, saida):
+    return LLMResult(
+        generations=[[Generation(text='ok')]],
+        llm_output={'token_usage': {'prompt_tokens': entrada, 'completion_tokens': saida}},
+    )
+
+
+def test_acumula_tokens_entre_chamadas():
+    resumos = []
+    medidor = MedidorTokens(ao_atualizar=resumos.append)
+    for _ in range(3):
+        medidor.on_llm_start({}, ['prompt'])
+        medidor.on_llm_end(_resposta(1000, 200))
+    assert (medidor.chamadas, medidor.tokens_entrada, medidor.tokens_saida) == (3, 3000, 600)
+    assert medidor.custo_usd == pytest.approx(calcular_custo(3000, 600))
+    assert [r['chamadas'] for r in resumos] == [1, 2, 3]
+    assert not medidor.estimado
+
+
+def test_sem_uso_informado_estima_pelo_texto():
+    medidor = MedidorTokens()
+    medidor.on_llm_start({}, ['x' * 400])
+    medidor.on_llm_end(LLMResult(generations=[[Generation(text='y' * 80)]]))
+    assert (medidor.tokens_entrada, medidor.tokens_saida, medidor.estimado) == (100, 20, True)
+
+
+def test_orcamento_no_limite_passa_e_acima_interrompe():
+    # 1M de tokens de entrada no gpt-4o-mini custa exatamente US$ 0,15
+    medidor = MedidorTokens(orcamento_usd=0.30)
+    medidor.on_llm_start({}, ['prompt'])
+    medidor.on_llm_end(_resposta(1_000_000, 0))
+    medidor.on_llm_start({}, ['prompt'])
+    medidor.on_llm_end(_resposta(1_000_000, 0))  # Igual ao orçamento: ainda permitido
+    assert medidor.custo_usd == pytest.approx(0.30)
+    with pytest.raises(OrcamentoExcedido):
+        medidor.on_llm_end(_resposta(0, 1))
+    # A próxima chamada também é barrada antes de ir à API
+    with pytest.raises(OrcamentoExcedido):
+        medidor.on_llm_start({}, ['prompt'])
+
+
+class _Referencia:
+    def get_all_valid_ncms(self):
+        return ['23091000']
+
+
+def test_estimativa_usa_pares_unicos(monkeypatch):
+    monkeypatch.setattr(dataset_profile, 'get_ncm_reference', _Referencia)
+    unicos = pd.DataFrame({'ncm': ['23091000', '42010090'], 'descricao': ['Ração', 'Coleira']})
+    repetidos = pd.DataFrame({
+        'ncm': ['23091000', '2309.10.00', '42010090'] * 200,
+        'descricao': ['Ração', 'RAÇÃO ', 'Coleira'] * 200,
+    })
+    pares = dataset_profile.perfilar_dataset(unicos)['grupos_unicos']
+    assert pares == dataset_profile.perfilar_dataset(repetidos)['grupos_unicos'] == 2
+    assert estimar_custo_validacao(1000, pares) != estimar_custo_validacao(1000, len(repetidos))
+    assert estimar_custo_validacao(1000, pares)['tokens_saida'] < estimar_custo_validacao(1000, 3)['tokens_saida']
@@ -0,0 +1,32 @@
+from chart_cache import CacheGraficos
+from memory_cache import CacheLRU
+from report_cache import CacheRelatorios
+from snippet_cache import CacheSnippets
+
+
+def test_descarta_o_menos_usado():
+    cache = CacheLRU(max_itens=2)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obter('a') == 1  # 'a' passa a ser o mais recente
+    cache.guardar('c', 3)
+    assert cache.obter('b') is None
+    assert cache.obter('a') == 1 and cache.obter('c') == 3
+    assert len(cache) == 2
+    assert (cache.acertos, cache.falhas) == (3, 1)
+
+
+def test_regravar_atualiza_valor_e_uso():
+    cache = CacheLRU(max_itens=2)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    cache.guardar('a', 10)
+    cache.guardar('c', 3)
+    assert cache.obter('a') == 10
+    assert cache.obter('b') is None
+
+
+def test_caches_do_processo_compartilham_a_base():
+    for classe, limite in ((CacheSnippets, 512), (CacheGraficos, 64), (CacheRelatorios, 32)):
+        cache = classe()
+        assert isinstance(cache, CacheLRU) and cache.max_itens == limite
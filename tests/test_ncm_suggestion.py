@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from ncm_suggestion import NCMSuggestionEngine
+
+
+def _motor():
+    referencia = pd.DataFrame({
+        'NCM_normalizado': ['23091000', '42010090', '33051000', '95030099'],
+        'Produto/Descrição Exemplo': ['Ração para cães e gatos', 'Coleira para cachorro',
+                                      'Shampoo para pets', 'Brinquedo mordedor'],
+        'Categoria': ['Alimentos', 'Acessórios', 'Higiene', 'Brinquedos'],
+    })
+    return NCMSuggestionEngine(SimpleNamespace(df_reference=referencia))
+
+
+def test_sugere_o_ncm_mais_parecido_e_ordena_por_similaridade():
+    sugestoes = _motor().sugerir(['RACAO CAES ADULTOS 15KG', 'coleira de couro', 'RACAO CAES ADULTOS 15KG'], top_k=2)
+    # Descrições repetidas são pontuadas uma vez
+    assert len(sugestoes) == 4
+    primeira = sugestoes[sugestoes['rank'] == 1].set_index('descricao')
+    assert primeira.loc['RACAO CAES ADULTOS 15KG', 'ncm_sugerido'] == '23091000'
+    assert primeira.loc['coleira de couro', 'categoria'] == 'Acessórios'
+    for _, grupo in sugestoes.groupby('descricao'):
+        assert grupo['similaridade'].is_monotonic_decreasing
+
+
+def test_lotes_nao_mudam_o_resultado():
+    motor = _motor()
+    descricoes = ['ração gato', 'shampoo neutro', 'mordedor de borracha', 'coleira']
+    assert motor.sugerir(descricoes, tamanho_lote=1).equals(motor.sugerir(descricoes))
+
+
+def test_melhor_sugestao_filtra_pela_similaridade_minima():
+    melhor = _motor().melhor_sugestao(['shampoo para pets', 'xyz'], similaridade_minima=0.5)
+    assert melhor.index.tolist() == ['shampoo para pets']
+    assert melhor.loc['shampoo para pets', 'ncm_sugerido'] == '33051000'
+
+
+def test_sem_referencia_retorna_vazio():
+    motor = NCMSuggestionEngine(SimpleNamespace(df_reference=None))
+    assert motor.sugerir(['ração']).empty
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+from ncm_validation import validar_ncms
+
+
+def test_formato_e_referencia_por_linha():
+    ncms = pd.Series(['2309.10.00', '23091000', '9503-00-99', '123', None, 42010090, '2309100A'], index=list('abcdefg'))
+    resultado = validar_ncms(ncms, ['23091000', '42010090'])
+    assert resultado.index.equals(ncms.index)
+    assert resultado['NCM_normalizado'].tolist()[:4] == ['23091000', '23091000', '95030099', '123']
+    assert resultado['formato_valido'].tolist() == [True, True, True, False, False, True, False]
+    assert resultado['na_referencia'].tolist() == [True, True, False, False, False, True, False]
+
+
+def test_sem_referencia_e_serie_vazia():
+    assert not validar_ncms(pd.Series(['23091000']))['na_referencia'].any()
+    vazio = validar_ncms(pd.Series([], dtype=object), ['23091000'])
+    assert vazio.empty and vazio['formato_valido'].dtype == np.bool_
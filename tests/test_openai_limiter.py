@@ -0,0 +1,206 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+from openai_limiter import LimitedTransport, RateLimiter
+
+URL = "https://api.openai.test/v1/chat/completions"
+CORPO = b'{"model": "gpt-4o-mini", "max_tokens": 10}'
+
+
+class _Chunks(httpx.SyncByteStream):
+    """Corpo em streaming que só termina quando `liberar` é sinalizado"""
+
+    def __init__(self, chunks, liberar):
+        self.chunks = chunks
+        self.liberar = liberar
+
+    def __iter__(self):
+        yield self.chunks[0]
+        self.liberar.wait(5)
+        yield from self.chunks[1:]
+
+
+class _LimiterRegistrado(RateLimiter):
+    def __init__(self):
+        super().__init__(rpm=1_000_000, tpm=1_000_000_000)
+        self.pausas = []
+
+    def pausar(self, segundos):
+        self.pausas.append(segundos)
+        super().pausar(segundos)
+
+
+def _cliente(handler, **kwargs):
+    transporte = LimitedTransport(_LimiterRegistrado(), httpx.MockTransport(handler), **kwargs)
+    return httpx.Client(transport=transporte), transporte
+
+
+def _esperar(condicao, limite=5.0):
+    fim = time.monotonic() + limite
+    while not condicao():
+        assert time.monotonic() < fim, "condição não atingida"
+        time.sleep(0.005)
+
+
+def test_requisicoes_identicas_em_andamento_sao_unidas_em_streaming():
+    chamadas = []
+    entrou, liberar = threading.Event(), threading.Event()
+
+    def handler(request):
+        chamadas.append(request)
+        entrou.set()
+        return httpx.Response(200, stream=_Chunks([b'data: a\n\n', b'data: b\n\n'], liberar))
+
+    cliente, transporte = _cliente(handler)
+    corpos = {}
+
+    def enviar(nome):
+        with cliente.stream('POST', URL, content=CORPO) as response:
+            corpos[nome] = (response.status_code, b''.join(response.iter_bytes()))
+
+    lider = threading.Thread(target=enviar, args=('lider',))
+    lider.start()
+    assert entrou.wait(5)
+    seguidor = threading.Thread(target=enviar, args=('seguidor',))
+    seguidor.start()
+    _esperar(lambda: transporte.estatisticas['unidas'] == 1)
+    liberar.set()
+    lider.join(5)
+    seguidor.join(5)
+
+    assert len(chamadas) == 1
+    assert corpos['lider'] == corpos['seguidor'] == (200, b'data: a\n\ndata: b\n\n')
+    # Terminada a resposta, a mesma requisição volta a ir à API
+    liberar.set()
+    cliente.post(URL, content=CORPO)
+    assert len(chamadas) == 2
+
+
+def test_seguidor_falha_quando_stream_do_lider_e_interrompido():
+    entrou, liberar = threading.Event(), threading.Event()
+
+    def handler(request):
+        entrou.set()
+        return httpx.Response(200, stream=_Chunks([b'a', b'b'], liberar))
+
+    cliente, transporte = _cliente(handler)
+    resultado = {}
+
+    def seguir():
+        try:
+            cliente.post(URL, content=CORPO)
+        except httpx.ReadError as e:
+            resultado['erro'] = e
+
+    with cliente.stream('POST', URL, content=CORPO) as response:
+        assert entrou.wait(5)
+        seguidor = threading.Thread(target=seguir)
+        seguidor.start()
+        _esperar(lambda: transporte.estatisticas['unidas'] == 1)
+        next(response.iter_bytes())
+    # Saiu do bloco sem ler o resto: o líder fecha o stream incompleto
+    liberar.set()
+    seguidor.join(5)
+    assert 'erro' in resultado
+
+
+def test_requisicoes_com_corpos_diferentes_nao_sao_unidas():
+    chamadas = []
+
+    def handler(request):
+        chamadas.append(request.content)
+        return httpx.Response(200, json={'ok': True})
+
+    cliente, transporte = _cliente(handler)
+    cliente.post(URL, content=b'{"a": 1}')
+    cliente.post(URL, content=b'{"a": 2}')
+    assert len(chamadas) == 2
+    assert transporte.estatisticas['unidas'] == 0
+
+
+def test_429_repete_com_retry_after_e_pausa_o_limiter():
+    respostas = [
+        httpx.Response(429, headers={'retry-after': '0.01'}),
+        httpx.Response(503),
+        httpx.Response(200, json={'ok': True}),
+    ]
+
+    def handler(request):
+        return respostas.pop(0)
+
+    cliente, transporte = _cliente(handler, backoff_base=0.0)
+    response = cliente.post(URL, content=CORPO)
+
+    assert response.status_code == 200
+    assert transporte.estatisticas['repeticoes'] == 2
+    # Só o 429 pausa as demais threads, pelo Retry-After informado
+    assert transporte.limiter.pausas == [0.01]
+
+
+def test_ultima_tentativa_devolve_a_resposta_de_erro():
+    chamadas = []
+
+    def handler(request):
+        chamadas.append(request)
+        return httpx.Response(429, headers={'retry-after': '0'})
+
+    cliente, _ = _cliente(handler, max_tentativas=3, backoff_base=0.0)
+    assert cliente.post(URL, content=CORPO).status_code == 429
+    assert len(chamadas) == 3
+
+
+def test_falha_de_conexao_e_repetida_e_repassada_aos_seguidores():
+    entrou, liberar = threading.Event(), threading.Event()
+    chamadas = []
+
+    def handler(request):
+        chamadas.append(request)
+        entrou.set()
+        liberar.wait(5)
+        raise httpx.ConnectError("sem rede", request=request)
+
+    cliente, transporte = _cliente(handler, max_tentativas=2, backoff_base=0.0)
+    erros = []
+
+    def enviar():
+        try:
+            cliente.post(URL, content=CORPO)
+        except httpx.ConnectError as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=enviar)]
+    threads[0].start()
+    assert entrou.wait(5)
+    threads.append(threading.Thread(target=enviar))
+    threads[1].start()
+    _esperar(lambda: transporte.estatisticas['unidas'] == 1)
+    liberar.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(chamadas) == 2
+    assert len(erros) == 2
+
+
+def test_pausar_segura_a_proxima_aquisicao():
+    limiter = RateLimiter(rpm=1_000_000, tpm=1_000_000_000)
+    limiter.pausar(0.2)
+    limiter.pausar(0.05)  # pausa menor não encurta a que está valendo
+    inicio = time.monotonic()
+    limiter.adquirir(10)
+    assert time.monotonic() - inicio >= 0.19
+
+    inicio = time.monotonic()
+    limiter.adquirir(10)
+    assert time.monotonic() - inicio < 0.1
+
+
+def test_token_bucket_espera_pela_reposicao():
+    limiter = RateLimiter(rpm=600, tpm=1_000_000_000)  # 10 requisições por segundo
+    limiter.requisicoes.disponivel = 0
+    inicio = time.monotonic()
+    limiter.adquirir(1)
+    assert time.monotonic() - inicio == pytest.approx(0.1, abs=0.08)
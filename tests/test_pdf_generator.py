@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("reportlab")
+
+from pdf_generator import PDFReportGenerator, _PaginaTabela
+
+
+def _problemas(n):
+    return pd.DataFrame({
+        'NCM': [f"{23090000 + i % 7}" for i in range(n)],
+        'Produto': [f"Produto {i}" for i in range(n)],
+        'Severidade': ['BAIXA' if i % 10 else 'CRÍTICA' for i in range(n)],
+    })
+
+
+@pytest.fixture
+def tabelas(monkeypatch):
+    """Registra as linhas e as páginas de cada tabela longa montada"""
+    geradas = []
+    original = PDFReportGenerator._tabela_paginada
+
+    def registrar(self, dados, doc, altura):
+        elementos = original(self, dados, doc, altura)
+        geradas.append((dados, [e for e in elementos if isinstance(e, _PaginaTabela)]))
+        return elementos
+
+    monkeypatch.setattr(PDFReportGenerator, '_tabela_paginada', registrar)
+    return geradas
+
+
+def test_tabela_completa_lista_todos_os_mais_graves_primeiro(tabelas):
+    pdf = PDFReportGenerator().gerar_relatorio_pdf(3000, 7, 3000, 0.0, _problemas(3000))
+    assert pdf.startswith(b'%PDF')
+    (resumo, _), (lista, paginas) = tabelas
+    assert list(resumo.columns[:2]) == ['NCM', 'Problemas'] and resumo['Problemas'].sum() == 3000
+    assert len(lista) == 3000
+    assert (lista['Severidade'].head(300) == 'CRÍTICA').all()
+    # Páginas contíguas cobrindo todas as linhas, sem nenhuma Table retida depois do build
+    assert len(paginas) > 1
+    assert [p.inicio for p in paginas[1:]] == [p.fim for p in paginas[:-1]]
+    assert (paginas[0].inicio, paginas[-1].fim) == (0, 3000)
+    assert all(p._tabela is None for p in paginas)
+
+
+def test_poucos_problemas_sem_resumo(tabelas):
+    PDFReportGenerator().gerar_relatorio_pdf(10, 7, 10, 0.0, _problemas(10))
+    assert [len(dados) for dados, _ in tabelas] == [10]
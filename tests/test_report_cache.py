@@ -0,0 +1,21 @@
+from report_cache import CacheRelatorios, chave_relatorio
+
+
+def test_chave_depende_do_arquivo_e_da_resposta():
+    chave = chave_relatorio('fp1', 'resposta')
+    assert chave == chave_relatorio('fp1', 'resposta')
+    assert chave != chave_relatorio('fp2', 'resposta')
+    assert chave != chave_relatorio('fp1', 'outra resposta')
+    # O separador impede que partes diferentes formem a mesma chave
+    assert chave_relatorio('ab', 'c') != chave_relatorio('a', 'bc')
+
+
+def test_relatorio_reaproveitado_entre_reruns():
+    cache = CacheRelatorios(max_itens=2)
+    cache.guardar(chave_relatorio('fp1', 'r1'), {'pdf': b'1'})
+    cache.guardar(chave_relatorio('fp2', 'r2'), {'pdf': b'2'})
+    assert cache.obter(chave_relatorio('fp1', 'r1')) == {'pdf': b'1'}
+    cache.guardar(chave_relatorio('fp3', 'r3'), {'pdf': b'3'})
+    # Sai o relatório usado há mais tempo
+    assert cache.obter(chave_relatorio('fp2', 'r2')) is None
+    assert cache.obter(chave_relatorio('fp1', 'r1')) is not None
@@ -0,0 +1,61 @@
+import threading
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import sandbox_pool
+from sandbox_pool import SandboxPool
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(n_workers=1, limite_cpu_s=5, timeout_s=3.0)
+    yield pool
+    pool.encerrar()
+
+
+@pytest.fixture
+def caminho(pool):
+    return pool.publicar_dataset(pd.DataFrame({'ncm': ['23091000', '123'], 'valor': [1.0, 2.0]}), 'teste')
+
+
+def test_sessao_mantem_variaveis_no_worker(pool, caminho):
+    assert pool.executar("x = df['valor'].sum()", caminho, 'a') == ''
+    assert pool.executar("x * 2", caminho, 'a') == '6.0'
+    assert pool.executar("'x' in globals()", caminho, 'b') == 'False'
+
+
+def test_quem_esperava_o_worker_reiniciado_usa_o_novo(pool, caminho):
+    pool.executar("1", caminho, 'lenta')  # aquece o worker
+    saidas = {}
+
+    def rodar(sessao, codigo):
+        saidas[sessao] = pool.executar(codigo, caminho, sessao)
+
+    lenta = threading.Thread(target=rodar, args=('lenta', "import time\nwhile True: time.sleep(0.1)"))
+    lenta.start()
+    while not pool._locks[0].locked():
+        pass
+    espera = threading.Thread(target=rodar, args=('espera', "len(df)"))
+    espera.start()
+    lenta.join(30)
+    espera.join(30)
+
+    assert 'tempo limite' in saidas['lenta']
+    assert saidas['espera'] == '2'
+    assert pool.reinicios == 1
+
+
+def test_sessoes_antigas_sao_esquecidas(pool, caminho, monkeypatch):
+    monkeypatch.setattr(sandbox_pool, 'SESSOES_MANTIDAS', 2)
+    pool.executar("y = 1", caminho, 'a')
+    pool.executar("y = 2", caminho, 'b')
+    pool.executar("y = 3", caminho, 'c')
+
+    assert list(pool._sessoes) == ['b', 'c']
+    assert not any(sessao == 'a' for sessao, _ in pool._estados)
+    # O namespace de 'a' foi descartado no worker: ela recomeça do zero
+    assert pool.executar("'y' in globals()", caminho, 'a') == 'False'
+    assert pool.executar("y", caminho, 'c') == '3'
@@ -0,0 +1,55 @@
+import smtplib
+from email.message import EmailMessage
+
+from smtp_pool import PoolSMTP
+
+
+def _mensagem(destinatario):
+    msg = EmailMessage()
+    msg['From'] = 'relatorios@teste.com'
+    msg['To'] = destinatario
+    msg['Subject'] = 'Relatório'
+    msg.set_content('corpo')
+    return msg
+
+
+def _pool(servidor):
+    return PoolSMTP('127.0.0.1', servidor.porta, starttls=False, timeout=5)
+
+
+def test_sessao_reaproveitada_entre_envios(servidor_smtp):
+    pool = _pool(servidor_smtp)
+    assert pool.enviar_varios([_mensagem('a@x.com'), _mensagem('b@x.com')]) == [None, None]
+    pool.enviar(_mensagem('c@x.com'))
+    pool.fechar()
+    assert servidor_smtp.conexoes == 1 and pool.conexoes_abertas == 1
+    assert servidor_smtp.aceitas == ['a@x.com', 'b@x.com', 'c@x.com']
+
+
+def test_recusa_nao_interrompe_as_demais(servidor_smtp):
+    pool = _pool(servidor_smtp)
+    resultados = pool.enviar_varios([_mensagem('a@x.com'), _mensagem('recusado@x.com'), _mensagem('b@x.com')])
+    assert resultados[0] is None and resultados[2] is None
+    assert isinstance(resultados[1], smtplib.SMTPRecipientsRefused)
+
+
+def test_conexao_derrubada_e_reaberta(servidor_smtp):
+    servidor_smtp.mensagens_por_conexao = 2
+    pool = _pool(servidor_smtp)
+    resultados = pool.enviar_varios([_mensagem(f'{i}@x.com') for i in range(5)])
+    assert resultados == [None] * 5
+    assert servidor_smtp.aceitas == [f'{i}@x.com' for i in range(5)]
+    assert servidor_smtp.conexoes == 3
+
+
+def test_falha_ao_reconectar_preserva_as_ja_aceitas(servidor_smtp):
+    servidor_smtp.mensagens_por_conexao = 2
+    servidor_smtp.recusar_reconexao = True
+    pool = _pool(servidor_smtp)
+    resultados = pool.enviar_varios([_mensagem(f'{i}@x.com') for i in range(4)])
+
+    assert resultados[:2] == [None, None]
+    assert all(isinstance(r, OSError) for r in resultados[2:])
+    assert servidor_smtp.aceitas == ['0@x.com', '1@x.com']
+    # Sem sessão aberta para devolver ao pool
+    assert pool._livres == []
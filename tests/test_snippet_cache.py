@@ -0,0 +1,45 @@
+import pytest
+
+from snippet_cache import e_snippet_puro
+
+
+@pytest.mark.parametrize('codigo', [
+    "df.columns.tolist()",
+    "df['NCM'].value_counts().head(10)",
+    "df.groupby('NCM')['Descricao'].first()",
+    "print(len(df), sorted(df['NCM'].unique())[:5])",
+    "df[df['NCM'].astype(str).str.startswith('2309')].shape",
+    "df.fillna(0, inplace=False).describe()",
+    "{k: v for k, v in df['NCM'].value_counts().items() if v > 1}",
+])
+def test_leituras_sao_puras(codigo):
+    assert e_snippet_puro(codigo)
+
+
+@pytest.mark.parametrize('codigo', [
+    # Funções definidas pelo agente antes na sessão podem alterar o df
+    "f()",
+    "limpar(df)",
+    "df.pipe(limpar)",
+    "df.apply(ajustar, axis=1)",
+    "(lambda: df.drop(columns=['x'], inplace=True))()",
+    # inplace e atribuições
+    "df.drop(columns=['x'], inplace=True)",
+    "df.sort_values('NCM', inplace=1)",
+    "df.x = 1",
+    "df['x'] = 1",
+    "setattr(df, 'x', 1)",
+    "(y := df['NCM'])",
+    # Métodos que alteram ou gravam
+    "lista.append(1)",
+    "df.to_csv('saida.csv')",
+    "df.to_string(buf=open('saida.txt', 'w'))",
+    # E/S, sistema, aleatoriedade
+    "open('dados.csv').read()",
+    "os.listdir('.')",
+    "df.sample(5)",
+    "np.random.rand(3)",
+    "pd.read_csv('outro.csv')",
+])
+def test_chamadas_fora_da_lista_de_permissao_sao_impuras(codigo):
+    assert not e_snippet_puro(codigo)
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+import validation_diff
+
+from validation_diff import CORRIGIDO, MANTIDO, NOVO, REGRESSAO, REMOVIDO, LadoComparacao, comparar, lado_de_arquivo
+
+REFERENCIA = {'23091000', '42010090', '33051000'}
+
+
+def _lado(ncms, produtos, rotulo, por='produto'):
+    df = pd.DataFrame({'ncm': ncms, 'descricao': produtos, 'valor': [10.0] * len(ncms)})
+    return lado_de_arquivo(df, REFERENCIA, rotulo=rotulo, por=por)
+
+
+def _categorias(resultado):
+    return dict(zip(resultado.detalhes['Produto'], resultado.detalhes['Categoria']))
+
+
+def test_categorias_entre_arquivos():
+    antes = _lado(
+        ['2309', '42010090', '99999999', '33051000', '1234'],
+        ['Ração', 'Coleira', 'Brinquedo', 'Shampoo', 'Areia'], 'antes'
+    )
+    depois = _lado(
+        ['23091000', '4201', '99999999', '12345678'],
+        ['RAÇÃO ', 'Coleira', 'Brinquedo', 'Petisco'], 'depois'
+    )
+    resultado = comparar(antes, depois)
+    assert _categorias(resultado) == {
+        'RAÇÃO ': CORRIGIDO,  # descrição normalizada casa com 'Ração'
+        'Areia': REMOVIDO,
+        'Brinquedo': MANTIDO,
+        'Petisco': NOVO,
+        'Coleira': REGRESSAO,
+    }
+    resumo = resultado.resumo.set_index('Categoria')
+    assert resumo.loc[CORRIGIDO, 'Valor em Risco'] == 10.0
+    assert resumo['Produtos'].sum() == 5
+
+
+def test_lado_do_historico_nao_tem_regressao_nem_removido():
+    antes = LadoComparacao(pd.DataFrame({
+        'estabelecimento': [None, None], 'produto': ['Ração', 'Coleira'],
+        'ncm': ['2309', '42010090'], 'problema': ['Formato inválido', 'Divergente'], 'valor': [0.0, 0.0],
+    }), completo=False, rotulo='execução 1')
+    depois = _lado(['23091000', '4201', '1234'], ['Ração', 'Coleira', 'Areia'], 'depois')
+    assert _categorias(comparar(antes, depois)) == {'Ração': CORRIGIDO, 'Coleira': MANTIDO, 'Areia': NOVO}
+
+
+def test_por_linha_mantem_a_chave_com_o_ncm_corrigido():
+    antes = _lado(['2309', '42010090'], ['Ração', 'Coleira'], 'antes', por='linha')
+    depois = _lado(['23091000', '42010090'], ['Ração', 'Coleira'], 'depois', por='linha')
+    resultado = comparar(antes, depois, por='linha')
+    assert resultado.detalhes['Categoria'].tolist() == [CORRIGIDO]
+    with pytest.raises(ValueError):
+        comparar(_lado(['2309'], ['Ração'], 'a'), depois, por='linha')
+
+
+def test_diferenca_de_colunas_impede_a_chave_por_linha():
+    base = pd.DataFrame({'ncm': ['2309'], 'descricao': ['Ração'], 'valor': [10.0]})
+    assert validation_diff.diferenca_colunas(base, base.assign(ncm='23091000')) is None
+    # Colunas reordenadas e NCM com outro nome continuam compatíveis
+    reordenado = base.rename(columns={'ncm': 'NCM'})[['valor', 'NCM', 'descricao']]
+    assert validation_diff.diferenca_colunas(base, reordenado) is None
+    antes = _lado(['2309'], ['Ração'], 'antes', por='linha')
+    depois = lado_de_arquivo(reordenado.assign(NCM='23091000'), REFERENCIA, por='linha')
+    assert comparar(antes, depois, por='linha').detalhes['Categoria'].tolist() == [CORRIGIDO]
+
+    assert 'só no segundo: loja' in validation_diff.diferenca_colunas(base, base.assign(loja='A'))
+    assert 'tipos diferentes: valor (float64 × ' in validation_diff.diferenca_colunas(base, base.assign(valor='10,0'))
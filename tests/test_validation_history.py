@@ -0,0 +1,85 @@
+import pandas as pd
+
+from validation_history import HistoricoValidacoes, registrar_validacao
+
+
+def _relatorio(percentual):
+    return {
+        'total_produtos': 3,
+        'ncms_unicos': 2,
+        'ncms_problemas': 1,
+        'percentual_conformidade': percentual,
+        'problemas_df': pd.DataFrame({'NCM': ['2309.10.00'], 'Produto': ['Ração'], 'Problema': ['Divergente']}),
+    }
+
+
+def _df():
+    return pd.DataFrame({'ncm': ['23091000', '23091000', '42010090'], 'descricao': ['Ração', 'Ração', 'Coleira']})
+
+
+def test_revalidar_o_mesmo_arquivo_cria_nova_execucao(tmp_path):
+    historico = HistoricoValidacoes(str(tmp_path))
+    primeira = registrar_validacao(historico, _df(), None, _relatorio(66.7), 'vendas.csv', id_execucao='job-1')
+    segunda = registrar_validacao(historico, _df(), None, _relatorio(66.7), 'vendas.csv', id_execucao='job-2')
+    assert primeira is not None and segunda is not None and primeira != segunda
+    assert len(historico.execucoes()) == 2
+    assert len(historico.conformidade_no_tempo()) == 2
+    assert historico.ultima_execucao() == segunda
+
+
+def test_mesmo_job_nao_duplica(tmp_path):
+    historico = HistoricoValidacoes(str(tmp_path))
+    assert registrar_validacao(historico, _df(), None, _relatorio(66.7), id_execucao='job-1') is not None
+    assert registrar_validacao(historico, _df(), None, _relatorio(66.7), id_execucao='job-1') is None
+    assert len(historico.execucoes()) == 1
+
+
+def test_sem_id_cada_registro_e_uma_execucao(tmp_path):
+    historico = HistoricoValidacoes(str(tmp_path))
+    assert historico.ultima_execucao() is None
+    registrar_validacao(historico, _df(), None, _relatorio(66.7))
+    registrar_validacao(historico, _df(), None, _relatorio(66.7))
+    assert len(historico.execucoes()) == 2
+
+
+def _achados(*ncms):
+    return pd.DataFrame({'estabelecimento': '', 'ncm': list(ncms), 'produto': None, 'problema': None, 'severidade': None})
+
+
+def _metricas():
+    return [{'estabelecimento': '', 'total_produtos': 3, 'ncms_unicos': 2, 'ncms_problemas': 1,
+             'percentual_conformidade': 50.0}]
+
+
+def test_correcao_so_conta_no_mesmo_arquivo(tmp_path):
+    historico = HistoricoValidacoes(str(tmp_path))
+    dia = 86400
+    historico.registrar('1', 'fa', _metricas(), _achados('95030099'), 'lojas.csv', criada_em=1 * dia)
+    # Outro arquivo validado no meio, sem o NCM: não corrige nada em lojas.csv
+    historico.registrar('2', 'fb', _metricas(), _achados('23091000'), 'estoque.csv', criada_em=2 * dia)
+    correcoes = historico.tempo_ate_correcao().set_index(['arquivo', 'ncm'])
+    assert correcoes['corrigido_em'].isna().all()
+
+    historico.registrar('3', 'fa2', _metricas(), _achados(), 'lojas.csv', criada_em=4 * dia)
+    correcoes = historico.tempo_ate_correcao().set_index(['arquivo', 'ncm'])
+    assert correcoes.loc[('lojas.csv', '95030099'), 'dias_ate_correcao'] == 3.0
+    assert pd.isna(correcoes.loc[('estoque.csv', '23091000'), 'corrigido_em'])
+
+
+def test_migra_banco_sem_origem(tmp_path):
+    import sqlite3
+
+    with sqlite3.connect(tmp_path / 'historico.db') as db:
+        db.executescript(
+            "CREATE TABLE execucoes (id INTEGER PRIMARY KEY AUTOINCREMENT, chave TEXT NOT NULL UNIQUE, "
+            "fingerprint TEXT NOT NULL, arquivo TEXT, criada_em REAL NOT NULL, mes TEXT NOT NULL);"
+            "CREATE TABLE metricas (execucao_id INTEGER, estabelecimento TEXT, criada_em REAL, mes TEXT, "
+            "total_produtos INTEGER, ncms_unicos INTEGER, ncms_problemas INTEGER, percentual_conformidade REAL);"
+            "CREATE TABLE ncms_execucao (execucao_id INTEGER, estabelecimento TEXT, ncm TEXT, criada_em REAL, "
+            "mes TEXT, ocorrencias INTEGER);"
+            "INSERT INTO execucoes VALUES (1, 'k', 'fp', 'antigo.csv', 10, '1970-01');"
+            "INSERT INTO metricas VALUES (1, '', 10, '1970-01', 3, 2, 1, 50.0);"
+            "INSERT INTO ncms_execucao VALUES (1, '', '95030099', 10, '1970-01', 1);"
+        )
+    historico = HistoricoValidacoes(str(tmp_path))
+    assert historico.tempo_ate_correcao()['arquivo'].tolist() == ['antigo.csv']
@@ -1,46 +1,29 @@
 import streamlit as st
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pandas as pd
+from description_clustering import agrupar_descricoes, propagar_veredito
+from ncm_reference import get_ncm_reference
+from ncm_validation import validar_ncms
+from startup_profile import lazy_import
 
-def generate_plot(user_query, df):
+def generate_plot(user_query, perfil):
     """Gera gráficos relevantes baseados na query do usuário"""
-    
-    # Identificar coluna NCM
-    ncm_cols = [col for col in df.columns if 'ncm' in col.lower()]
-    
-    if "distribuição" in user_query.lower() or "gráfico" in user_query.lower():
-        if ncm_cols:
-            st.write("**📊 Gráfico: Distribuição de NCMs**")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            # Normaliza NCMs para agrupamento
-            ncm_normalized = df[ncm_cols[0]].astype(str).str.replace('.', '').str.replace('-', '')
-            ncm_counts = ncm_normalized.value_counts().head(10)
-            ncm_counts.plot(kind='bar', ax=ax, color='steelblue')
-            ax.set_title('Top 10 NCMs Mais Frequentes')
-            ax.set_xlabel('NCM')
-            ax.set_ylabel('Quantidade')
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            st.pyplot(fig)
-    
-    elif "valor" in user_query.lower() and ncm_cols:
-        valor_cols = [col for col in df.columns if 'valor' in col.lower() or 'total' in col.lower()]
-        if valor_cols:
-            st.write("**💰 Gráfico: Valores por NCM**")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            # Normaliza NCMs
-            df_temp = df.copy()
-            df_temp['NCM_norm'] = df_temp[ncm_cols[0]].astype(str).str.replace('.', '').str.replace('-', '')
-            # Agrupa por NCM e soma valores
-            grouped = df_temp.groupby('NCM_norm')[valor_cols[0]].sum().sort_values(ascending=False).head(10)
-            grouped.plot(kind='bar', ax=ax, color='green')
-            ax.set_title('Top 10 NCMs por Valor Total')
-            ax.set_xlabel('NCM')
-            ax.set_ylabel('Valor Total (R$)')
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            st.pyplot(fig)
+    # Gráficos saem do resumo por NCM já calculado no perfil, sem reprocessar o DataFrame
+    if not perfil or perfil.get('validacao') is None:
+        return
+
+    query = user_query.lower()
+    if "distribuição" in query or "gráfico" in query:
+        titulo, tipo = "**📊 Gráfico: Distribuição de NCMs**", 'distribuicao'
+    elif "valor" in query:
+        titulo, tipo = "**💰 Gráfico: Valores por NCM**", 'valor'
+    else:
+        return
+
+    # matplotlib só é carregado quando um gráfico é de fato pedido (e não está em cache)
+    imagem = lazy_import("chart_cache").grafico_ncm(perfil, tipo, top_n=10)
+    if imagem is not None:
+        st.write(titulo)
+        st.image(imagem, use_container_width=True)
 
 def quick_ncm_validation(df):
     """
@@ -64,12 +47,13 @@ def quick_ncm_validation(df):
     if desc_col:
         st.success(f"✅ Coluna Descrição encontrada: **{desc_col}**")
     
-    # Normaliza NCMs
+    # Normaliza e valida formato/referência
     df_temp = df.copy()
-    df_temp['NCM_normalizado'] = df_temp[ncm_col].astype(str).str.replace('.', '').str.replace('-', '').str.strip()
+    validacao = validar_ncms(df_temp[ncm_col], get_ncm_reference().get_all_valid_ncms())
+    df_temp['NCM_normalizado'] = validacao['NCM_normalizado']
     
     # Estatísticas básicas
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         total_registros = len(df_temp)
         st.metric("Total de Produtos", total_registros)
@@ -77,9 +61,13 @@ def quick_ncm_validation(df):
         ncms_unicos = df_temp['NCM_normalizado'].nunique()
         st.metric("NCMs Únicos", ncms_unicos)
     with col3:
-        ncms_validos = df_temp['NCM_normalizado'].str.len().eq(8).sum()
+        ncms_validos = validacao['formato_valido'].sum()
         perc_valido = (ncms_validos / total_registros * 100)
         st.metric("NCMs com 8 dígitos", f"{perc_valido:.1f}%")
+    with col4:
+        ncms_referencia = validacao['na_referencia'].sum()
+        perc_referencia = (ncms_referencia / total_registros * 100)
+        st.metric("Na Tabela de Referência", f"{perc_referencia:.1f}%")
     
     # Lista NCMs únicos
     st.write("### 📋 NCMs Encontrados")
@@ -96,7 +84,43 @@ def quick_ncm_validation(df):
         ncm_summary.columns = ['NCM', 'Quantidade']
     
     st.dataframe(ncm_summary, use_container_width=True)
-    
+
+    # Sugestões locais por similaridade de descrição (sem chamadas ao modelo)
+    if desc_col:
+        st.write("### 💡 Sugestões de NCM por Similaridade")
+
+        # Variações da mesma descrição ("RACAO GOLDEN 15KG", "Ração Golden 15 kg")
+        # formam um único grupo por NCM: cada grupo é pontuado uma vez e o
+        # resultado é replicado para todas as linhas membro
+        df_temp['cluster_id'] = agrupar_descricoes(df_temp[desc_col])['cluster_id']
+        df_temp['grupo'] = df_temp.groupby(['NCM_normalizado', 'cluster_id'], sort=False).ngroup()
+        representantes = df_temp.groupby('grupo')[desc_col].first().dropna()
+
+        pares_unicos = len(df_temp[['NCM_normalizado', desc_col]].drop_duplicates())
+        st.caption(f"{pares_unicos} pares (NCM, descrição) únicos agrupados em {len(representantes)} grupos")
+
+        engine = lazy_import("ncm_suggestion").get_suggestion_engine()
+        sugestoes = engine.melhor_sugestao(representantes, similaridade_minima=0.3)
+        veredito = representantes.to_frame('Produto').join(sugestoes, on='Produto', how='inner')
+
+        por_linha = propagar_veredito(df_temp['grupo'], veredito[['ncm_sugerido', 'categoria', 'similaridade']])
+        divergente = por_linha['ncm_sugerido'].notna() & (por_linha['ncm_sugerido'] != df_temp['NCM_normalizado'])
+
+        if not divergente.any():
+            st.write("_Nenhuma divergência relevante entre NCM informado e descrição_")
+        else:
+            divergentes = (
+                df_temp[divergente]
+                .groupby('grupo')
+                .agg(NCM=('NCM_normalizado', 'first'), Produto=(desc_col, 'first'), Linhas=(desc_col, 'size'))
+                .join(veredito[['ncm_sugerido', 'categoria', 'similaridade']])
+                .sort_values(['similaridade', 'Linhas'], ascending=False)
+                .head(50)
+            )
+            divergentes.columns = ['NCM Informado', 'Produto', 'Linhas', 'NCM Sugerido', 'Categoria', 'Similaridade']
+            st.warning(f"⚠️ {int(divergente.sum())} linhas com NCM divergente da descrição")
+            st.dataframe(divergentes, use_container_width=True, hide_index=True)
+
     # NCMs comuns do setor pet
     st.write("### ✅ NCMs Comuns no Setor Pet")
     ncms_corretos_pet = {
@@ -0,0 +1,265 @@
+"""
+Comparação entre duas validações (arquivos ou execuções do histórico): problemas corrigidos, novos, mantidos e regressões
+"""
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from dataset_profile import converter_valores, detectar_colunas
+from description_clustering import normalizar_descricoes
+from ncm_validation import validar_ncms
+
+CORRIGIDO = "Corrigido"
+NOVO = "Novo"
+MANTIDO = "Mantido"
+REGRESSAO = "Regressão"
+REMOVIDO = "Removido"
+
+# Ordem de exibição do resumo
+CATEGORIAS = [CORRIGIDO, REMOVIDO, MANTIDO, NOVO, REGRESSAO]
+
+_PROBLEMA_LOCAL = {False: 'Formato inválido', True: 'Fora da tabela de referência'}
+
+
+@dataclass
+class LadoComparacao:
+    """
+    Um dos lados da comparação, uma linha por produto/linha do arquivo
+
+    `dados` tem as colunas estabelecimento (ou None), produto, ncm, problema
+    (None = sem problema), valor e, para arquivos montados com `por='linha'`,
+    chave_linha. `completo`
+    indica se há também os produtos sem problema (arquivos) ou só os achados
+    (execuções do histórico).
+    """
+    dados: pd.DataFrame
+    completo: bool
+    rotulo: str
+
+
+def lado_de_arquivo(
+    df: pd.DataFrame,
+    ncms_referencia,
+    perfil: Optional[Dict] = None,
+    rotulo: str = "arquivo",
+    por: str = 'produto'
+) -> LadoComparacao:
+    """
+    Valida os NCMs do arquivo localmente (formato e tabela de referência) e monta o lado da comparação
+
+    Com `por='linha'` calcula também o hash de cada linha sem a coluna de NCM:
+    a mesma linha com o NCM corrigido mantém a chave.
+    """
+    colunas = perfil['colunas_detectadas'] if perfil else detectar_colunas(df)
+    col_ncm, col_desc = colunas['ncm'], colunas['descricao']
+    col_valor, col_est = colunas['valor'], colunas.get('estabelecimento')
+    if col_ncm is None:
+        raise ValueError(f"Nenhuma coluna de NCM em {rotulo}")
+
+    validacao = perfil.get('validacao') if perfil else None
+    if validacao is None:
+        validacao = validar_ncms(df[col_ncm], ncms_referencia)
+    ok = (validacao['formato_valido'] & validacao['na_referencia']).to_numpy()
+    problema = pd.Series(
+        np.where(ok, None, np.where(validacao['formato_valido'].to_numpy(), _PROBLEMA_LOCAL[True], _PROBLEMA_LOCAL[False])),
+        dtype=object
+    )
+
+    dados = pd.DataFrame({
+        'estabelecimento': df[col_est].astype(str).str.strip().to_numpy() if col_est else None,
+        'produto': df[col_desc].astype(str).to_numpy() if col_desc else None,
+        'ncm': validacao['NCM_normalizado'].to_numpy(),
+        'problema': problema,
+        'valor': converter_valores(df[col_valor]).fillna(0.0).to_numpy() if col_valor else 0.0,
+    })
+    if por == 'linha':
+        # Colunas em ordem alfabética: a mesma linha com as colunas reordenadas mantém a chave
+        sem_ncm = df.drop(columns=[col_ncm]).sort_index(axis=1)
+        dados['chave_linha'] = pd.util.hash_pandas_object(sem_ncm, index=False).to_numpy()
+    return LadoComparacao(dados, completo=True, rotulo=rotulo)
+
+
+def diferenca_colunas(df_a: pd.DataFrame, df_b: pd.DataFrame) -> Optional[str]:
+    """
+    Descreve por que os dois arquivos não podem ser comparados com `por='linha'` (None quando podem)
+
+    A chave por linha é o hash das colunas sem o NCM: os dois arquivos precisam
+    ter as mesmas colunas, com os mesmos tipos.
+    """
+    tipos = []
+    for df in (df_a, df_b):
+        col_ncm = detectar_colunas(df)['ncm']
+        tipos.append({col: str(tipo) for col, tipo in df.dtypes.items() if col != col_ncm})
+    tipos_a, tipos_b = tipos
+    so_a, so_b = sorted(set(tipos_a) - set(tipos_b)), sorted(set(tipos_b) - set(tipos_a))
+    if so_a or so_b:
+        partes = [f"só no primeiro: {', '.join(so_a)}" if so_a else "", f"só no segundo: {', '.join(so_b)}" if so_b else ""]
+        return "colunas diferentes (" + "; ".join(p for p in partes if p) + ")"
+    tipos_diferentes = [f"{col} ({tipos_a[col]} × {tipos_b[col]})" for col in sorted(tipos_a) if tipos_a[col] != tipos_b[col]]
+    if tipos_diferentes:
+        return "tipos diferentes: " + ", ".join(tipos_diferentes)
+    return None
+
+
+def lado_de_execucao(historico, execucao_id: int, rotulo: Optional[str] = None) -> LadoComparacao:
+    """Achados de uma execução do histórico (por loja, quando a execução foi dividida por estabelecimento)"""
+    from validation_history import GERAL
+
+    achados = historico.achados_execucao(execucao_id)
+    por_loja = achados['estabelecimento'] != GERAL
+    if por_loja.any():
+        achados = achados[por_loja]
+    else:
+        achados = achados.assign(estabelecimento=None)
+    dados = achados.assign(problema=achados['problema'].fillna('Problema apontado'), valor=0.0)[
+        ['estabelecimento', 'produto', 'ncm', 'problema', 'valor']
+    ].reset_index(drop=True)
+    return LadoComparacao(dados, completo=False, rotulo=rotulo or f"execução {execucao_id}")
+
+
+def _codigos(valores: pd.Series, normalizar=None) -> np.ndarray:
+    """Código inteiro de cada valor; a normalização roda uma vez por valor distinto"""
+    codigos, unicos = pd.factorize(valores.fillna('').astype(str))
+    if normalizar is None:
+        return codigos
+    normalizados, _ = pd.factorize(normalizar(pd.Series(unicos, dtype=object)))
+    return normalizados[codigos]
+
+
+def _chaves(antes: pd.DataFrame, depois: pd.DataFrame, por: str, com_estabelecimento: bool) -> np.ndarray:
+    """
+    Chave inteira de cada linha dos dois lados (linhas de `antes` primeiro)
+
+    Por produto: código da descrição normalizada combinado com o do
+    estabelecimento; por linha: hash da linha sem o NCM.
+    """
+    if por == 'linha':
+        return np.concatenate([antes['chave_linha'].to_numpy(), depois['chave_linha'].to_numpy()])
+    chaves = _codigos(pd.concat([antes['produto'], depois['produto']], ignore_index=True), normalizar_descricoes)
+    chaves = chaves.astype(np.int64)
+    if com_estabelecimento:
+        lojas = _codigos(pd.concat([antes['estabelecimento'], depois['estabelecimento']], ignore_index=True))
+        chaves = chaves * (int(lojas.max()) + 1) + lojas
+    return chaves
+
+
+def _por_chave(codigos: np.ndarray, dados: pd.DataFrame, n: int) -> Dict[str, np.ndarray]:
+    """Agrega as linhas de um lado por código inteiro da chave (sem groupby)"""
+    com_problema = dados['problema'].notna().to_numpy()
+    valor = dados['valor'].to_numpy(dtype=float)
+    presente = np.zeros(n, dtype=bool)
+    presente[codigos] = True
+    # Linha representativa de cada chave: uma com problema, se houver
+    linhas = np.arange(len(codigos))
+    representante = np.full(n, -1)
+    representante[codigos] = linhas
+    representante[codigos[com_problema]] = linhas[com_problema]
+    return {
+        'presente': presente,
+        'problema': np.bincount(codigos, weights=com_problema, minlength=n) > 0,
+        'valor_em_risco': np.bincount(codigos, weights=valor * com_problema, minlength=n),
+        'representante': representante,
+    }
+
+
+def _coluna_representante(dados: pd.DataFrame, coluna: str, representante: np.ndarray) -> np.ndarray:
+    valores = dados[coluna].to_numpy(dtype=object)
+    saida = np.full(len(representante), None, dtype=object)
+    existe = representante >= 0
+    saida[existe] = valores[representante[existe]]
+    return saida
+
+
+@dataclass
+class ResultadoComparacao:
+    resumo: pd.DataFrame
+    detalhes: pd.DataFrame
+    antes: str
+    depois: str
+
+
+def comparar(antes: LadoComparacao, depois: LadoComparacao, por: str = 'produto') -> ResultadoComparacao:
+    """
+    Compara os problemas de dois lados produto a produto (ou linha a linha)
+
+    As chaves dos dois lados são convertidas juntas em códigos inteiros
+    (`pd.factorize`) e cada lado é agregado por código com `np.bincount`: um
+    hash join vetorizado, linear no número de linhas.
+
+    Categorias de cada produto com problema em algum dos lados:
+        Corrigido: tinha problema antes e está presente, sem problema, depois
+            (para execuções do histórico: não aparece mais entre os achados)
+        Removido: tinha problema e não está mais no arquivo
+        Mantido: tem problema nos dois
+        Novo: tem problema depois e não existia antes
+        Regressão: existia sem problema antes e tem problema depois
+            (só detectável quando `antes` é um arquivo)
+
+    Args:
+        por: 'produto' (estabelecimento + descrição normalizada) ou 'linha'
+            (linha inteira sem o NCM; só entre dois arquivos com as mesmas colunas)
+
+    Returns:
+        Resumo (produtos e valor em risco por categoria) e detalhes por produto
+    """
+    if por == 'linha' and not ('chave_linha' in antes.dados and 'chave_linha' in depois.dados):
+        raise ValueError("Comparação por linha só entre dois arquivos montados com por='linha'")
+    if por == 'produto' and (antes.dados['produto'].isna().all() or depois.dados['produto'].isna().all()):
+        raise ValueError("Comparação por produto exige a coluna de descrição nos dois lados")
+    com_estabelecimento = antes.dados['estabelecimento'].notna().any() and depois.dados['estabelecimento'].notna().any()
+
+    codigos, unicos = pd.factorize(_chaves(antes.dados, depois.dados, por, com_estabelecimento))
+    n, n_antes = len(unicos), len(antes.dados)
+    a = _por_chave(codigos[:n_antes], antes.dados, n)
+    d = _por_chave(codigos[n_antes:], depois.dados, n)
+
+    if depois.completo:
+        corrigido = a['problema'] & d['presente'] & ~d['problema']
+        removido = a['problema'] & ~d['presente']
+    else:
+        corrigido = a['problema'] & ~d['problema']
+        removido = np.zeros(n, dtype=bool)
+    mantido = a['problema'] & d['problema']
+    if antes.completo:
+        regressao = d['problema'] & a['presente'] & ~a['problema']
+        novo = d['problema'] & ~a['presente']
+    else:
+        regressao = np.zeros(n, dtype=bool)
+        novo = d['problema'] & ~a['problema']
+
+    condicoes = [corrigido, removido, mantido, novo, regressao]
+    categoria = np.select(condicoes, [CORRIGIDO, REMOVIDO, MANTIDO, NOVO, REGRESSAO], default='')
+    # Valor em risco que saiu (corrigido/removido) ou que está em risco agora (demais)
+    valor = np.where(corrigido | removido, a['valor_em_risco'], d['valor_em_risco'])
+
+    selecionados = categoria != ''
+    rep_antes, rep_depois = a['representante'][selecionados], d['representante'][selecionados]
+
+    def depois_ou_antes(coluna: str) -> np.ndarray:
+        return np.where(
+            rep_depois >= 0,
+            _coluna_representante(depois.dados, coluna, rep_depois),
+            _coluna_representante(antes.dados, coluna, rep_antes),
+        )
+
+    detalhes = pd.DataFrame({
+        'Categoria': categoria[selecionados],
+        'Estabelecimento': depois_ou_antes('estabelecimento'),
+        'Produto': depois_ou_antes('produto'),
+        'NCM Antes': _coluna_representante(antes.dados, 'ncm', rep_antes),
+        'NCM Depois': _coluna_representante(depois.dados, 'ncm', rep_depois),
+        'Problema Antes': _coluna_representante(antes.dados, 'problema', rep_antes),
+        'Problema Depois': _coluna_representante(depois.dados, 'problema', rep_depois),
+        'Valor em Risco': valor[selecionados],
+    })
+    if not com_estabelecimento:
+        detalhes = detalhes.drop(columns='Estabelecimento')
+
+    resumo = pd.DataFrame({
+        'Categoria': CATEGORIAS,
+        'Produtos': [int(c.sum()) for c in condicoes],
+        'Valor em Risco': [float(valor[c].sum()) for c in condicoes],
+    })
+    return ResultadoComparacao(resumo, detalhes, antes.rotulo, depois.rotulo)
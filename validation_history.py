@@ -0,0 +1,346 @@
+"""
+Histórico de validações (SQLite indexado por mês e estabelecimento) e consultas de tendência
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from ncm_validation import normalizar_ncm
+
+DIRETORIO_HISTORICO = os.getenv(
+    "HISTORICO_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "historico")
+)
+
+# Linhas de métricas/achados com este estabelecimento valem para o arquivo inteiro
+GERAL = ""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS execucoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chave TEXT NOT NULL UNIQUE,
+    fingerprint TEXT NOT NULL,
+    arquivo TEXT,
+    criada_em REAL NOT NULL,
+    mes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_execucoes_data ON execucoes (criada_em);
+
+-- origem: nome do arquivo (ou fingerprint, sem nome); um NCM só conta como corrigido
+-- numa validação posterior do mesmo arquivo
+CREATE TABLE IF NOT EXISTS metricas (
+    execucao_id INTEGER NOT NULL REFERENCES execucoes (id),
+    estabelecimento TEXT NOT NULL,
+    origem TEXT NOT NULL DEFAULT '',
+    criada_em REAL NOT NULL,
+    mes TEXT NOT NULL,
+    total_produtos INTEGER NOT NULL,
+    ncms_unicos INTEGER NOT NULL,
+    ncms_problemas INTEGER NOT NULL,
+    percentual_conformidade REAL NOT NULL,
+    PRIMARY KEY (execucao_id, estabelecimento)
+);
+CREATE INDEX IF NOT EXISTS idx_metricas_mes ON metricas (mes, estabelecimento);
+CREATE INDEX IF NOT EXISTS idx_metricas_serie ON metricas (estabelecimento, criada_em);
+
+CREATE TABLE IF NOT EXISTS achados (
+    execucao_id INTEGER NOT NULL REFERENCES execucoes (id),
+    estabelecimento TEXT NOT NULL,
+    ncm TEXT NOT NULL,
+    produto TEXT,
+    problema TEXT,
+    severidade TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_achados_execucao ON achados (execucao_id, estabelecimento);
+
+-- Achados agregados por execução, estabelecimento e NCM: as tendências leem só esta tabela
+CREATE TABLE IF NOT EXISTS ncms_execucao (
+    execucao_id INTEGER NOT NULL REFERENCES execucoes (id),
+    estabelecimento TEXT NOT NULL,
+    origem TEXT NOT NULL DEFAULT '',
+    ncm TEXT NOT NULL,
+    criada_em REAL NOT NULL,
+    mes TEXT NOT NULL,
+    ocorrencias INTEGER NOT NULL,
+    PRIMARY KEY (execucao_id, estabelecimento, ncm)
+);
+CREATE INDEX IF NOT EXISTS idx_ncms_mes ON ncms_execucao (mes, estabelecimento);
+-- Cobre as consultas de tendência (não lê a tabela)
+CREATE INDEX IF NOT EXISTS idx_ncms_serie ON ncms_execucao (estabelecimento, ncm, criada_em, ocorrencias);
+"""
+
+# Criados depois da migração (bancos antigos ainda não têm a coluna origem)
+_INDICES_ORIGEM = """
+CREATE INDEX IF NOT EXISTS idx_metricas_origem ON metricas (estabelecimento, origem, criada_em);
+CREATE INDEX IF NOT EXISTS idx_ncms_origem ON ncms_execucao (estabelecimento, origem, ncm, criada_em);
+"""
+
+
+def _datas(segundos: pd.Series) -> pd.Series:
+    """Timestamps Unix no horário local (o mesmo de `mes`), sem frações de segundo"""
+    fuso = datetime.now().astimezone().tzinfo
+    return pd.to_datetime(segundos, unit='s', utc=True).dt.tz_convert(fuso).dt.tz_localize(None).dt.floor('s')
+
+
+def _coluna(df: pd.DataFrame, *termos: str) -> Optional[str]:
+    return next((c for c in df.columns if any(t in str(c).upper() for t in termos)), None)
+
+
+def normalizar_achados(problemas_df: Optional[pd.DataFrame], estabelecimento: str = GERAL) -> pd.DataFrame:
+    """Tabela de problemas (colunas variam conforme a resposta do agente) no formato do histórico"""
+    colunas = ['estabelecimento', 'ncm', 'produto', 'problema', 'severidade']
+    if problemas_df is None or problemas_df.empty:
+        return pd.DataFrame(columns=colunas)
+    col_ncm = _coluna(problemas_df, 'NCM')
+    if col_ncm is None:
+        return pd.DataFrame(columns=colunas)
+    col_prod = _coluna(problemas_df, 'PRODUTO', 'DESCRI')
+    col_prob = _coluna(problemas_df, 'PROBLEMA')
+    col_sev = _coluna(problemas_df, 'SEVERIDADE')
+    vazio = pd.Series(None, index=problemas_df.index, dtype=object)
+    return pd.DataFrame({
+        'estabelecimento': estabelecimento,
+        'ncm': normalizar_ncm(problemas_df[col_ncm]),
+        'produto': problemas_df[col_prod].astype(str) if col_prod else vazio,
+        'problema': problemas_df[col_prob].astype(str) if col_prob else vazio,
+        'severidade': problemas_df[col_sev].astype(str) if col_sev else vazio,
+    }, columns=colunas)
+
+
+class HistoricoValidacoes:
+    """
+    Guarda cada validação (métricas, achados e fingerprint do arquivo) para consultas de tendência
+
+    As tabelas são indexadas por (mes, estabelecimento) e por (estabelecimento,
+    data); as consultas de tendência usam só as métricas e a contagem de achados
+    por NCM de cada execução, nunca a lista completa de achados.
+
+    Args:
+        diretorio: Pasta do banco `historico.db`
+    """
+
+    def __init__(self, diretorio: str):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho_db = os.path.join(diretorio, "historico.db")
+        self._lock = threading.Lock()
+        with self._conectar() as db:
+            db.executescript(_SCHEMA)
+            self._migrar(db)
+            db.executescript(_INDICES_ORIGEM)
+
+    @staticmethod
+    def _migrar(db: sqlite3.Connection):
+        """Adiciona a coluna origem a bancos criados antes dela, preenchida a partir das execuções"""
+        for tabela in ('metricas', 'ncms_execucao'):
+            colunas = {linha[1] for linha in db.execute(f"PRAGMA table_info({tabela})")}
+            if 'origem' not in colunas:
+                db.execute(f"ALTER TABLE {tabela} ADD COLUMN origem TEXT NOT NULL DEFAULT ''")
+                db.execute(
+                    f"UPDATE {tabela} SET origem = (SELECT COALESCE(e.arquivo, e.fingerprint) FROM execucoes e "
+                    f"WHERE e.id = {tabela}.execucao_id)"
+                )
+
+    def _conectar(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.caminho_db, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def registrar(
+        self,
+        chave: str,
+        fingerprint: str,
+        metricas: List[Dict],
+        achados: pd.DataFrame,
+        arquivo: Optional[str] = None,
+        criada_em: Optional[float] = None
+    ) -> Optional[int]:
+        """
+        Registra uma execução
+
+        Args:
+            chave: Identifica a execução (ex.: id do job de validação); registrar a mesma
+                execução de novo não duplica, mas validar o mesmo arquivo outra vez cria outra
+            fingerprint: Fingerprint do conjunto de dados
+            metricas: Uma entrada por estabelecimento (`GERAL` para o arquivo inteiro) com
+                total_produtos, ncms_unicos, ncms_problemas e percentual_conformidade
+            achados: Saída de `normalizar_achados`
+            arquivo: Nome do arquivo enviado
+
+        Returns:
+            Id da execução, ou None se a execução já estava registrada
+        """
+        criada_em = time.time() if criada_em is None else criada_em
+        mes = datetime.fromtimestamp(criada_em).strftime('%Y-%m')
+        origem = arquivo or fingerprint
+        por_ncm = achados.groupby(['estabelecimento', 'ncm'], sort=False).size()
+
+        with self._lock, self._conectar() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO execucoes (chave, fingerprint, arquivo, criada_em, mes) VALUES (?, ?, ?, ?, ?)",
+                (chave, fingerprint, arquivo, criada_em, mes)
+            )
+            if not cursor.rowcount:
+                return None
+            execucao_id = cursor.lastrowid
+            db.executemany(
+                "INSERT INTO metricas (execucao_id, estabelecimento, origem, criada_em, mes, total_produtos, "
+                "ncms_unicos, ncms_problemas, percentual_conformidade) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(execucao_id, m['estabelecimento'], origem, criada_em, mes, int(m['total_produtos']),
+                  int(m['ncms_unicos']), int(m['ncms_problemas']), float(m['percentual_conformidade'])) for m in metricas]
+            )
+            db.executemany(
+                "INSERT INTO achados VALUES (?, ?, ?, ?, ?, ?)",
+                ((execucao_id, *linha) for linha in achados.itertuples(index=False, name=None))
+            )
+            db.executemany(
+                "INSERT INTO ncms_execucao (execucao_id, estabelecimento, origem, ncm, criada_em, mes, ocorrencias) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(execucao_id, est, origem, ncm, criada_em, mes, int(n)) for (est, ncm), n in por_ncm.items()]
+            )
+        return execucao_id
+
+    def ultima_execucao(self) -> Optional[int]:
+        """Id da execução mais recente (muda a cada registro: serve de chave de cache das consultas)"""
+        with self._conectar() as db:
+            return db.execute("SELECT MAX(id) FROM execucoes").fetchone()[0]
+
+    def _consultar(self, sql: str, parametros: tuple = ()) -> pd.DataFrame:
+        with self._conectar() as db:
+            return pd.read_sql_query(sql, db, params=parametros)
+
+    def execucoes(self, limite: int = 100) -> pd.DataFrame:
+        """Execuções mais recentes com as métricas do arquivo inteiro"""
+        return self._consultar(
+            "SELECT e.id, e.arquivo, e.fingerprint, e.criada_em, m.total_produtos, m.ncms_problemas, "
+            "m.percentual_conformidade FROM execucoes e JOIN metricas m ON m.execucao_id = e.id AND m.estabelecimento = ? "
+            "ORDER BY e.criada_em DESC LIMIT ?",
+            (GERAL, limite)
+        ).assign(criada_em=lambda d: _datas(d['criada_em']))
+
+    def achados_execucao(self, execucao_id: int) -> pd.DataFrame:
+        """Achados de uma execução (todos os estabelecimentos)"""
+        return self._consultar(
+            "SELECT estabelecimento, ncm, produto, problema, severidade FROM achados WHERE execucao_id = ?",
+            (execucao_id,)
+        )
+
+    def estabelecimentos(self) -> List[str]:
+        with self._conectar() as db:
+            linhas = db.execute(
+                "SELECT DISTINCT estabelecimento FROM metricas WHERE estabelecimento != ? ORDER BY 1", (GERAL,)
+            ).fetchall()
+        return [linha[0] for linha in linhas]
+
+    def conformidade_no_tempo(self, estabelecimento: str = GERAL, desde: Optional[float] = None) -> pd.DataFrame:
+        """Conformidade e problemas de cada execução, em ordem cronológica"""
+        return self._consultar(
+            "SELECT criada_em, total_produtos, ncms_problemas, percentual_conformidade FROM metricas "
+            "WHERE estabelecimento = ? AND criada_em >= ? ORDER BY criada_em",
+            (estabelecimento, desde or 0)
+        ).assign(criada_em=lambda d: _datas(d['criada_em']))
+
+    def ncms_recorrentes(
+        self,
+        estabelecimento: str = GERAL,
+        desde: Optional[float] = None,
+        limite: int = 20
+    ) -> pd.DataFrame:
+        """NCMs com problema em mais execuções: número de execuções, ocorrências e primeira/última vez"""
+        return self._consultar(
+            # Uma linha por (execução, estabelecimento, NCM): COUNT(*) conta execuções
+            "SELECT ncm, COUNT(*) AS execucoes, SUM(ocorrencias) AS ocorrencias, "
+            "MIN(criada_em) AS primeira_vez, MAX(criada_em) AS ultima_vez FROM ncms_execucao "
+            "WHERE estabelecimento = ? AND criada_em >= ? GROUP BY ncm "
+            "ORDER BY execucoes DESC, ocorrencias DESC LIMIT ?",
+            (estabelecimento, desde or 0, limite)
+        ).assign(
+            primeira_vez=lambda d: _datas(d['primeira_vez']),
+            ultima_vez=lambda d: _datas(d['ultima_vez']),
+        )
+
+    def tempo_ate_correcao(self, estabelecimento: str = GERAL, desde: Optional[float] = None) -> pd.DataFrame:
+        """
+        Para cada NCM com problema em cada arquivo: quando apareceu, quando deixou de aparecer e quantos dias levou
+
+        Um NCM conta como corrigido na primeira execução do mesmo arquivo (e
+        estabelecimento) posterior à última em que teve problema: validações
+        de outros arquivos no meio não contam. Sem essa execução, ainda está
+        em aberto (`corrigido_em` vazio).
+        """
+        tabela = self._consultar(
+            "SELECT n.origem AS arquivo, n.ncm, n.primeira_vez, n.ultima_vez, "
+            "(SELECT MIN(m.criada_em) FROM metricas m WHERE m.estabelecimento = n.estabelecimento "
+            " AND m.origem = n.origem AND m.criada_em > n.ultima_vez) AS corrigido_em "
+            "FROM (SELECT estabelecimento, origem, ncm, MIN(criada_em) AS primeira_vez, MAX(criada_em) AS ultima_vez "
+            "      FROM ncms_execucao WHERE estabelecimento = ? AND criada_em >= ? "
+            "      GROUP BY estabelecimento, origem, ncm) n "
+            "ORDER BY n.primeira_vez",
+            (estabelecimento, desde or 0)
+        )
+        tabela['dias_ate_correcao'] = ((tabela['corrigido_em'] - tabela['primeira_vez']) / 86400).round(1)
+        for coluna in ('primeira_vez', 'ultima_vez', 'corrigido_em'):
+            tabela[coluna] = _datas(tabela[coluna])
+        return tabela
+
+
+def registrar_validacao(
+    historico: HistoricoValidacoes,
+    df: pd.DataFrame,
+    perfil: Optional[Dict],
+    relatorio: Dict,
+    arquivo: Optional[str] = None,
+    id_execucao: Optional[str] = None
+) -> Optional[int]:
+    """
+    Grava no histórico o resultado de uma validação (sem chamadas ao Streamlit)
+
+    Com coluna de estabelecimento no arquivo, grava também as métricas e os
+    achados de cada loja (mesma divisão dos relatórios por estabelecimento).
+    Cada validação vira uma execução, mesmo quando o arquivo e a resposta se
+    repetem: a série de tendências mostra todas as revalidações.
+
+    Args:
+        id_execucao: Identificador da validação (id do job); None gera um novo
+    """
+    from dataset_profile import fingerprint_dataframe
+
+    fingerprint = perfil['fingerprint'] if perfil else fingerprint_dataframe(df)
+    metricas = [{
+        'estabelecimento': GERAL,
+        **{k: relatorio[k] for k in ('total_produtos', 'ncms_unicos', 'ncms_problemas', 'percentual_conformidade')}
+    }]
+    achados = [normalizar_achados(relatorio['problemas_df'])]
+
+    if perfil and perfil['colunas_detectadas'].get('estabelecimento'):
+        from establishment_reports import dividir_por_estabelecimento
+
+        for loja in dividir_por_estabelecimento(df, perfil, relatorio['problemas_df']):
+            metricas.append({
+                'estabelecimento': loja.estabelecimento,
+                'total_produtos': loja.total_produtos,
+                'ncms_unicos': loja.ncms_unicos,
+                'ncms_problemas': loja.ncms_problemas,
+                'percentual_conformidade': loja.percentual_conformidade,
+            })
+            achados.append(normalizar_achados(loja.problemas_df, loja.estabelecimento))
+
+    return historico.registrar(
+        id_execucao or uuid.uuid4().hex, fingerprint, metricas, pd.concat(achados, ignore_index=True), arquivo
+    )
+
+
+def existe_historico() -> bool:
+    """Se já há banco de histórico (sem abri-lo nem criá-lo)"""
+    return os.path.exists(os.path.join(DIRETORIO_HISTORICO, "historico.db"))
+
+
+@lru_cache(maxsize=1)
+def get_historico() -> HistoricoValidacoes:
+    """Histórico compartilhado pelo processo"""
+    return HistoricoValidacoes(DIRETORIO_HISTORICO)